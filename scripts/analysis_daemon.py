@@ -0,0 +1,76 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from instruction_matching import matchers
+from analysis_service import AnalysisService, bind_server, default_socket_path, log
+
+# Worker processes import this script as a module, so it only runs when executed
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Daemon keeping instruction definitions and analyzers loaded, answering analysis requests from query_analysis_daemon.py over a Unix domain socket.")
+
+    parser.add_argument("--socket", help="Unix domain socket to listen on", type=str, default=default_socket_path)
+    parser.add_argument("-d", "--definitions", help="The file containing instruction definitions. Should be a .csv file. It's reloaded when it changes", default="instructions_fixed.csv")
+    parser.add_argument("--compiled-definitions", help="Compiled definitions file from compile_definitions.py, used instead of the .csv file when up to date. Defaults to the definitions file with a .bin extension", type=str)
+    parser.add_argument("--workers", help="Number of worker processes analyzing binaries. Requests are answered concurrently and share them", type=int, default=os.cpu_count())
+    parser.add_argument("--objdump-location", help="Location of object dump command to use", type=str)
+    parser.add_argument("--memo-size", help="Maximum number of resolved instruction encodings each worker remembers. 0 disables the memo", type=int, default=65536)
+    parser.add_argument("--matcher", help="Engine used to match instruction bytes against candidate definitions", choices=sorted(matchers), default='trie')
+    parser.add_argument("--result-cache", help="SQLite file caching results by build-id or content hash, so unchanged binaries aren't disassembled again", type=str)
+    parser.add_argument("-v", "--verbose", help="Log every request", action='store_true')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.definitions):
+        print(f"Definitions file {args.definitions} doesn't exist or is a directory!")
+        sys.exit(0)
+
+    if args.workers < 1:
+        print("At least one worker is needed!")
+        sys.exit(1)
+
+    # Relative paths are resolved now, requests name absolute paths anyway
+    definitions_file = os.path.abspath(args.definitions)
+    compiled_definitions_file = args.compiled_definitions
+    if compiled_definitions_file is None:
+        compiled_definitions_file = os.path.splitext(definitions_file)[0]+'.bin'
+    compiled_definitions_file = os.path.abspath(compiled_definitions_file)
+
+    if args.objdump_location is None:
+        objdump_location = subprocess.check_output(['which', 'objdump']).decode().strip()
+    else:
+        objdump_location = args.objdump_location
+
+    settings = {
+        'matcher': args.matcher,
+        'memo_size': args.memo_size,
+        'objdump_location': objdump_location,
+    }
+
+    try:
+        service = AnalysisService(definitions_file, compiled_definitions_file, args.workers, settings,
+                                  result_cache_file=args.result_cache, verbose=args.verbose)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    try:
+        server = bind_server(args.socket, service)
+    except RuntimeError as e:
+        service.close()
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    # Stop on SIGTERM like on Ctrl-C, removing the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    log(f"Listening on {args.socket} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        service.close()
+        log("Stopped")
@@ -0,0 +1,390 @@
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from instruction_definitions import load_definitions, load_compiled_definitions
+from disassembly import objdump_disassemble, elf_disassemble
+from extension_analysis import ExtensionAnalyzer, print_report, print_functions, print_unsupported, check_policy, print_violation
+from batch_analysis import find_binaries, analyze_binary, BatchSummary
+from result_cache import ResultCache, binary_key, analysis_fingerprint
+from cpu_policy import parse_allowed
+
+default_socket_path = os.path.join(os.path.expanduser('~'), '.cache', 'binx86ext', 'daemon.sock')
+
+# Requests are one JSON line: {"paths": [...], "options": {...}, "format": "text" or
+# "ndjson"}. The response is JSON lines as well. ndjson requests get the records of
+# JsonReporter and text requests get {"type": "text", "text": ...} records with the
+# output of get_extension_requirements.py. A request which can't be served gets an
+# {"type": "error", "error": ...} record. The last record is always
+# {"type": "status", "status": ...}, the exit status get_extension_requirements.py
+# would have had.
+
+# Send an analysis request to a daemon, yielding the records of its response
+def request_analysis(socket_path, paths, options, output_format='text'):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        request = {'paths': paths, 'options': options, 'format': output_format}
+        sock.sendall((json.dumps(request)+'\n').encode())
+        with sock.makefile('r', encoding='utf-8') as response:
+            for line in response:
+                yield json.loads(line)
+
+# Load instruction definitions, preferring an up to date compiled definitions file
+def load_preferred_definitions(definitions_file, compiled_definitions_file):
+    if os.path.isfile(compiled_definitions_file):
+        try:
+            definitions_raw = load_compiled_definitions(compiled_definitions_file, definitions_file)
+            if definitions_raw is not None:
+                return definitions_raw
+        except RuntimeError:
+            pass
+    return load_definitions(definitions_file)
+
+# Modification time and size of a file, None when it doesn't exist
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Per request analysis options. Requests name them like get_extension_requirements.py's
+# options, with allow holding the --allow values.
+class AnalysisOptions(object):
+    __slots__ = ('careful', 'full_stats', 'functions', 'instruction_hits', 'allowed', 'disassembler')
+
+    def __init__(self, careful=False, full_stats=False, functions=False, instruction_hits=False, allowed=None, disassembler='objdump'):
+        self.careful = careful
+        self.full_stats = full_stats
+        self.functions = functions
+        self.instruction_hits = instruction_hits
+        self.allowed = allowed
+        self.disassembler = disassembler
+
+    # Parse the options of a request. Raises ValueError for invalid ones.
+    @staticmethod
+    def from_request(options, known_extensions):
+        unknown = set(options)-{'careful', 'full_stats', 'functions', 'instruction_hits', 'allow', 'disassembler'}
+        if len(unknown) != 0:
+            raise ValueError(f"Unknown options {', '.join(sorted(unknown))}")
+        disassembler = options.get('disassembler', 'objdump')
+        if disassembler not in ['objdump', 'builtin']:
+            raise ValueError(f"Unknown disassembler {disassembler}")
+        allowed = None
+        if options.get('allow') is not None:
+            try:
+                allowed = frozenset(parse_allowed(options['allow'], known_extensions))
+            except RuntimeError as e:
+                raise ValueError(str(e))
+        return AnalysisOptions(bool(options.get('careful', False)), bool(options.get('full_stats', False)),
+                               bool(options.get('functions', False)), bool(options.get('instruction_hits', False)),
+                               allowed, disassembler)
+
+# Definitions and settings of the worker processes. They're set before the pool is
+# created and inherited by forking, like batch_analysis does, so definition hashes
+# agree with the daemon's. Every worker keeps an analyzer for careful and one for
+# default analysis, so their memos stay warm between requests. Careful analysis fills
+# its memo with the trivial encodings default analysis skips. Options which only
+# change what's recorded are set on the analyzer for each binary, as a worker analyzes
+# one binary at a time.
+_worker_definitions = None
+_worker_settings = None
+_worker_analyzers = {}
+
+def _worker_analyzer(careful):
+    analyzer = _worker_analyzers.get(careful)
+    if analyzer is None:
+        analyzer = ExtensionAnalyzer(_worker_definitions, matcher=_worker_settings['matcher'], careful=careful,
+                                     memo_size=_worker_settings['memo_size'])
+        _worker_analyzers[careful] = analyzer
+    return analyzer
+
+# Submitted once per worker when the pool is started, so every worker is forked and
+# has its default analyzer built before the first request
+def _start_worker():
+    _worker_analyzer(False)
+
+def analyze_request_binary(input_file, options):
+    analyzer = _worker_analyzer(options.careful)
+    analyzer.full_stats = options.full_stats
+    analyzer.allowed = options.allowed
+    analyzer.record_hits = options.instruction_hits
+    analyzer.attribute_functions = options.functions
+    if options.disassembler == 'builtin':
+        disassemble = elf_disassemble
+    else:
+        disassemble = functools.partial(objdump_disassemble, objdump_location=_worker_settings['objdump_location'])
+    return analyze_binary(input_file, analyzer, disassemble)
+
+# Daemon messages go to stderr, stdout is redirected while reports are rendered
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+# The state of a daemon: the loaded definitions and the pool of worker processes
+# analyzing binaries for every request. settings holds the matcher, memo_size and
+# objdump_location the workers' analyzers use.
+class AnalysisService(object):
+    def __init__(self, definitions_file, compiled_definitions_file, workers, settings, result_cache_file=None, verbose=False):
+        self.definitions_file = definitions_file
+        self.compiled_definitions_file = compiled_definitions_file
+        self.workers = workers
+        self.settings = settings
+        self.result_cache_file = result_cache_file
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        # Notified when the last request being answered finishes and when a reload is done
+        self._idle = threading.Condition(self._lock)
+        self._active_requests = 0
+        self._reloading = False
+        # Rendering text reports redirects stdout, which is shared by every thread
+        self._render_lock = threading.Lock()
+        self._pool = None
+        self._failed_stamp = None
+        stamp = self._definitions_stamp()
+        self._start_pool(load_preferred_definitions(self.definitions_file, self.compiled_definitions_file), stamp)
+
+    def _definitions_stamp(self):
+        return (file_stamp(self.definitions_file), file_stamp(self.compiled_definitions_file))
+
+    # Start a pool of workers using the given definitions. Forking isn't safe while other
+    # threads run, they may hold locks the workers would inherit held, so this is only
+    # done before serving and while check_reload holds requests off.
+    def _start_pool(self, definitions_raw, stamp):
+        global _worker_definitions, _worker_settings
+        _worker_definitions = definitions_raw
+        _worker_settings = self.settings
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        # Fork every worker now rather than when requests submit binaries
+        for future in [pool.submit(_start_worker) for _ in range(self.workers)]:
+            future.result()
+        self.definitions_raw = definitions_raw
+        self.known_extensions = set(extension for definition in definitions_raw.values() for extension in definition.cpuid)
+        self._pool = pool
+        self._stamp = stamp
+        log(f"Loaded {len(definitions_raw)} definitions from {self.definitions_file}")
+
+    # Reload the definitions if their files changed. A failed reload, like of a file
+    # caught half written, keeps the current definitions until they change again. New
+    # requests wait while the ones being answered finish and the old pool shuts down,
+    # so no other thread runs when the new workers are forked.
+    def check_reload(self):
+        stamp = self._definitions_stamp()
+        if stamp == self._stamp or stamp == self._failed_stamp:
+            return
+        try:
+            definitions_raw = load_preferred_definitions(self.definitions_file, self.compiled_definitions_file)
+        except Exception as e:
+            self._failed_stamp = stamp
+            log(f"WARNING: Couldn't reload definitions: {type(e).__name__}: {e}")
+            return
+        with self._lock:
+            self._reloading = True
+            while self._active_requests != 0:
+                self._idle.wait()
+        try:
+            self._pool.shutdown(wait=True)
+            self._start_pool(definitions_raw, stamp)
+        finally:
+            with self._lock:
+                self._reloading = False
+                self._idle.notify_all()
+
+    # Context of answering a request, which waits for a reload to finish first
+    @contextlib.contextmanager
+    def answering(self):
+        with self._lock:
+            while self._reloading:
+                self._idle.wait()
+            self._active_requests += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_requests -= 1
+                if self._active_requests == 0:
+                    self._idle.notify_all()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _render(self, function, *function_args):
+        output = io.StringIO()
+        with self._render_lock, contextlib.redirect_stdout(output):
+            function(*function_args)
+        return output.getvalue()
+
+    # Answer a request, passing each response record to emit. Called within answering().
+    def handle(self, request, emit):
+        (definitions_raw, known_extensions, pool) = (self.definitions_raw, self.known_extensions, self._pool)
+
+        paths = request.get('paths') if isinstance(request, dict) else None
+        output_format = request.get('format', 'text') if isinstance(request, dict) else None
+        if not isinstance(paths, list) or len(paths) == 0 or output_format not in ['text', 'ndjson']:
+            emit({'type': 'error', 'error': "Requests need a list of paths and a format of text or ndjson"})
+            emit({'type': 'status', 'status': 1})
+            return
+        try:
+            options = AnalysisOptions.from_request(request.get('options', {}), known_extensions)
+        except ValueError as e:
+            emit({'type': 'error', 'error': str(e)})
+            emit({'type': 'status', 'status': 1})
+            return
+        missing = [path for path in paths if not os.path.exists(path)]
+        if len(missing) != 0:
+            emit({'type': 'error', 'error': f"Input files {', '.join(missing)} don't exist"})
+            emit({'type': 'status', 'status': 1})
+            return
+        binaries = find_binaries(paths)
+        if len(binaries) == 0:
+            emit({'type': 'error', 'error': "No 64 bit x86 ELF files among the inputs"})
+            emit({'type': 'status', 'status': 1})
+            return
+        if self.verbose:
+            log(f"Analyzing {len(binaries)} binaries")
+
+        reporter = None
+        if output_format == 'ndjson':
+            from json_report import JsonReporter
+            reporter = JsonReporter(RecordStream(emit), 'ndjson', definitions_raw)
+
+        summary = BatchSummary()
+        def report_binary(input_file, result, output, error):
+            summary.add(input_file, result, error)
+            if reporter is not None:
+                reporter.binary(input_file, result, error)
+                return
+            def render():
+                if len(binaries) > 1:
+                    print(f"== {input_file} ==")
+                print(output, end='')
+                if error is None and result.violation is not None:
+                    print_violation(result)
+                elif error is None:
+                    print_report(result, definitions_raw, options.full_stats)
+                    print_functions(result)
+                    if len(binaries) == 1 and options.allowed is not None:
+                        print("All required extensions are allowed")
+                    print_unsupported(result.unsupported_inst_encounters)
+                else:
+                    print(f"ERROR: {error}")
+            emit({'type': 'text', 'text': self._render(render)})
+
+        # Answer from the result cache where possible, like get_extension_requirements.py
+        result_cache = None
+        binary_keys = {}
+        if self.result_cache_file is not None:
+            result_cache = ResultCache(self.result_cache_file)
+            fingerprint = analysis_fingerprint(self.definitions_file, options.disassembler, options.careful)
+        futures = []
+        try:
+            for input_file in binaries:
+                if result_cache is not None:
+                    binary_keys[input_file] = binary_key(input_file)
+                    result = result_cache.lookup(binary_keys[input_file], fingerprint, input_file, definitions_raw,
+                                                 options.full_stats, options.functions)
+                    if result is not None:
+                        if options.allowed is not None:
+                            check_policy(result, options.allowed)
+                        report_binary(input_file, result, '', None)
+                        continue
+                futures.append(pool.submit(analyze_request_binary, input_file, options))
+            for future in as_completed(futures):
+                (input_file, result, output, error) = future.result()
+                if result_cache is not None and error is None and result.violation is None:
+                    result_cache.store(binary_keys[input_file], fingerprint, result, definitions_raw, options.full_stats)
+                report_binary(input_file, result, output, error)
+        finally:
+            for future in futures:
+                future.cancel()
+            if result_cache is not None:
+                result_cache.close()
+
+        if len(binaries) > 1:
+            if reporter is not None:
+                reporter.summary(summary)
+            else:
+                def render_summary():
+                    print("== Summary ==")
+                    summary.print()
+                    print_unsupported(summary.unsupported_inst_encounters)
+                emit({'type': 'text', 'text': self._render(render_summary)})
+        emit({'type': 'status', 'status': 2 if len(summary.violations) != 0 else (1 if len(summary.failed) != 0 else 0)})
+
+# A stream JsonReporter writes records to, passing each on as a decoded record
+class RecordStream(object):
+    def __init__(self, emit):
+        self._emit = emit
+
+    def write(self, text):
+        for line in text.splitlines():
+            self._emit(json.loads(line))
+
+    def flush(self):
+        pass
+
+class AnalysisRequestHandler(socketserver.StreamRequestHandler):
+    # Seconds a client has to send its request, as reloads wait on requests being read
+    request_timeout = 10
+
+    def handle(self):
+        service = self.server.service
+        with service.answering():
+            self.connection.settimeout(self.request_timeout)
+            try:
+                request = json.loads(self.rfile.readline())
+            except ValueError:
+                request = None
+            except OSError:
+                return
+            self.connection.settimeout(None)
+            def emit(record):
+                self.wfile.write((json.dumps(record)+'\n').encode())
+            try:
+                service.handle(request, emit)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away, its remaining binaries were cancelled
+                pass
+
+# Serves requests on a Unix domain socket, each in its own thread. Definitions are
+# checked for changes on the serving thread by service_actions, which serve_forever
+# calls after accepting each connection and every poll_interval seconds without one,
+# so changes are noticed however busy the daemon is. The reload itself waits for the
+# requests being answered, so a long request delays it while new ones wait.
+class AnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        socketserver.UnixStreamServer.__init__(self, socket_path, AnalysisRequestHandler)
+
+    def service_actions(self):
+        self.service.check_reload()
+
+# Create the server socket. A socket file left behind by a daemon which is no longer
+# running is replaced. Raises RuntimeError if another daemon is listening on it.
+def bind_server(socket_path, service):
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError(f"Another daemon is listening on {socket_path}")
+    # Only this user may send requests
+    old_umask = os.umask(0o177)
+    try:
+        return AnalysisServer(socket_path, service)
+    finally:
+        os.umask(old_umask)
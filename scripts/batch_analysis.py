@@ -0,0 +1,414 @@
+import asyncio
+import contextlib
+import io
+import locale
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import struct
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from elf import is_elf_x86_64
+from disassembly import objdump_command, parse_objdump_output
+from scan_profile import children_cpu_time
+
+# Find the 64 bit x86 ELF files among a list of files and directories. Directories
+# are walked recursively without following symlinked directories, and files reached
+# through several links are only returned once. Files are ordered largest first so
+# the longest scans start earliest.
+def find_binaries(paths):
+    binaries = {}
+
+    def add(path):
+        real_path = os.path.realpath(path)
+        if real_path in binaries or not os.path.isfile(real_path):
+            return
+        if is_elf_x86_64(real_path):
+            binaries[real_path] = os.path.getsize(real_path)
+
+    for path in paths:
+        if os.path.isdir(path):
+            for (dir_path, _, file_names) in os.walk(path):
+                for file_name in file_names:
+                    add(os.path.join(dir_path, file_name))
+        else:
+            add(path)
+
+    return sorted(binaries, key=lambda binary: (-binaries[binary], binary))
+
+# Read the paths listed one per line in a file, or on stdin for '-'
+def read_file_list(file_list):
+    if file_list == '-':
+        return [line.strip() for line in sys.stdin if line.strip() != '']
+    with open(file_list, 'r') as list_file:
+        return [line.strip() for line in list_file if line.strip() != '']
+
+# Analyzer and disassembler of the worker processes. They're set before the pool is
+# created and inherited by forking, so the definitions are only loaded once.
+_worker_analyzer = None
+_worker_disassemble = None
+
+# Analyze one binary, capturing anything printed along the way. Returns the path, the
+# result or None, the captured output and an error message if the analysis failed.
+# The worker's analyzer and disassembler are used unless others are given.
+def analyze_binary(input_file, analyzer=None, disassemble=None):
+    if analyzer is None:
+        analyzer = _worker_analyzer
+    if disassemble is None:
+        disassemble = _worker_disassemble
+    output = io.StringIO()
+    result = None
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            result = analyzer.analyze_file(input_file, disassemble)
+            if result is None:
+                error = "Unsupported file"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return (input_file, result, output.getvalue(), error)
+
+# analyze_binary in a worker process. The wins the worker's adaptive matcher counted
+# since its previous binary go back with the result, or with the next one to succeed.
+def _worker_analyze_binary(input_file, disassemble=None):
+    (input_file, result, output, error) = analyze_binary(input_file, disassemble=disassemble)
+    if result is not None and hasattr(_worker_analyzer.matcher, 'take_new_wins'):
+        result.strategy_wins = _worker_analyzer.matcher.take_new_wins()
+    return (input_file, result, output, error)
+
+# Merge the strategy wins a worker handed back into the batch's analyzer, whose
+# matcher saves them
+def _merge_strategy_wins(analyzer, result):
+    if result is not None and result.strategy_wins is not None:
+        analyzer.matcher.merge_wins(result.strategy_wins)
+        result.strategy_wins = None
+
+# Analyze a list of binaries in a pool of processes, yielding the analyze_binary
+# tuple of each binary as it finishes. Binaries are submitted in the order given.
+def analyze_binaries(binaries, analyzer, disassemble, processes):
+    global _worker_analyzer, _worker_disassemble
+    _worker_analyzer = analyzer
+    _worker_disassemble = disassemble
+
+    if processes <= 1:
+        for input_file in binaries:
+            yield analyze_binary(input_file)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = [executor.submit(_worker_analyze_binary, input_file) for input_file in binaries]
+        try:
+            for future in as_completed(futures):
+                (input_file, result, output, error) = future.result()
+                _merge_strategy_wins(analyzer, result)
+                yield (input_file, result, output, error)
+        finally:
+            for future in futures:
+                future.cancel()
+
+# Frames between analyze_binaries_async and its workers: a kind byte, the payload length
+# and the payload
+frame_header = struct.Struct('<cI')
+
+def _frame(kind, payload=b''):
+    return frame_header.pack(kind, len(payload))+payload
+
+# objdump output is sent to workers in chunks of whole lines of about this size, and
+# up to this many chunks are held while its worker catches up
+chunk_size = 1 << 18
+queued_chunks = 32
+
+# Worker process of analyze_binaries_async. A binary arrives as a B frame with its path,
+# then its objdump output as D frames of whole lines, ended by an E frame, an F frame
+# with objdump's exit status when it failed or an A frame when the batch gave up on it.
+# The output is parsed and analyzed as it arrives, and the analyze_binary tuple is sent
+# back in an R frame as soon as it's done, skipping the rest of the binary's frames.
+# SIGALRM interrupts an analysis after timeout seconds. It's held off while frames are
+# read, so none is ever read partially.
+def _stream_worker(sock, inherited_socks, objdump_location, timeout):
+    for inherited_sock in inherited_socks:
+        inherited_sock.close()
+    # Ctrl-C is handled by the batch, which then stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    def interrupt(signum, frame):
+        raise TimeoutError(f"Timed out after {timeout} seconds")
+    signal.signal(signal.SIGALRM, interrupt)
+    encoding = locale.getpreferredencoding(False)
+    frames = sock.makefile('rb')
+    # Whether every frame of the current binary was read
+    ended = True
+
+    def read_frame():
+        nonlocal ended
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+        try:
+            header = frames.read(frame_header.size)
+            if len(header) < frame_header.size:
+                # The batch is done
+                ended = True
+                return (None, None)
+            (kind, length) = frame_header.unpack(header)
+            payload = frames.read(length)
+            if kind != b'D':
+                ended = True
+            return (kind, payload)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGALRM])
+
+    def output_lines(input_file):
+        while True:
+            (kind, payload) = read_frame()
+            if kind == b'D':
+                yield from io.StringIO(payload.decode(encoding))
+            elif kind == b'E':
+                return
+            elif kind == b'F':
+                raise subprocess.CalledProcessError(int(payload), objdump_command(input_file, objdump_location))
+            elif kind == b'A':
+                raise TimeoutError(f"Timed out after {timeout} seconds")
+            else:
+                raise EOFError("The batch stopped")
+
+    while True:
+        (kind, payload) = read_frame()
+        if kind is None:
+            return
+        input_file = payload.decode()
+        ended = False
+        try:
+            try:
+                if timeout is not None:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                result = _worker_analyze_binary(input_file, disassemble=lambda binary_path: parse_objdump_output(output_lines(binary_path)))
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except TimeoutError as e:
+            result = (input_file, None, '', f"{type(e).__name__}: {e}")
+        try:
+            sock.sendall(_frame(b'R', pickle.dumps(result)))
+        except OSError:
+            return
+        while not ended:
+            read_frame()
+
+# A worker process of analyze_binaries_async and the event loop's end of its socket
+class _StreamWorker(object):
+    def __init__(self, process, sock):
+        self.process = process
+        self.sock = sock
+        self._received = bytearray()
+
+    async def send(self, loop, kind, payload=b''):
+        await loop.sock_sendall(self.sock, _frame(kind, payload))
+
+    async def _receive_exactly(self, loop, size):
+        while len(self._received) < size:
+            data = await loop.sock_recv(self.sock, 1 << 16)
+            if len(data) == 0:
+                raise EOFError(f"Analysis worker exited with status {self.process.exitcode}")
+            self._received += data
+        data = bytes(self._received[:size])
+        del self._received[:size]
+        return data
+
+    async def receive_result(self, loop):
+        (_, length) = frame_header.unpack(await self._receive_exactly(loop, frame_header.size))
+        return pickle.loads(await self._receive_exactly(loop, length))
+
+# Fork the workers of analyze_binaries_async. Each closes the loop's ends of the
+# sockets of the workers before it, so every worker sees the end of its input.
+def _start_stream_workers(processes, objdump_location, timeout):
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for _ in range(processes):
+        (loop_sock, worker_sock) = socket.socketpair()
+        inherited_socks = [worker.sock for worker in workers]+[loop_sock]
+        process = context.Process(target=_stream_worker, args=(worker_sock, inherited_socks, objdump_location, timeout), daemon=True)
+        process.start()
+        worker_sock.close()
+        loop_sock.setblocking(False)
+        workers.append(_StreamWorker(process, loop_sock))
+    return workers
+
+# Read the output of a running objdump into chunks of whole lines, ended by its exit
+# status and CPU time. objdump is killed if this is cancelled.
+async def read_objdump_chunks(process, chunks, reaped_cpu):
+    pending = bytearray()
+    try:
+        while True:
+            data = await process.stdout.read(1 << 16)
+            if len(data) == 0:
+                break
+            pending += data
+            if len(pending) >= chunk_size:
+                end = pending.rfind(b'\n')+1
+                if end != 0:
+                    await chunks.put(bytes(pending[:end]))
+                    del pending[:end]
+        if len(pending) != 0:
+            await chunks.put(bytes(pending))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    # CPU time of the objdump processes which exited since the last one finished is
+    # attributed to the binary of that one
+    objdump_cpu = children_cpu_time()-reaped_cpu[0]
+    reaped_cpu[0] += objdump_cpu
+    await chunks.put((returncode, objdump_cpu))
+
+# Analyze a list of binaries disassembled by objdump, yielding the analyze_binary tuple
+# of each binary as it finishes. An event loop keeps up to disassemblers objdump
+# processes running, reading their output as it's produced and streaming it to
+# processes worker processes which parse and analyze it as it arrives. Every objdump
+# runs ahead of its worker by at most queued_chunks chunks, which bounds memory use.
+# A binary taking longer than timeout seconds once it has a worker is reported as
+# failed, with its objdump killed and its worker's analysis interrupted. objdump is
+# also stopped once its worker is done early, like after a policy violation.
+def analyze_binaries_async(binaries, analyzer, objdump_location, processes, disassemblers, timeout=None):
+    global _worker_analyzer
+    _worker_analyzer = analyzer
+
+    # Workers are forked before the event loop starts any threads
+    workers = _start_stream_workers(processes, objdump_location, timeout)
+    num_workers = [len(workers)]
+
+    loop = asyncio.new_event_loop()
+    disassembler_slots = asyncio.Semaphore(disassemblers)
+    idle_workers = asyncio.Queue()
+    for worker in workers:
+        idle_workers.put_nowait(worker)
+    reaped_cpu = [children_cpu_time()]
+
+    # Stream a binary's objdump output to a worker. Returns its result and the
+    # objdump CPU time, or None for the time if objdump didn't finish.
+    async def stream_to_worker(input_file, worker, chunks, reading, deadline):
+        await worker.send(loop, b'B', input_file.encode())
+        receiving = loop.create_task(worker.receive_result(loop))
+        objdump_cpu = None
+        try:
+            while objdump_cpu is None:
+                getting = loop.create_task(chunks.get())
+                remaining = None if deadline is None else max(0., deadline-loop.time())
+                (done, _) = await asyncio.wait({getting, receiving}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if getting not in done:
+                    # Timed out, or the worker is done without the rest of the output
+                    getting.cancel()
+                    reading.cancel()
+                    await worker.send(loop, b'A')
+                    break
+                item = getting.result()
+                if isinstance(item, bytes):
+                    await worker.send(loop, b'D', item)
+                    continue
+                (returncode, objdump_cpu) = item
+                if returncode == 0:
+                    await worker.send(loop, b'E')
+                else:
+                    await worker.send(loop, b'F', str(returncode).encode())
+            return (await receiving, objdump_cpu)
+        finally:
+            receiving.cancel()
+
+    async def analyze(input_file):
+        await disassembler_slots.acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(*objdump_command(input_file, objdump_location), stdout=asyncio.subprocess.PIPE)
+        except OSError as e:
+            disassembler_slots.release()
+            return (input_file, None, '', f"{type(e).__name__}: {e}")
+        chunks = asyncio.Queue(maxsize=queued_chunks)
+        reading = loop.create_task(read_objdump_chunks(process, chunks, reaped_cpu))
+        reading.add_done_callback(lambda task: disassembler_slots.release())
+        try:
+            worker = await idle_workers.get()
+            if worker is None:
+                # Every worker died, the next binary finds out the same way
+                idle_workers.put_nowait(None)
+                return (input_file, None, '', "No analysis workers are left")
+            # Time spent waiting for a worker doesn't count against the timeout
+            deadline = None if timeout is None else loop.time()+timeout
+            try:
+                ((input_file, result, output, error), objdump_cpu) = await stream_to_worker(input_file, worker, chunks, reading, deadline)
+            except (OSError, EOFError) as e:
+                num_workers[0] -= 1
+                if num_workers[0] == 0:
+                    idle_workers.put_nowait(None)
+                return (input_file, None, '', f"{type(e).__name__}: {e}")
+            idle_workers.put_nowait(worker)
+            if result is not None and result.profile is not None and objdump_cpu is not None:
+                result.profile.add_stage('objdump', 0., objdump_cpu)
+            return (input_file, result, output, error)
+        finally:
+            if not reading.done():
+                reading.cancel()
+                await asyncio.wait([reading])
+
+    pending = set(loop.create_task(analyze(input_file)) for input_file in binaries)
+    try:
+        while len(pending) != 0:
+            (done, pending) = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                (input_file, result, output, error) = task.result()
+                _merge_strategy_wins(analyzer, result)
+                yield (input_file, result, output, error)
+    finally:
+        for task in pending:
+            task.cancel()
+        if len(pending) != 0:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+        # Workers exit at the end of their input, unless stuck in an analysis
+        for worker in workers:
+            worker.sock.close()
+        for worker in workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+
+# Totals over every binary of a batch
+class BatchSummary(object):
+    def __init__(self):
+        self.num_binaries = 0
+        self.num_instructions = 0
+        self.failed = []
+        self.violations = []
+        # Number of binaries requiring each cpuid requirement list
+        self.requirement_counts = {}
+        self.unsupported_inst_encounters = {}
+
+    def add(self, input_file, result, error):
+        self.num_binaries += 1
+        if error is not None:
+            self.failed.append((input_file, error))
+            return
+        self.num_instructions += result.num_instructions
+        if result.violation is not None:
+            self.violations.append((input_file, result.violation))
+        for cpuid_reqs in result.extension_requirements:
+            key = tuple(cpuid_reqs)
+            self.requirement_counts[key] = self.requirement_counts.get(key, 0)+1
+        for (key, count) in result.unsupported_inst_encounters.items():
+            self.unsupported_inst_encounters[key] = self.unsupported_inst_encounters.get(key, 0)+count
+
+    def print(self):
+        print(f"Scanned {self.num_binaries} binaries, {self.num_instructions} instructions")
+        if len(self.requirement_counts) == 0:
+            print("No special extensions are required by any binary")
+        else:
+            print("Aggregate Extension Requirements:")
+            for (cpuid_reqs, count) in sorted(self.requirement_counts.items(), key=lambda item: (-item[1], item[0])):
+                print(f"{list(cpuid_reqs)} -> {count} binaries")
+        if len(self.violations) != 0:
+            print(f"WARNING: {len(self.violations)} binaries require extensions which aren't allowed")
+            for (input_file, violation) in sorted(self.violations, key=lambda item: item[0]):
+                print(f"{input_file}: {violation}")
+        if len(self.failed) != 0:
+            print(f"WARNING: {len(self.failed)} binaries couldn't be analyzed")
+            for (input_file, error) in sorted(self.failed):
+                print(f"{input_file}: {error}")
@@ -0,0 +1,82 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from disassembly import parse_objdump_records
+from elf import ElfFile, EM_X86_64
+from x86_decoder import decode_instructions
+
+parser = argparse.ArgumentParser("Compare the builtin instruction decoder against objdump")
+
+parser.add_argument("binaries", help="Binaries to disassemble", nargs='*', default=['/bin/ls', '/bin/bash'])
+parser.add_argument("--objdump-location", help="Location of objdump", default="objdump")
+parser.add_argument("-r", "--repeat", help="Number of timed runs of each disassembler. The fastest is reported", type=int, default=1)
+parser.add_argument("--show-disagreements", help="Number of disagreeing instructions to print per binary", type=int, default=0)
+
+args = parser.parse_args()
+
+# Map each instruction address reported by objdump to its (name, length)
+def objdump_lengths(binary_path):
+    command = [args.objdump_location, '--disassemble', '-M', 'intel', binary_path]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True) as process:
+        lengths = {}
+        for (address, inst_name, inst_bytes, _) in parse_objdump_records(process.stdout):
+            lengths[address] = (inst_name, len(inst_bytes))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return lengths
+
+# Map each instruction address found by the builtin decoder to its length
+def builtin_lengths(binary_path):
+    elf_file = ElfFile(binary_path)
+    lengths = {}
+    try:
+        for section in elf_file.executable_sections():
+            data = elf_file.section_data(section)
+            for (offset, length, _) in decode_instructions(data):
+                lengths[section.addr+offset] = length
+            data.release()
+    finally:
+        elf_file.close()
+    return lengths
+
+def best_time(function, binary_path):
+    best = None
+    for i in range(max(1, args.repeat)):
+        start = time.perf_counter()
+        result = function(binary_path)
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (result, best)
+
+print(f"{'binary':40} {'instructions':>12} {'objdump inst/s':>15} {'builtin inst/s':>15} {'speedup':>8} {'agreement':>10}")
+for binary_path in args.binaries:
+    if not os.path.isfile(binary_path):
+        print(f"{binary_path} doesn't exist or is a directory!")
+        sys.exit(1)
+    try:
+        elf_file = ElfFile(binary_path)
+    except ValueError as e:
+        print(f"{e}!")
+        sys.exit(1)
+    machine = elf_file.machine
+    elf_file.close()
+    if machine != EM_X86_64:
+        print(f"{binary_path} isn't an x86-64 binary!")
+        sys.exit(1)
+
+    (reference, objdump_time) = best_time(objdump_lengths, binary_path)
+    (decoded, builtin_time) = best_time(builtin_lengths, binary_path)
+
+    # An instruction agrees when the decoder starts an instruction of the same length at its address
+    disagreements = [address for address in sorted(reference) if decoded.get(address) != reference[address][1]]
+    num_instructions = len(reference)
+    agreement = 1.0-len(disagreements)/num_instructions if num_instructions > 0 else 1.0
+
+    print(f"{binary_path:40} {num_instructions:>12} {num_instructions/objdump_time:>15.0f} "
+          f"{len(decoded)/builtin_time:>15.0f} {objdump_time/builtin_time:>7.2f}x {agreement:>10.5%}")
+    for address in disagreements[:args.show_disagreements]:
+        (inst_name, length) = reference[address]
+        print(f"    {address:x}: objdump {inst_name} length {length}, builtin length {decoded.get(address)}")
@@ -0,0 +1,134 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from instruction_definitions import load_definitions, load_compiled_definitions
+from instruction_matching import matchers
+from extension_analysis import ExtensionAnalyzer, UnmatchedEncoding
+from synthetic_corpus import synthesize_corpus, write_corpus, read_corpus
+
+parser = argparse.ArgumentParser("Benchmark the instruction matching engines on encodings synthesized from the instruction definitions, and check each resolves back to its definition")
+
+parser.add_argument("-d", "--definitions", help="The file containing instruction definitions. Should be a .csv file", default="instructions_fixed.csv")
+parser.add_argument("--compiled-definitions", help="Compiled definitions file from compile_definitions.py, used instead of the .csv file when up to date", type=str)
+parser.add_argument("--matchers", help="Engines to benchmark", nargs='+', choices=sorted(matchers), default=sorted(matchers))
+parser.add_argument("--samples", help="Number of random fills of each valmask", type=int, default=1)
+parser.add_argument("--seed", help="Seed of the random fills", type=int, default=0)
+parser.add_argument("--no-prefixes", help="Only synthesize the plain encodings, without extra legacy and REX prefixes", action='store_true')
+parser.add_argument("--corpus", help="Read the corpus from this file instead of synthesizing it", type=str)
+parser.add_argument("--write-corpus", help="Write the synthesized corpus to this file", type=str)
+parser.add_argument("-r", "--repeat", help="Number of timed runs of each engine. The fastest is reported", type=int, default=1)
+parser.add_argument("--unnamed", help="Also resolve the encodings without their mnemonic, the way the builtin disassembler's instructions are", action='store_true')
+parser.add_argument("--show-mismatches", help="Number of encodings resolving to definitions with other cpuid requirements to print per engine", type=int, default=0)
+
+args = parser.parse_args()
+
+if not os.path.isfile(args.definitions):
+    print(f"Definitions file {args.definitions} doesn't exist or is a directory!")
+    sys.exit(1)
+
+definitions_raw = None
+compiled_definitions_file = args.compiled_definitions
+if compiled_definitions_file is None:
+    compiled_definitions_file = os.path.splitext(args.definitions)[0]+'.bin'
+if os.path.isfile(compiled_definitions_file):
+    try:
+        definitions_raw = load_compiled_definitions(compiled_definitions_file, args.definitions)
+    except RuntimeError as e:
+        print(f"WARNING: {e}")
+if definitions_raw is None:
+    definitions_raw = load_definitions(args.definitions)
+
+if args.corpus is not None:
+    try:
+        corpus = read_corpus(args.corpus, definitions_raw)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+else:
+    corpus = synthesize_corpus(definitions_raw, samples=args.samples, seed=args.seed, prefixes=not args.no_prefixes)
+if args.write_corpus is not None:
+    write_corpus(corpus, definitions_raw, args.write_corpus)
+
+variant_counts = {}
+for encoding in corpus:
+    variant_counts[encoding.variant] = variant_counts.get(encoding.variant, 0)+1
+print(f"Corpus of {len(corpus)} encodings: {', '.join(f'{num} {variant}' for (variant, num) in sorted(variant_counts.items()))}")
+
+# Match the corpus once with the engine's own interface. Encodings are grouped by
+# their candidates, and engines matching whole batches get each group at once.
+def match_corpus(matcher, groups):
+    num_records = 0
+    for (cand_hashes, inst_bytes_list) in groups:
+        if hasattr(matcher, 'match_batch'):
+            for records in matcher.match_batch(inst_bytes_list, cand_hashes):
+                num_records += len(records)
+        else:
+            for inst_bytes in inst_bytes_list:
+                num_records += len(matcher.match(inst_bytes, cand_hashes))
+    return num_records
+
+def best_time(function, *function_args):
+    best = None
+    for i in range(max(1, args.repeat)):
+        start = time.perf_counter()
+        result = function(*function_args)
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (result, best)
+
+# Resolve every encoding the way the primary loop does, without a memo. Returns the
+# number resolving to their own definition, to another definition with the same cpuid
+# requirements, the mismatches and the encodings which couldn't be resolved.
+def check_corpus(analyzer, unnamed):
+    exact = 0
+    equivalent = 0
+    mismatches = []
+    errors = 0
+    for (inst_num, encoding) in enumerate(corpus):
+        inst_name = None if unnamed else encoding.inst_name
+        # resolve_instruction prints the candidates of the encodings it can't resolve
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                (_, def_hash, _) = analyzer.resolve_instruction(inst_num+1, inst_name, encoding.inst_bytes, encoding.inst_decode)
+            except (RuntimeError, KeyError):
+                errors += 1
+                continue
+        if def_hash == encoding.def_hash:
+            exact += 1
+        elif definitions_raw[def_hash].cpuid == definitions_raw[encoding.def_hash].cpuid:
+            equivalent += 1
+        else:
+            mismatches.append((encoding, def_hash))
+    return (exact, equivalent, mismatches, errors)
+
+analyzer = ExtensionAnalyzer(definitions_raw, careful=True, memo_size=0)
+groups = {}
+for encoding in corpus:
+    (_, cand_hashes) = analyzer.get_candidates(encoding.inst_name, encoding.inst_decode)
+    groups.setdefault(tuple(cand_hashes), []).append(encoding.inst_bytes)
+groups = [(list(cand_key), inst_bytes_list) for (cand_key, inst_bytes_list) in groups.items()]
+
+modes = [False, True] if args.unnamed else [False]
+print(f"{'engine':12} {'mnemonic':>8} {'match inst/s':>13} {'resolve inst/s':>15} {'exact':>7} {'equivalent':>10} {'mismatched':>10} {'errors':>7}")
+mismatched = False
+for matcher_name in args.matchers:
+    analyzer = ExtensionAnalyzer(definitions_raw, matcher=matcher_name, careful=True, memo_size=0)
+    (_, match_time) = best_time(match_corpus, analyzer.matcher, groups)
+    for unnamed in modes:
+        if unnamed and not hasattr(analyzer.matcher, 'match_any'):
+            # Every definition is a candidate without a mnemonic, too slow for these engines
+            continue
+        ((exact, equivalent, mismatches, errors), resolve_time) = best_time(check_corpus, analyzer, unnamed)
+        print(f"{matcher_name:12} {'no' if unnamed else 'yes':>8} {'' if unnamed else f'{len(corpus)/match_time:.0f}':>13} "
+              f"{len(corpus)/resolve_time:>15.0f} {exact:>7} {equivalent:>10} {len(mismatches):>10} {errors:>7}")
+        for (encoding, def_hash) in mismatches[:args.show_mismatches]:
+            print(f"    {encoding.variant} {encoding.inst_bytes.hex(' ').upper()} from {definitions_raw[encoding.def_hash]}")
+            print(f"        resolved to {definitions_raw[def_hash]}")
+        if len(mismatches) != 0:
+            mismatched = True
+
+sys.exit(1 if mismatched else 0)
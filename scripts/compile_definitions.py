@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+from instruction_definitions import load_definitions, compile_definitions
+
+parser = argparse.ArgumentParser("Compile instruction definitions into a memory mappable binary file")
+
+parser.add_argument("-d", "--definitions", help="The instruction definitions file to compile. Should be a .csv file", default="instructions_fixed.csv")
+parser.add_argument("-o", "--output", help="Output file. Defaults to the definitions file with a .bin extension", type=str)
+
+args = parser.parse_args()
+
+if not os.path.isfile(args.definitions):
+    print(f"Definitions file {args.definitions} doesn't exist or is a directory!")
+    sys.exit(1)
+
+output_file = args.output
+if output_file is None:
+    output_file = os.path.splitext(args.definitions)[0]+'.bin'
+
+try:
+    definitions_raw = load_definitions(args.definitions)
+except RuntimeError as e:
+    print(f"ERROR: {e}")
+    sys.exit(1)
+
+compile_definitions(definitions_raw, args.definitions, output_file)
+print(f"Compiled {len(definitions_raw)} definitions to {output_file}")
@@ -0,0 +1,71 @@
+# Named sets of allowed extensions for --allow, using the extension names of the
+# instruction definitions. Features without instructions of their own in the
+# definitions, like POPCNT or CMPXCHG16B, aren't listed.
+x86_64_v1 = ['MMX', 'SSE', 'SSE2']
+x86_64_v2 = x86_64_v1+['SSE3', 'SSSE3', 'SSE4_1', 'SSE4_2']
+x86_64_v3 = x86_64_v2+['AVX', 'AVX2', 'BMI1', 'BMI2', 'F16C', 'FMA', 'LZCNT', 'XSAVE']
+x86_64_v4 = x86_64_v3+['AVX512F', 'AVX512BW', 'AVX512CD', 'AVX512DQ', 'AVX512VL']
+haswell = x86_64_v3+['AES', 'PCLMULQDQ', 'RDRAND', 'XSAVEOPT', 'HLE', 'RTM', 'INVPCID']
+skylake = haswell+['ADX', 'RDSEED', 'PREFETCHW', 'SMAP', 'XSAVEC', 'XSS', 'MPX']
+skylake_avx512 = skylake+x86_64_v4[len(x86_64_v3):]+['CLWB', 'OSPKE']
+icelake_server = skylake_avx512+['AVX512_IFMA', 'AVX512_VBMI', 'GFNI', 'SHA', 'RDPID']
+
+policy_presets = {
+    'x86-64': x86_64_v1,
+    'x86-64-v2': x86_64_v2,
+    'x86-64-v3': x86_64_v3,
+    'x86-64-v4': x86_64_v4,
+    'haswell': haswell,
+    'skylake': skylake,
+    'skylake-avx512': skylake_avx512,
+    'icelake-server': icelake_server,
+}
+
+# /proc/cpuinfo flags whose extension name isn't just the upper cased flag
+cpuinfo_flag_names = {
+    'pni': 'SSE3',
+    'abm': 'LZCNT',
+    'sha_ni': 'SHA',
+    'xsaves': 'XSS',
+    '3dnowprefetch': 'PREFETCHW',
+    'avx512ifma': 'AVX512_IFMA',
+    'avx512vbmi': 'AVX512_VBMI',
+    'avx512_4fmaps': 'AVX512_4FMAPS',
+    'avx512_4vnniw': 'AVX512_4VNNIW',
+}
+
+# Extensions supported by the host, read from the flags of /proc/cpuinfo
+def host_extensions(cpuinfo_file='/proc/cpuinfo'):
+    with open(cpuinfo_file, 'r') as cpuinfo:
+        for line in cpuinfo:
+            if line.startswith('flags'):
+                flags = line.split(':', 1)[1].split()
+                return set(cpuinfo_flag_names.get(flag, flag.upper()) for flag in flags)
+    raise RuntimeError(f"No cpu flags found in {cpuinfo_file}")
+
+# Build the set of allowed extensions from --allow values. Each value is a comma
+# separated list of preset names, 'host' and extension names. Raises ValueError for
+# names which are neither a preset nor one of known_extensions.
+def parse_allowed(values, known_extensions):
+    allowed = set()
+    for value in values:
+        for name in value.split(','):
+            name = name.strip()
+            if name == '':
+                continue
+            if name == 'host':
+                allowed |= host_extensions()
+            elif name in policy_presets:
+                allowed |= set(policy_presets[name])
+            elif name.upper() in known_extensions:
+                allowed.add(name.upper())
+            else:
+                raise ValueError(f"Unknown extension or preset {name}")
+    return allowed
+
+# Whether a cpuid requirement list is covered by the allowed extensions
+def is_allowed(cpuid_reqs, allowed):
+    for extension in cpuid_reqs:
+        if extension not in allowed:
+            return False
+    return True
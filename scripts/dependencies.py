@@ -0,0 +1,143 @@
+import glob
+import os
+from elf import ElfFile, is_elf_x86_64, DT_NEEDED, DT_RPATH, DT_RUNPATH
+from extension_analysis import AnalysisResult
+
+# Directories searched after those configured in ld.so.conf
+default_library_dirs = ['/lib/x86_64-linux-gnu', '/usr/lib/x86_64-linux-gnu', '/lib64', '/usr/lib64', '/lib', '/usr/lib']
+
+# Read the library directories listed in an ld.so.conf file, following includes
+def read_ld_so_conf(conf_file, seen=None):
+    if seen is None:
+        seen = set()
+    if conf_file in seen or not os.path.isfile(conf_file):
+        return []
+    seen.add(conf_file)
+    dirs = []
+    with open(conf_file, 'r') as conf:
+        for line in conf:
+            line = line.split('#')[0].strip()
+            if line == '':
+                continue
+            if line.startswith('include'):
+                pattern = line.split(None, 1)[1]
+                if not os.path.isabs(pattern):
+                    pattern = os.path.join(os.path.dirname(conf_file), pattern)
+                for included in sorted(glob.glob(pattern)):
+                    dirs += read_ld_so_conf(included, seen)
+            else:
+                dirs.append(line)
+    return dirs
+
+def system_library_dirs():
+    dirs = read_ld_so_conf('/etc/ld.so.conf')
+    return dirs+[lib_dir for lib_dir in default_library_dirs if lib_dir not in dirs]
+
+# Split a DT_RPATH or DT_RUNPATH value into directories, expanding $ORIGIN
+def expand_search_path(search_path, origin):
+    dirs = []
+    for lib_dir in search_path.split(':'):
+        if lib_dir == '':
+            continue
+        lib_dir = lib_dir.replace('${ORIGIN}', origin).replace('$ORIGIN', origin)
+        dirs.append(lib_dir)
+    return dirs
+
+# The dynamic linking details of an ELF file
+class DynamicInfo(object):
+    def __init__(self, path):
+        self.path = path
+        self.needed = []
+        self.rpath = []
+        self.runpath = []
+        elf_file = ElfFile(path)
+        try:
+            origin = os.path.dirname(path)
+            for (tag, value) in elf_file.dynamic_entries():
+                if tag == DT_NEEDED:
+                    self.needed.append(value)
+                elif tag == DT_RPATH:
+                    self.rpath += expand_search_path(value, origin)
+                elif tag == DT_RUNPATH:
+                    self.runpath += expand_search_path(value, origin)
+        finally:
+            elf_file.close()
+
+# Resolves the shared libraries binaries load the way the dynamic linker searches for
+# them: DT_RPATH of the loading object and its loaders when it has no DT_RUNPATH, then
+# LD_LIBRARY_PATH, DT_RUNPATH, the ld.so.conf directories and the default directories.
+# Only 64 bit x86 ELF files are accepted. Dynamic details are read once per file.
+class DependencyResolver(object):
+    def __init__(self, library_path=None, system_dirs=None):
+        if library_path is None:
+            library_path = os.environ.get('LD_LIBRARY_PATH', '')
+        self.library_path = [lib_dir for lib_dir in library_path.split(':') if lib_dir != '']
+        self.system_dirs = system_library_dirs() if system_dirs is None else system_dirs
+        self._info = {}
+
+    def info(self, path):
+        if path not in self._info:
+            self._info[path] = DynamicInfo(path)
+        return self._info[path]
+
+    # Find the file a library name refers to. loaders are the objects which led to the
+    # loading object, the executable first. Returns None if it can't be found.
+    def find_library(self, name, loading, loaders):
+        if '/' in name:
+            candidates = [name if os.path.isabs(name) else os.path.join(os.path.dirname(loading.path), name)]
+        else:
+            dirs = []
+            if len(loading.runpath) == 0:
+                for loader in [loading]+list(reversed(loaders)):
+                    dirs += loader.rpath
+            dirs += self.library_path+loading.runpath+self.system_dirs
+            candidates = [os.path.join(lib_dir, name) for lib_dir in dirs]
+        for candidate in candidates:
+            if os.path.isfile(candidate) and is_elf_x86_64(candidate):
+                return os.path.realpath(candidate)
+        return None
+
+    # Resolve the dependency closure of a binary. Returns the real paths of every library
+    # it loads directly or indirectly, and the names of libraries which weren't found.
+    def closure(self, binary_path):
+        root = self.info(os.path.realpath(binary_path))
+        libraries = []
+        missing = []
+        seen = set([root.path])
+        # Breadth first, the order the dynamic linker loads libraries in
+        queue = [(root, [])]
+        while len(queue) != 0:
+            (loading, loaders) = queue.pop(0)
+            for name in loading.needed:
+                library = self.find_library(name, loading, loaders)
+                if library is None:
+                    if name not in missing:
+                        missing.append(name)
+                    continue
+                if library in seen:
+                    continue
+                seen.add(library)
+                libraries.append(library)
+                queue.append((self.info(library), loaders+[loading]))
+        return (libraries, missing)
+
+# Combine the results of an executable and the libraries it loads from a dict of
+# binary path to (result, error). Returns the combined result, the binaries requiring
+# each requirement list and the (binary, error) pairs of failed analyses.
+def merge_closure_results(executable, libraries, results):
+    merged = AnalysisResult(executable)
+    requiring = {}
+    failed = []
+    for binary in [executable]+libraries:
+        (result, error) = results[binary]
+        if error is not None:
+            failed.append((binary, error))
+            continue
+        merged.num_instructions += result.num_instructions
+        for cpuid_reqs in result.extension_requirements:
+            if cpuid_reqs not in merged.extension_requirements:
+                merged.extension_requirements.append(cpuid_reqs)
+            requiring.setdefault(tuple(cpuid_reqs), []).append(binary)
+        for (key, count) in result.unsupported_inst_encounters.items():
+            merged.unsupported_inst_encounters[key] = merged.unsupported_inst_encounters.get(key, 0)+count
+    return (merged, requiring, failed)
@@ -0,0 +1,202 @@
+import collections
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from elf import ElfFile, EM_X86_64
+from x86_decoder import decode_instructions
+
+file_types_64 = ['elf64-x86-64']
+file_format_matcher = re.compile(r'file format ([\S]*)')
+instruction_heading_matcher = re.compile(r'^ *[0-9a-f]+:$')
+
+# Parse lines of objdump disassembly into (address, inst_name, inst_bytes, inst_decode)
+# tuples, with inst_bytes a bytes object converted from objdump's hex column once.
+# objdump splits the bytes of long instructions over continuation lines which have an
+# address and bytes but no decoded instruction. Those bytes are appended to the
+# preceding instruction, so instructions are yielded once the next one starts.
+def parse_objdump_records(lines):
+    pending = None
+    for line in lines:
+        tab_list = line.rstrip('\n').split('\t')
+        if len(tab_list) < 2 or not instruction_heading_matcher.match(tab_list[0]):
+            continue
+
+        # Get byte stream
+        inst_bytes = bytes.fromhex(tab_list[1])
+        if len(tab_list) == 2:
+            # Continuation of the previous instruction's bytes
+            if pending is not None:
+                pending = (pending[0], pending[1], pending[2]+inst_bytes, pending[3])
+            continue
+
+        # We have a line which is an instruction
+        if pending is not None:
+            yield pending
+        address = int(tab_list[0].strip()[:-1], 16)
+        inst_name_portion = tab_list[2].strip()
+        inst_name = inst_name_portion.split(' ')[0]
+        pending = (address, inst_name, inst_bytes, inst_name_portion)
+
+    if pending is not None:
+        yield pending
+
+# Yield instructions parsed from a running objdump process as its output arrives.
+# If the consumer stops early the pipe is closed, which makes objdump exit.
+def stream_objdump_instructions(process, command):
+    completed = False
+    try:
+        yield from parse_objdump_records(process.stdout)
+        completed = True
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if completed and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+def objdump_command(binary_path, objdump_location):
+    return [objdump_location, '--disassemble', '-M', 'intel', binary_path]
+
+# Read objdump's output up to the file format reported in the header before any
+# disassembly. Returns the file mode, or None for unsupported files.
+def read_objdump_file_mode(lines):
+    match_res = None
+    for line in lines:
+        match_res = file_format_matcher.search(line)
+        if match_res is not None:
+            break
+
+    if match_res is None:
+        print(f"Wrongly formatted output!")
+        return None
+    file_type = match_res.group(1)
+    if file_type in file_types_64:
+        return '64'
+    print(f"Unsupported file type {file_type}!")
+    return None
+
+# Disassemble a binary with objdump. Returns the file mode and a generator of parsed
+# (address, inst_name, inst_bytes, inst_decode) instructions reading objdump's output
+# through a pipe, so memory use stays bounded and matching overlaps with disassembly.
+# Returns None for unsupported files.
+def objdump_disassemble(binary_path, objdump_location):
+    command = objdump_command(binary_path, objdump_location)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+
+    file_mode = read_objdump_file_mode(process.stdout)
+    if file_mode is None:
+        process.stdout.close()
+        process.wait()
+        return None
+
+    return (file_mode, stream_objdump_instructions(process, command))
+
+# Parse lines of objdump output read elsewhere like objdump_disassemble does
+def parse_objdump_output(lines):
+    lines = iter(lines)
+    file_mode = read_objdump_file_mode(lines)
+    if file_mode is None:
+        return None
+    return (file_mode, parse_objdump_records(lines))
+
+# Split the executable sections of an ELF file into (section name, start, stop) address
+# ranges of roughly equal size. Ranges are only split at function symbols, so every
+# shard starts on an instruction boundary.
+def plan_shards(elf_file, num_shards):
+    sections = elf_file.executable_sections()
+    total_size = sum(section.size for section in sections)
+    target_size = max(1, total_size//max(1, num_shards))
+
+    function_starts = {}
+    for symbol in elf_file.function_symbols():
+        function_starts.setdefault(symbol.section_index, set()).add(symbol.value)
+
+    shards = []
+    for section in sections:
+        start = section.addr
+        stop = section.addr+section.size
+        boundaries = sorted(address for address in function_starts.get(section.index, [])
+                            if start < address < stop)
+        shard_start = start
+        for address in boundaries:
+            if address-shard_start >= target_size:
+                shards.append((section.name, shard_start, address))
+                shard_start = address
+        shards.append((section.name, shard_start, stop))
+    return shards
+
+def run_objdump(command):
+    return subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+
+# Yield instructions from objdump commands run in parallel. At most two commands per
+# job are in flight, and their output is parsed in command order.
+def stream_sharded_instructions(commands, jobs):
+    commands = iter(commands)
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for command in commands:
+                pending.append(executor.submit(run_objdump, command))
+                if len(pending) >= 2*jobs:
+                    break
+            while pending:
+                output = pending.popleft().result()
+                for command in commands:
+                    pending.append(executor.submit(run_objdump, command))
+                    break
+                yield from parse_objdump_records(output.splitlines())
+        finally:
+            for future in pending:
+                future.cancel()
+
+# Disassemble a binary with several objdump processes in parallel, each covering a
+# shard of the executable sections split at function boundaries. Instructions are
+# merged back in address order. Falls back to a single objdump for files which
+# aren't 64 bit x86 ELF files.
+def sharded_objdump_disassemble(binary_path, objdump_location, jobs, shards_per_job=4):
+    try:
+        elf_file = ElfFile(binary_path)
+    except ValueError:
+        return objdump_disassemble(binary_path, objdump_location)
+    try:
+        if elf_file.machine != EM_X86_64:
+            return objdump_disassemble(binary_path, objdump_location)
+        shards = plan_shards(elf_file, jobs*shards_per_job)
+    finally:
+        elf_file.close()
+
+    commands = [[objdump_location, '--disassemble', '-M', 'intel', '-j', section,
+                 f'--start-address=0x{start:x}', f'--stop-address=0x{stop:x}', binary_path]
+                for (section, start, stop) in shards]
+    return ('64', stream_sharded_instructions(commands, jobs))
+
+# Yield the instructions of the executable sections of an open ELF file
+def stream_elf_instructions(elf_file):
+    try:
+        for section in elf_file.executable_sections():
+            data = elf_file.section_data(section)
+            try:
+                for (offset, length, is_memory) in decode_instructions(data):
+                    if is_memory is None:
+                        # Bytes which don't decode, objdump's (bad)
+                        continue
+                    yield (section.addr+offset, None, bytes(data[offset:offset+length]), 'PTR' if is_memory else '')
+            finally:
+                data.release()
+    finally:
+        elf_file.close()
+
+# Disassemble a 64 bit x86 ELF file in process, without objdump. The executable
+# sections are read from the memory mapped file and split into instructions by the
+# length decoder. The decoder doesn't name instructions, so inst_name is None and the
+# decoded text only marks memory operands with PTR the way objdump does.
+def elf_disassemble(binary_path):
+    try:
+        elf_file = ElfFile(binary_path)
+    except ValueError as e:
+        print(f"{e}!")
+        return None
+    if elf_file.machine != EM_X86_64:
+        print(f"Unsupported machine type {elf_file.machine}!")
+        elf_file.close()
+        return None
+    return ('64', stream_elf_instructions(elf_file))
@@ -0,0 +1,219 @@
+import bisect
+import mmap
+import struct
+
+# ELF constants used by the readers below
+elf_magic = b'\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+EM_X86_64 = 62
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+STT_FUNC = 2
+NT_GNU_BUILD_ID = 3
+DT_NULL = 0
+DT_NEEDED = 1
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+elf64_header = struct.Struct('<16sHHIQQQIHHHHHH')
+elf64_section_header = struct.Struct('<IIQQQQIIQQ')
+elf64_symbol = struct.Struct('<IBBHQQ')
+elf_note_header = struct.Struct('<III')
+elf64_dynamic = struct.Struct('<qQ')
+
+# Check the header of a file for the ELF magic bytes of a little endian 64 bit x86 file
+# without mapping the whole file
+def is_elf_x86_64(path):
+    try:
+        with open(path, 'rb') as elf_file:
+            header = elf_file.read(elf64_header.size)
+    except OSError:
+        return False
+    if len(header) < elf64_header.size or header[:4] != elf_magic:
+        return False
+    (ident, _, machine, _, _, _, _, _, _, _, _, _, _, _) = elf64_header.unpack(header)
+    return ident[4] == ELFCLASS64 and ident[5] == ELFDATA2LSB and machine == EM_X86_64
+
+# A section header of an ELF file
+class ElfSection(object):
+    def __init__(self, index, name, sh_type, flags, addr, offset, size, link, entsize):
+        self.index = index
+        self.name = name
+        self.type = sh_type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.entsize = entsize
+
+    @property
+    def executable(self):
+        return self.type == SHT_PROGBITS and (self.flags & SHF_EXECINSTR) != 0
+
+    def __repr__(self):
+        return f"{self.name} addr:{self.addr:x} offset:{self.offset:x} size:{self.size:x}"
+
+# A symbol table entry of an ELF file
+class ElfSymbol(object):
+    def __init__(self, name, value, size, sym_type, section_index):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.type = sym_type
+        self.section_index = section_index
+
+    def __repr__(self):
+        return f"{self.name} {self.value:x} size:{self.size}"
+
+# Minimal reader for little endian 64 bit ELF files. The file is memory mapped and
+# only the headers needed to describe its layout are parsed.
+class ElfFile(object):
+    def __init__(self, path):
+        with open(path, 'rb') as elf_file:
+            self._mmap = mmap.mmap(elf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+        if len(self.data) < elf64_header.size or bytes(self.data[:4]) != elf_magic:
+            raise ValueError(f"{path} is not an ELF file")
+        (ident, self.type, self.machine, _, self.entry, _, shoff, _, _, _, _,
+         shentsize, shnum, shstrndx) = elf64_header.unpack_from(self.data)
+        if ident[4] != ELFCLASS64 or ident[5] != ELFDATA2LSB:
+            raise ValueError(f"{path} is not a little endian 64 bit ELF file")
+
+        self.sections = []
+        raw_sections = [elf64_section_header.unpack_from(self.data, shoff+i*shentsize) for i in range(shnum)]
+        names = raw_sections[shstrndx] if shstrndx < shnum else None
+        for (i, (name, sh_type, flags, addr, offset, size, link, _, _, entsize)) in enumerate(raw_sections):
+            name = self.string(names[4], name) if names is not None else ''
+            self.sections.append(ElfSection(i, name, sh_type, flags, addr, offset, size, link, entsize))
+
+    def close(self):
+        self.data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views into the mapping are still alive, it's unmapped once they're released
+            pass
+
+    # Read a NUL terminated string at an offset into a string table
+    def string(self, table_offset, offset):
+        start = table_offset+offset
+        end = self._mmap.find(b'\x00', start)
+        return str(self.data[start:end], 'utf-8', errors='replace')
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    # The contents of a section as a memoryview into the mapped file
+    def section_data(self, section):
+        return self.data[section.offset:section.offset+section.size]
+
+    def executable_sections(self):
+        return [section for section in self.sections if section.executable]
+
+    # Symbols from the static and dynamic symbol tables
+    def symbols(self):
+        symbols = []
+        for section in self.sections:
+            if section.type not in [SHT_SYMTAB, SHT_DYNSYM] or section.entsize == 0:
+                continue
+            strtab = self.sections[section.link]
+            for i in range(section.size//section.entsize):
+                (name, info, _, shndx, value, size) = elf64_symbol.unpack_from(self.data, section.offset+i*section.entsize)
+                symbols.append(ElfSymbol(self.string(strtab.offset, name), value, size, info & 0xF, shndx))
+        return symbols
+
+    # The GNU build-id note as a hex string, or None if the file has none
+    def build_id(self):
+        for section in self.sections:
+            if section.type != SHT_NOTE:
+                continue
+            pos = section.offset
+            end = section.offset+section.size
+            while pos+elf_note_header.size <= end:
+                (namesz, descsz, note_type) = elf_note_header.unpack_from(self.data, pos)
+                name_start = pos+elf_note_header.size
+                desc_start = name_start+((namesz+3) & ~3)
+                if note_type == NT_GNU_BUILD_ID and bytes(self.data[name_start:name_start+namesz]) == b'GNU\x00':
+                    return bytes(self.data[desc_start:desc_start+descsz]).hex()
+                pos = desc_start+((descsz+3) & ~3)
+        return None
+
+    # Entries of the dynamic section as (tag, value) pairs. String valued entries are
+    # resolved through the dynamic string table.
+    def dynamic_entries(self):
+        entries = []
+        for section in self.sections:
+            if section.type != SHT_DYNAMIC:
+                continue
+            strtab = self.sections[section.link]
+            for i in range(section.size//elf64_dynamic.size):
+                (tag, value) = elf64_dynamic.unpack_from(self.data, section.offset+i*elf64_dynamic.size)
+                if tag == DT_NULL:
+                    break
+                if tag in [DT_NEEDED, DT_RPATH, DT_RUNPATH]:
+                    value = self.string(strtab.offset, value)
+                entries.append((tag, value))
+        return entries
+
+    def function_symbols(self):
+        return [symbol for symbol in self.symbols() if symbol.type == STT_FUNC and symbol.value != 0]
+
+
+# Maps addresses to the function containing them, using the function symbols of an ELF
+# file. Code past the end of a function and before the next one, common in stripped
+# files, is named after the preceding function and its offset the way objdump labels
+# it, like memcpy+0x40. Code before the first function of a section is named after the
+# section, like <.plt>. Lookups are expected in increasing address order, so the last
+# region found is checked first.
+class FunctionMap(object):
+    def __init__(self, elf_file):
+        names = {}
+        sizes = {}
+        for symbol in elf_file.function_symbols():
+            # Prefer names without leading underscores among aliases of one address
+            name = names.get(symbol.value)
+            if name is None or (name.startswith('_'), name) > (symbol.name.startswith('_'), symbol.name):
+                names[symbol.value] = symbol.name
+            sizes[symbol.value] = max(sizes.get(symbol.value, 0), symbol.size)
+        starts = sorted(names)
+
+        # Split the executable sections into named (start, end, name) regions
+        regions = []
+        for section in elf_file.executable_sections():
+            section_end = section.addr+section.size
+            lo = bisect.bisect_left(starts, section.addr)
+            hi = bisect.bisect_left(starts, section_end)
+            section_starts = starts[lo:hi]
+            first = section_starts[0] if len(section_starts) != 0 else section_end
+            if section.addr < first:
+                regions.append((section.addr, first, f"<{section.name}>"))
+            for (i, start) in enumerate(section_starts):
+                next_start = section_starts[i+1] if i+1 < len(section_starts) else section_end
+                end = min(start+sizes[start], next_start) if sizes[start] > 0 else next_start
+                regions.append((start, end, names[start]))
+                if end < next_start:
+                    regions.append((end, next_start, f"{names[start]}+0x{end-start:x}"))
+        regions.sort()
+        self._starts = [region[0] for region in regions]
+        self._regions = regions
+        self._last = (0, 0, None)
+
+    def lookup(self, address):
+        (start, end, name) = self._last
+        if start <= address < end:
+            return name
+        i = bisect.bisect_right(self._starts, address)-1
+        if i >= 0 and address < self._regions[i][1]:
+            self._last = self._regions[i]
+            return self._last[2]
+        return None
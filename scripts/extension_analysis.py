@@ -0,0 +1,617 @@
+import progressbar
+import library as lib
+from instruction_definitions import group_definitions, build_candidate_plans, unsupported_instructions, segment_override_mnemonics
+from instruction_matching import matchers, MatchMemo
+from cpu_policy import is_allowed
+from elf import ElfFile, FunctionMap
+from x86_decoder import decode_fields
+from instruction_store import InstructionStore, deduplicate
+from scan_profile import ScanProfile, children_cpu_time
+
+# Raised when the bytes of an instruction without a mnemonic can't be resolved to a definition
+class UnmatchedEncoding(RuntimeError):
+    pass
+
+# Raised for an instruction with a mnemonic matching definitions with differing
+# requirements, which the plan's decision table doesn't tell apart. cpuid_reqs is the
+# union of the matching definitions' requirements.
+class AmbiguousEncoding(UnmatchedEncoding):
+    def __init__(self, message, cpuid_reqs):
+        super().__init__(message)
+        self.cpuid_reqs = cpuid_reqs
+
+# Prefix of the unsupported instruction entries counting ambiguous encodings
+ambiguous_encoding_prefix = 'ambiguous encoding '
+
+# An instruction requiring extensions outside of the allowed set. The address, mnemonic
+# and bytes are None when the violation was found from a cached result.
+class PolicyViolation(object):
+    def __init__(self, address, mnemonic, inst_bytes, cpuid_reqs, function=None):
+        self.address = address
+        self.mnemonic = mnemonic
+        self.inst_bytes = inst_bytes
+        self.cpuid_reqs = cpuid_reqs
+        self.function = function
+
+    def __repr__(self):
+        if self.address is None:
+            return f"requires {self.cpuid_reqs}"
+        location = f"0x{self.address:x}" if self.function is None else f"0x{self.address:x} in {self.function}"
+        return f"{self.mnemonic} ({self.inst_bytes.hex(' ').upper()}) at {location} requires {self.cpuid_reqs}"
+
+# The outcome of analyzing one binary
+class AnalysisResult(object):
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.num_instructions = 0
+        # Whether the result was read from the result cache
+        self.cached = False
+        # The first instruction outside of the allowed extensions. The analysis stops
+        # there, so the rest of the result is incomplete.
+        self.violation = None
+        # Distinct cpuid requirement lists in the order they were first encountered
+        self.extension_requirements = []
+        # Number of instructions needing each requirement list, keyed by its tuple
+        self.requirement_counts = {}
+        # (address, mnemonic, inst_bytes, cpuid_reqs) of every instruction with
+        # requirements, only recorded when asked for
+        self.instruction_hits = []
+        # The functions using each requirement list, keyed by its tuple, as a dict of
+        # function name to [instruction count, first address]. Only recorded when asked for.
+        self.function_requirements = None
+        # Unsupported instructions which were encountered and how often
+        self.unsupported_inst_encounters = {}
+        # Number of times each definition was used, only recorded with full stats
+        self.instruction_count = lib.counting_dict()
+        # ScanProfile of the analysis, only recorded when profiling
+        self.profile = None
+        # Match strategy wins of the adaptive matcher of a batch worker process since
+        # its previous binary, for the batch to merge
+        self.strategy_wins = None
+
+    # Whether the requirements include those of ambiguous encodings, which are taken
+    # to need every matching definition's requirements and may overstate them
+    @property
+    def uncertain(self):
+        return any(key.startswith(ambiguous_encoding_prefix) for key in self.unsupported_inst_encounters)
+
+# Resolves the instructions of disassembled binaries to their definitions and collects
+# the extensions they require. The matcher and memo are kept between binaries. With a
+# set of allowed extensions, analysis stops at the first instruction needing others.
+# With profile set, each result carries a ScanProfile of its analysis. With dedup set,
+# each unique encoding of a binary is resolved once and counted for all occurrences,
+# unless instruction hits, function attribution or a policy need every address.
+class ExtensionAnalyzer(object):
+    def __init__(self, definitions_raw, matcher='trie', careful=False, memo_size=65536, full_stats=False, allowed=None, record_hits=False, attribute_functions=False,
+                 profile=False, dedup=True):
+        self.definitions_raw = definitions_raw
+        self.careful = careful
+        self.full_stats = full_stats
+        self.allowed = allowed
+        self.record_hits = record_hits
+        self.attribute_functions = attribute_functions
+        self.profile = profile
+        self.dedup = dedup
+        # The ScanProfile of the analysis in progress
+        self._profile = None
+
+        # Group instruction definitions
+        self.def_name_dict = group_definitions(definitions_raw)
+
+        # Candidate plan of every mnemonic, including pseudo-ops, segment overrides and
+        # instructions without a mnemonic
+        self.plans = build_candidate_plans(definitions_raw, self.def_name_dict)
+
+        # Build the matching engine
+        self.matcher = matchers[matcher](definitions_raw)
+
+        # Memo of resolved instruction encodings
+        self.memo = None
+        if memo_size > 0:
+            self.memo = MatchMemo(definitions_raw, memo_size)
+
+        self._specificity = {}
+
+    # Get the candidate plan of an instruction, resolving segment overrides through the
+    # decoded instruction. Raises KeyError for unknown instructions.
+    def get_plan(self, inst_name, inst_decode):
+        plan = self.plans.get(inst_name)
+        if plan is None:
+            raise KeyError(inst_name)
+        if plan.segment_override:
+            # Chance this is a jump with a segment override.
+            inst_name = inst_decode.split(' ')[1]
+            plan = self.plans.get(inst_name)
+            if plan is None or plan.segment_override:
+                raise KeyError(inst_name)
+        return plan
+
+    # Get the list of 64 bit valid candidate hashes for an instruction along with the
+    # definition group they come from. Raises KeyError for unknown instructions.
+    def get_candidates(self, inst_name, inst_decode):
+        plan = self.get_plan(inst_name, inst_decode)
+        return (plan.target, plan.cand_hashes)
+
+    # Number of fixed bits in a definition's most specific valmask. Without a mnemonic an
+    # encoding like 0F 01 D5 matches both XEND and the 0F 01 /2 forms, and the definition
+    # fixing the most bits is the one the mnemonic would have picked.
+    def get_specificity(self, def_hash):
+        if def_hash not in self._specificity:
+            self._specificity[def_hash] = max((sum(bin(mask).count('1') for (_, mask) in valmask)
+                                               for valmask in self.definitions_raw[def_hash].valmasks), default=0)
+        return self._specificity[def_hash]
+
+    # Whether instructions of a plan are resolved without matching their bytes. Trivial
+    # instructions are skipped, and every candidate of a uniform plan has the same
+    # requirements, so which one matches only matters when definitions are counted.
+    # Careful analysis matches everything.
+    def skips_matching(self, plan):
+        return not self.careful and (plan.trivial or (plan.uniform and not self.full_stats))
+
+    # Batch matching. Engines supporting it match every instruction of an
+    # InstructionStore sharing a set of candidates at once, ahead of the primary loop.
+    # Returns the match records of each instruction by index.
+    def match_batches(self, store):
+        batch_records = {}
+        batches = {}
+        for inst_idx in range(len(store)):
+            inst_name = store.mnemonic(inst_idx)
+            # Instructions without a mnemonic would be matched against every definition at once
+            if inst_name is None or inst_name in unsupported_instructions:
+                continue
+            try:
+                plan = self.get_plan(inst_name, store.decode(inst_idx))
+            except KeyError:
+                # Reported by the primary loop
+                continue
+            if self.skips_matching(plan):
+                continue
+            batches.setdefault(plan.cand_hashes, []).append(inst_idx)
+        for (cand_key, inst_idxs) in batches.items():
+            results = self.matcher.match_batch([store.encoding(i) for i in inst_idxs], list(cand_key))
+            batch_records.update(zip(inst_idxs, results))
+        return batch_records
+
+    # Resolve an instruction to the definition it uses. Returns the candidate hashes,
+    # the hash of the resolved definition and its number of additional prefixes. The
+    # definition is None for trivial instructions which were skipped. batch_records are
+    # the match_batches records, the instruction's are used up. fields are the
+    # instruction's decode_fields, decoded here if matching needs them and they aren't given.
+    def resolve_instruction(self, inst_num, inst_name, inst_bytes, inst_decode, batch_records=None, fields=None):
+        if batch_records is None:
+            batch_records = {}
+        definitions_raw = self.definitions_raw
+        profile = self._profile
+        if profile is not None:
+            clock = profile.clock()
+
+        # Get list of candidate hashes
+        try:
+            plan = self.get_plan(inst_name, inst_decode)
+        except KeyError as e:
+            print(f"Couldn't find instruction {e.args[0]}({inst_num})! {inst_bytes.hex(' ').upper()} {inst_decode}")
+            raise e
+        inst_name = plan.target
+        cand_hashes = plan.cand_hashes
+
+        # Check whether any candidate has a non-trivial extension requirement
+        if not self.careful:
+            if plan.trivial:
+                # Skip trivial instruction
+                if profile is not None:
+                    profile.lap('candidate lookup', clock)
+                    profile.count('trivial instructions')
+                return (cand_hashes, None, 0)
+            if plan.uniform and not self.full_stats:
+                # Resolve to any candidate, they all have the same requirements
+                if profile is not None:
+                    profile.lap('candidate lookup', clock)
+                    profile.count('requirement uniform instructions')
+                return (cand_hashes, cand_hashes[0], 0)
+
+        if profile is not None:
+            clock = profile.lap('candidate lookup', clock)
+            if inst_name is None and hasattr(self.matcher, 'match_any'):
+                profile.count('instructions matched against every definition')
+            else:
+                profile.count('candidates evaluated', len(cand_hashes))
+
+        # Attempt to match each hash's valmask to the instruction bytes.
+        if inst_num-1 in batch_records:
+            cand_records = batch_records.pop(inst_num-1)
+        elif inst_name is None and hasattr(self.matcher, 'match_any'):
+            cand_records = self.matcher.match_any(inst_bytes)
+        elif hasattr(self.matcher, 'match_fields'):
+            if fields is None:
+                fields = decode_fields(inst_bytes)
+            cand_records = self.matcher.match_fields(fields, cand_hashes)
+        else:
+            cand_records = self.matcher.match(inst_bytes, cand_hashes)
+
+        if profile is not None:
+            clock = profile.lap('matching', clock)
+            profile.count('candidates matched', len(cand_records))
+
+        if len(cand_records) == 0 and inst_name is None:
+            raise UnmatchedEncoding(f"No definition matches instruction ({inst_num})! {inst_bytes.hex(' ').upper()}")
+
+        if len(cand_records) == 0:
+            print("Problem instruction binary:")
+            for byte in inst_bytes:
+                print(f"{byte:08b}")
+            raise RuntimeError(f"No candidates for this instruction ({inst_num})! {inst_name} {inst_bytes.hex(' ').upper()}")
+
+        # Prune list of candidates to the candidate which had the fewest additional prefixes
+        fewest_prefixes = None
+        for cand_record in cand_records:
+            if fewest_prefixes is None:
+                fewest_prefixes = cand_record[1]
+            else:
+                if cand_record[1] < fewest_prefixes:
+                    fewest_prefixes = cand_record[1]
+        i = 0
+        while i < len(cand_records):
+            if cand_records[i][1] > fewest_prefixes:
+                del cand_records[i]
+            else:
+                i += 1
+
+        if inst_name is None:
+            # Keep the most specific of the matching definitions
+            most_specific = max(self.get_specificity(cand_record[0]) for cand_record in cand_records)
+            cand_records = [cand_record for cand_record in cand_records if self.get_specificity(cand_record[0]) == most_specific]
+
+        # Check that the remaining candidates have identical extension requirements
+        cpuid_classes = plan.cpuid_classes
+        first_class = cpuid_classes[cand_records[0][0]]
+        uniform_requirements = all(cpuid_classes[cand_record[0]] == first_class for cand_record in cand_records)
+
+        if not uniform_requirements:
+            # Two candidates may be told apart by whether the ModR/M byte addresses memory
+            decision = None
+            if len(cand_records) == 2:
+                decision = plan.decide(cand_records[0][0], cand_records[1][0])
+            if decision is not None:
+                (mem_hash, reg_hash) = decision
+                if fields is None:
+                    fields = decode_fields(inst_bytes)
+                keep = mem_hash if fields.is_memory else reg_hash
+                cand_records = [cand_record for cand_record in cand_records if cand_record[0] == keep]
+
+            if decision is None and inst_name is None:
+                raise UnmatchedEncoding(f"Definitions matching instruction ({inst_num}) have differing cpuid requirements! {inst_bytes.hex(' ').upper()}")
+
+            if decision is None:
+                candidates = '\n'.join(f"    {definitions_raw[cand_record[0]]}" for cand_record in cand_records)
+                cpuid_reqs = []
+                for cand_record in cand_records:
+                    cpuid_reqs += [extension for extension in definitions_raw[cand_record[0]].cpuid if extension not in cpuid_reqs]
+                raise AmbiguousEncoding(f"Definitions matching instruction ({inst_num}) {inst_name} {inst_bytes.hex(' ').upper()} "
+                                        f"have differing cpuid requirements, all of {cpuid_reqs} are counted:\n{candidates}", cpuid_reqs)
+
+            if profile is not None:
+                profile.count('ambiguities resolved by operand type')
+
+        if profile is not None:
+            profile.lap('ambiguity resolution', clock)
+
+        return (cand_hashes, cand_records[0][0], cand_records[0][1])
+
+    # Primary program loop. Loops through each disassembled instruction, which may be
+    # streamed from a generator or held in an InstructionStore, and collects the
+    # extensions they require. With a function_map, instructions with requirements are
+    # attributed to their functions.
+    def analyze(self, input_file, instruction_list, progress=False, function_map=None):
+        memo = self.memo
+        plans = self.plans
+        allowed = self.allowed
+        record_hits = self.record_hits
+        result = AnalysisResult(input_file)
+        requirement_counts = result.requirement_counts
+        function_requirements = None
+        if function_map is not None:
+            function_requirements = result.function_requirements = {}
+        unsupported_inst_encounters = result.unsupported_inst_encounters
+        extension_requirements = result.extension_requirements
+        instruction_count = result.instruction_count
+
+        profile = None
+        if self.profile:
+            profile = result.profile = self._profile = ScanProfile()
+            scan_start = profile.clock()
+            if hasattr(self.matcher, 'stats'):
+                self.matcher.stats = profile.match_stats
+            instruction_list = profile.timed(instruction_list, 'disassembly')
+
+        # Occurrences of each instruction in instruction_list, None when every
+        # occurrence is listed
+        counts = None
+        if self.dedup and not record_hits and function_map is None and allowed is None:
+            if profile is not None:
+                clock = profile.clock()
+                waited = list(profile.stages.get('disassembly', [0., 0.]))
+            (instruction_list, counts) = deduplicate(instruction_list, segment_override_mnemonics)
+            if profile is not None:
+                # Less the time spent waiting on the disassembler meanwhile
+                now = profile.clock()
+                disassembly = profile.stages.get('disassembly', [0., 0.])
+                profile.add_stage('deduplication', now[0]-clock[0]-(disassembly[0]-waited[0]), now[1]-clock[1]-(disassembly[1]-waited[1]))
+                profile.count('unique encodings', len(instruction_list))
+
+        batch_records = {}
+        if hasattr(self.matcher, 'match_batch'):
+            # Batches need the whole binary at hand, which is kept in columns rather
+            # than as a tuple per instruction
+            if not isinstance(instruction_list, InstructionStore):
+                instruction_list = InstructionStore.from_stream(instruction_list, segment_override_mnemonics)
+            if profile is not None:
+                clock = profile.clock()
+                profile.count('instruction store bytes', instruction_list.nbytes())
+            batch_records = self.match_batches(instruction_list)
+            if profile is not None:
+                profile.lap('batch matching', clock)
+
+        if progress:
+            if isinstance(instruction_list, InstructionStore):
+                bar_widgets = [
+                    progressbar.Bar(),
+                    progressbar.Counter(format='%(value)i/%(max_value)i')
+                ]
+                max_value = len(instruction_list)
+            else:
+                # Streamed instructions, the total isn't known up front
+                bar_widgets = [
+                    progressbar.AnimatedMarker(),
+                    progressbar.Counter(format=' %(value)i')
+                ]
+                max_value = progressbar.UnknownLength
+            bar = progressbar.ProgressBar(max_value=max_value, widgets=bar_widgets, redirect_stdout=True)
+            bar.start()
+
+        inst_num = 0
+        count = 1
+        try:
+            for (address, inst_name, inst_bytes, inst_decode) in instruction_list:
+                inst_num += 1
+                if progress:
+                    bar.update(inst_num)
+                if counts is not None:
+                    count = counts[inst_num-1]
+                # Check whether this instruction is unsupported
+                if inst_name in unsupported_instructions:
+                    if inst_name not in unsupported_inst_encounters:
+                        unsupported_inst_encounters[inst_name] = count
+                    else:
+                        unsupported_inst_encounters[inst_name] += count
+                    continue
+
+                if profile is not None:
+                    clock = profile.clock()
+
+                # Instructions resolved without matching bypass the memo, which is kept
+                # for the encodings matching has to be done for. Segment override forms
+                # are left to resolve_instruction.
+                plan = plans.get(inst_name)
+                if plan is not None and not plan.segment_override and self.skips_matching(plan):
+                    if plan.trivial:
+                        if profile is not None:
+                            profile.lap('candidate lookup', clock)
+                            profile.count('trivial instructions')
+                        continue
+                    resolution = (plan.cand_hashes[0], 0)
+                    if profile is not None:
+                        clock = profile.lap('candidate lookup', clock)
+                        profile.count('requirement uniform instructions')
+                else:
+                    # Check the memo for an already resolved encoding. Its key needs the
+                    # operand type when the plan decides by it, otherwise fields are
+                    # decoded once matching needs them.
+                    fields = None
+                    is_memory = None
+                    memo_key = None
+                    resolution = None
+                    if memo is not None:
+                        if plan is not None and plan.decides_by_operand:
+                            fields = decode_fields(inst_bytes)
+                            is_memory = fields.is_memory
+                        memo_key = memo.key(inst_name, inst_bytes, is_memory)
+                        resolution = memo.get(memo_key)
+
+                    if profile is not None:
+                        clock = profile.lap('memo lookup', clock)
+                        profile.count('memo hits' if resolution is not None else 'memo misses')
+
+                ambiguous_reqs = None
+                if resolution is None:
+                    try:
+                        (cand_hashes, def_hash, num_prefixes) = self.resolve_instruction(inst_num, inst_name, inst_bytes, inst_decode, batch_records, fields)
+                    except AmbiguousEncoding as e:
+                        # Reported with its candidates once and counted like the unsupported.
+                        # It needs the requirements of every candidate it matched, so they
+                        # may be overstated but are never left out.
+                        key = f"{ambiguous_encoding_prefix}{inst_name}"
+                        if key not in unsupported_inst_encounters:
+                            print(f"WARNING: {e}")
+                        unsupported_inst_encounters[key] = unsupported_inst_encounters.get(key, 0)+count
+                        if profile is not None:
+                            profile.count('ambiguous encodings')
+                        def_hash = None
+                        ambiguous_reqs = e.cpuid_reqs
+                    except UnmatchedEncoding:
+                        # Without a mnemonic these are reported by their leading bytes
+                        key = f"unmatched encoding {inst_bytes[:4].hex(' ').upper()}"
+                        unsupported_inst_encounters[key] = unsupported_inst_encounters.get(key, 0)+count
+                        if profile is not None:
+                            profile.add_resolution('(unmatched)', profile.clock()[0]-clock[0])
+                            profile.count('unmatched encodings')
+                        continue
+                    if ambiguous_reqs is None:
+                        if profile is not None:
+                            now = profile.clock()
+                            if def_hash is not None:
+                                profile.add_resolution(inst_name if inst_name is not None else self.definitions_raw[def_hash].name.lower(), now[0]-clock[0])
+                            clock = now
+                        # Segment override forms resolve through their operands, so aren't memoized
+                        if memo is not None and inst_name not in segment_override_mnemonics:
+                            if memo_key is None:
+                                memo.register(inst_name, cand_hashes)
+                                memo_key = memo.key(inst_name, inst_bytes, is_memory)
+                            memo.put(memo_key, (def_hash, num_prefixes))
+                else:
+                    (def_hash, num_prefixes) = resolution
+
+                if ambiguous_reqs is not None:
+                    cpuid_reqs = ambiguous_reqs
+                elif def_hash is None:
+                    continue
+                else:
+                    cpuid_reqs = self.definitions_raw[def_hash].cpuid
+
+                if profile is not None:
+                    profile.count('instructions resolved', count)
+
+                if self.full_stats and def_hash is not None:
+                    instruction_count[def_hash] += count
+                if len(cpuid_reqs) != 0:
+                    reqs_key = tuple(cpuid_reqs)
+                    requirement_counts[reqs_key] = requirement_counts.get(reqs_key, 0)+count
+                    if record_hits:
+                        mnemonic = inst_name if inst_name is not None else self.definitions_raw[def_hash].name.lower()
+                        result.instruction_hits.append((address, mnemonic, inst_bytes, cpuid_reqs))
+                    function = None
+                    if function_requirements is not None:
+                        function = function_map.lookup(address)
+                        functions = function_requirements.setdefault(reqs_key, {})
+                        if function in functions:
+                            functions[function][0] += 1
+                        else:
+                            functions[function] = [1, address]
+                    if cpuid_reqs not in extension_requirements:
+                        extension_requirements.append(cpuid_reqs)
+                        if allowed is not None and not is_allowed(cpuid_reqs, allowed):
+                            mnemonic = inst_name if inst_name is not None else self.definitions_raw[def_hash].name.lower()
+                            result.violation = PolicyViolation(address, mnemonic, inst_bytes, cpuid_reqs, function)
+                            break
+                if profile is not None:
+                    profile.lap('bookkeeping', clock)
+        finally:
+            # Stops a streaming disassembler if the loop ended early
+            if hasattr(instruction_list, 'close'):
+                instruction_list.close()
+
+        if progress:
+            bar.finish()
+
+        if counts is not None:
+            inst_num = sum(counts)
+        result.num_instructions = inst_num
+        if profile is not None:
+            self._profile = None
+            now = profile.clock()
+            profile.wall_time += now[0]-scan_start[0]
+            profile.cpu_time += now[1]-scan_start[1]
+            profile.count('instructions', inst_num)
+            profile.count('unsupported instructions', sum(unsupported_inst_encounters.values()))
+            profile.update_peak_rss()
+        return result
+
+    # Disassemble and analyze a binary. Returns None if the disassembler doesn't support it.
+    def analyze_file(self, input_file, disassemble, progress=False):
+        if self.profile:
+            clock = ScanProfile.clock()
+            children_cpu = children_cpu_time()
+        disassembly = disassemble(input_file)
+        if disassembly is None:
+            return None
+        (file_type, instruction_list) = disassembly
+        if self.profile:
+            disassembly_start = ScanProfile.clock()
+
+        if file_type != '64':
+            raise RuntimeError("binary types other than 64 bit are not supported at this time.")
+
+        function_map = None
+        if self.attribute_functions:
+            elf_file = ElfFile(input_file)
+            try:
+                function_map = FunctionMap(elf_file)
+            finally:
+                elf_file.close()
+
+        result = self.analyze(input_file, instruction_list, progress=progress, function_map=function_map)
+        if self.profile:
+            # Starting the disassembler and waiting on its processes is disassembly too
+            result.profile.add_stage('disassembly', disassembly_start[0]-clock[0], disassembly_start[1]-clock[1])
+            if children_cpu_time() > children_cpu:
+                result.profile.add_stage('objdump', 0., children_cpu_time()-children_cpu)
+            result.profile.wall_time += disassembly_start[0]-clock[0]
+            result.profile.cpu_time += disassembly_start[1]-clock[1]
+        return result
+
+# Print the report for an analyzed binary
+def print_report(result, definitions_raw, full_stats):
+    extension_requirements = result.extension_requirements
+    instruction_count = result.instruction_count
+    if len(extension_requirements) == 0:
+        print(f"No special extensions are required to run {result.input_file}")
+    else:
+        if full_stats:
+            print(f"Full Instruction Statistics:")
+            def hash_cpuid(cpuid):
+                hash_answer = 0
+                for component in cpuid:
+                    hash_answer += hash(component)
+                return hash_answer
+            cpuid_name_hash_map = {}
+            cpuid_hash_map = {}
+            for def_hash in sorted(instruction_count.keys()):
+                definition = definitions_raw[def_hash]
+                cpuid_hash = hash_cpuid(definition.cpuid)
+                if cpuid_hash not in cpuid_name_hash_map:
+                    cpuid_name_hash_map[cpuid_hash] = {}
+                cpuid_name_hash_map[cpuid_hash][definition.name] = def_hash
+                if cpuid_hash not in cpuid_hash_map:
+                    cpuid_hash_map[cpuid_hash] = definition.cpuid
+
+            for cpuid_hash in sorted(list(cpuid_hash_map.keys())):
+                cpuid = cpuid_hash_map[cpuid_hash]
+                print(f"-- {cpuid} --")
+                for name in sorted(list(cpuid_name_hash_map[cpuid_hash].keys())):
+                    definition = definitions_raw[cpuid_name_hash_map[cpuid_hash][name]]
+                    print(f"{definition.name} -> {instruction_count[cpuid_name_hash_map[cpuid_hash][name]]}")
+        print("Extension Requirements:")
+        for cpuid_reqs in extension_requirements:
+            print(cpuid_reqs)
+        if result.uncertain:
+            print("WARNING: Ambiguous encodings are counted with the requirements of every definition they match, which may overstate them")
+
+# Print the warning listing unsupported instructions which were encountered
+def print_unsupported(unsupported_inst_encounters):
+    if len(unsupported_inst_encounters) != 0:
+        print("WARNING: The following instructions were encountered which are not supported")
+        for key in sorted(list(unsupported_inst_encounters)):
+            print(f'{key} -> {unsupported_inst_encounters[key]} times')
+
+# Check the requirements of a complete result against the allowed extensions, for
+# results which weren't analyzed with them, such as cached ones
+def check_policy(result, allowed):
+    if result.violation is None:
+        for cpuid_reqs in result.extension_requirements:
+            if not is_allowed(cpuid_reqs, allowed):
+                result.violation = PolicyViolation(None, None, None, cpuid_reqs)
+                break
+    return result.violation
+
+# Print the functions using each requirement list, in address order
+def print_functions(result):
+    if result.function_requirements is None or len(result.extension_requirements) == 0:
+        return
+    print("Functions by Extension Requirements:")
+    for cpuid_reqs in result.extension_requirements:
+        functions = result.function_requirements.get(tuple(cpuid_reqs), {})
+        print(f"-- {cpuid_reqs} --")
+        for (function, (count, first_address)) in sorted(functions.items(), key=lambda item: item[1][1]):
+            print(f"{function} -> {count} instructions, first at 0x{first_address:x}")
+
+def print_violation(result):
+    print(f"Policy violation in {result.input_file}: {result.violation}")
@@ -1,576 +1,84 @@
 import argparse
+import atexit
 import os
 import sys
 import subprocess
-import re
-import csv
 import progressbar
-import library as lib
-
-class InstructionDefinition(object):
-    def_col_idx = {'name':0, 'opcode':1, 'instruction':2,
-                   '64-val':3, '32-val':4, 'cpuid':5, 'val-mask':6}
-    plain_byte_matcher = re.compile('^[0-9A-F][0-9A-F]$')
-    immediate_operands = ['ib', 'iw', 'id', 'io' ]
-    opcode_byte_modifiers = ['+rb', '+rw', '+rd', '+ro']
-    code_segment_offset = [('cb', 1), ('cw', 2), ('cd', 4), ('cp', 6), ('co', 8), ('ct', 10)]
-    digit_matcher = re.compile('^/[0-7]$')
-    legacy_prefix_groups = [[0xF0, 0xF2, 0xF3],
-                            [0x2E, 0x36, 0x3E, 0x26, 0x64, 0x65, 0x2E, 0x3E],
-                            [0x66],
-                            [0x67]]
-    pseudo_op_maps = [(['cmpeqps', 'cmpltps', 'cmpleps', 'cmpunordps',
-                        'cmpneqps', 'cmpnltps', 'cmpnleps', 'cmpordps'],'cmpps'),
-                      (['vcmpeqps', 'vcmpltps', 'vcmpleps', 'vcmpunordps',
-                        'vcmpneqps', 'vcmpnltps', 'vcmpnleps', 'vcmpordps',
-                        'vcmpeq_uqps', 'vcmpngeps', 'vcmpngtps', 'vcmpfalseps',
-                        'vcmpneq_oqps', 'vcmpgeps', 'vcmpgtps', 'vcmptrueps',
-                        'vcmpeq_osps', 'vcmplt_oqps', 'vcmple_oqps', 'vcmpunord_sps',
-                        'vcmpneq_usps', 'vcmpnlt_uqps', 'vcmpnle_uqps', 'vcmpord_sps'
-                        'vcmpeq_usps', 'vcmpnge_uqps', 'vcmpngt_uqps', 'vcmpfalse_osps',
-                        'vcmpneq_osps', 'vcmpge_oqps', 'vcmpgt_oqps', 'vcmptrue_usps'], 'vcmpps'),
-                      (['cmpeqss', 'cmpltss', 'cmpless', 'cmpunordss',
-                        'cmpneqss', 'cmpnltss', 'cmpnless', 'cmpordss'], 'cmpss'),
-                      (['vcmpeqss', 'vcmpltss', 'vcmpless', 'vcmpunordss',
-                        'vcmpneqss', 'vcmpnltss', 'vcmpnless', 'vcmpordss',
-                        'vcmpeq_uqss', 'vcmpnegess', 'vcmpngtss', 'vcmpfalsess',
-                        'vcmpneq_oqss', 'vcmpgess', 'vcmpgtss', 'vcmptruess',
-                        'vcmpeq_osss', 'vcmplt_oqss', 'vcmple_oqss', 'vcmpunord_sss',
-                        'vcmpneq_usss', 'vcmpnlt_uqss', 'vcmpnle_uqss', 'vcmpord_sss',
-                        'vcmpeq_usss', 'vcmpeq_uqss', 'vcmpngt_uqss', 'vcmpfalse_osss',
-                        'vcmpneq_osss', 'vcmpge_oqss', 'vcmpgt_oqss', 'vcmptrue_usss'], 'vcmpss'),
-                      (['cmpeqpd', 'cmpltpd', 'cmplepd', 'cmpunordpd',
-                        'cmpneqpd', 'cmpnltpd', 'cmpnlepd', 'cmpordpd'], 'cmppd'),
-                      (['vcmpeqpd', 'vcmpltpd', 'vcmplepd', 'vcmpunordpd',
-                        'vcmpneqpd', 'vcmpnltpd', 'vcmpnlepd', 'vcmpordpd',
-                        'vcmpeq_uqpd', 'vcmpngepd', 'vcmpngtpd', 'vcmpfalsepd',
-                        'vcmpneq_oqpd', 'vcmpgepd', 'vcmpgtpd', 'vcmptruepd',
-                        'vcmpeq_ospd', 'vcmplt_oqpd', 'vcmple_oqpd', 'vcmpunord_spd',
-                        'vcmpneq_uspd', 'vcmpnlt_uqpd', 'vcmpnle_uqps', 'vcmpord_spd',
-                        'vcmpeq_uspd', 'vcmpnge_uqpd', 'vcmpngt_uqpd', 'vcmpfalse_ospd',
-                        'vcmpneq_ospd', 'vcmpge_oqpd', 'vcmpgt_oqpd', 'vcmptrue_uspd'], 'vcmppd'),
-                      (['cmpeqsd', 'cmpltsd', 'cmplesd', 'cmpunordsd',
-                        'cmpneqsd', 'cmpnltsd', 'cmpnlesd', 'cmpordsd'], 'cmpsd'),
-                      (['vcmpeqsd', 'vcmpltsd', 'vcmplesd', 'vcmpunordsd',
-                        'vcmpneqsd', 'vcmpnltsd', 'vcmpnlesd', 'vcmpordsd',
-                        'vcmpeq_uqsd', 'vcmpngesd', 'vcmpngtsd', 'vcmpfalsesd',
-                        'vcmpneq_oqsd', 'vcmpgesd', 'vcmpgtsd', 'vcmptruesd',
-                        'vcmpeq_ossd', 'vcmplt_oqsd', 'vcmple_oqsd', 'vcmpunord_ssd',
-                        'vcmpneq_ussd', 'vcmpnlt_uqsd', 'vcmpnle_uqsd', 'vcmpord_ssd',
-                        'vcmpeq_ussd', 'vcmpnge_uqsd', 'vcmpngt_uqsd', 'vcmpfalse_ossd',
-                        'vcmpneq_ossd', 'vcmpge_oqsd', 'vcmpgt_oqsd', 'vcmptrue_ussd'], 'vcmpsd'),
-                      (['vpcmpeq', 'vpcmplt', 'vpcmple', 'vpcmpneq',
-                        'vppcmpnlt', 'vpcmpnle'], 'vpcmp'),
-                      (['pclmullqlqdq', 'pclmulhqlqdq', 'pclmullqhqdq', 'pclmulhqhqdq'], 'pclmulqdq'),
-                      (['vpclmullqlqdq', 'vpclmulhqlqdq', 'vpclmullqhqdq', 'vpclmulhqhqdq'], 'vpclmulqdq')]
-    pseudo_op_maps += [ ([ ('vpcmp'+var+Type) for var in [ 'eq', 'lt', 'le', 'false', 'neq', 'nlt', 'nle', 'true' ]],('vpcmp'+Type)) for Type in [ 'b', 'd', 'q', 'w', 'ub', 'ud', 'uq', 'uw' ]]
-
-    def __init__(self, inrow=[]):
-        self._name = inrow[def_col_idx['name']]
-        self._opcode = inrow[def_col_idx['opcode']]
-        self._opcode_parts = self._opcode.split(' ')
-        self._instruction = inrow[def_col_idx['instruction']]
-        self._64val = inrow[def_col_idx['64-val']]
-        self._32val = inrow[def_col_idx['32-val']]
-        if inrow[def_col_idx['cpuid']] == '':
-            self._cpuid = []
-        else:
-            self._cpuid = inrow[def_col_idx['cpuid']].split('|')
-        self._valmasks = []
-        self.build_valmasks()
-
-    @property
-    def def_hash(self):
-        return hash(self.opcode+self.instruction)
-
-    @property
-    def name(self):
-        return self._name
-
-    @property
-    def opcode(self):
-        return self._opcode
-
-    @property
-    def instruction(self):
-        return self._instruction
-
-    @property
-    def val64(self):
-        return self._64val
-
-    @property
-    def val32(self):
-        return self._32val
-
-    @property
-    def cpuid(self):
-        return self._cpuid
-
-    @property
-    def valmasks(self):
-        return self._valmasks
-
-    # Build values/masks for this instruction
-    def build_valmasks(self):
-        # Initialize values and masks variables
-        self._valmasks = [[]]
-        valmasks = self._valmasks
-
-        # Retrieve instruction definition
-        op_i = 0
-        ex_prefix_defined = False
-
-        # Go through remaining opcode_parts
-        last_simple_i = op_i # We need to track this as +rb, +rw etcc modify the opcode.
-        mod_rm_i = -1
-        while op_i < len(self.opcode_parts):
-            if InstructionDefinition.plain_byte_matcher.match(self.opcode_parts[op_i]):
-                # We have a simple byte.
-                for valmask in valmasks:
-                    valmask.append((int(self.opcode_parts[op_i],16), 0xFF))
-                last_simple_i = op_i
-                op_i += 1
-            elif 'EX' in self.opcode_parts[op_i]:
-                # We have a REX, VEX, EVEX prefix.
-                if 'REX' == self.opcode_parts[op_i][0:3]:
-                    # REX prefix
-                    if 'REX' == self.opcode_parts[op_i]:
-                        for valmask in valmasks:
-                            valmask.append((0x40, 0xF0))
-                    elif 'REX.W' == self.opcode_parts[op_i] or 'REX.w' == self.opcode_parts[op_i]:
-                        for valmask in valmasks:
-                            valmask.append((0x48, 0xF8))
-                    elif 'REX.R' == self.opcode_parts[op_i]:
-                        for valmask in valmasks:
-                            valmask.append((0x42, 0xF2))
-                    else:
-                        raise RuntimeError("Unrecognized REX prefix!")
-                    op_i += 1
-                elif 'VEX' == self.opcode_parts[op_i][0:3]:
-                    # VEX prefix
-                    if len(valmasks) > 1:
-                        raise RuntimeError("Should only be one valmask at this point!")
-                    # Determine if we need to
-                    vex_parts = self.opcode_parts[op_i].split('.')[1:]
-                    three_byte_only = False
-
-                    # VEX.L
-                    if vex_parts[0] == '128':
-                        vex_l = 0
-                        vex_l_mask = 1
-                    elif vex_parts[0] == '256':
-                        vex_l = 1
-                        vex_l_mask = 1
-                    elif vex_parts[0] == 'LZ':
-                        vex_l = 0
-                        vex_l_mask = 1
-                    elif vex_parts[0] == 'LIG':
-                        # I'll just default this to 0..
-                        vex_l = 0
-                        vex_l_mask = 0
-                    elif vex_parts[0] == 'L1':
-                        vex_l = 1
-                        vex_l_mask = 1
-                    elif vex_parts[0] == 'L0':
-                        vex_l = 0
-                        vex_l_mask = 1
-                    else:
-                        raise RuntimeError(f"Unrecognized VEX.L! {vex_parts[0]} {self}")
-
-                    # VEX.pp
-                    if '66' in vex_parts:
-                        vex_pp = int('01', 2)
-                        vex_pp_mask = 0x3
-                    elif 'F3' in vex_parts:
-                        vex_pp = int('10', 2)
-                        vex_pp_mask = 0x3
-                    elif 'F2' in vex_parts:
-                        vex_pp = int('11', 2)
-                        vex_pp_mask = 0x3
-                    else:
-                        vex_pp = 0
-                        vex_pp_mask = 0
-
-                    # VEX.mmmmm
-                    vex_mmmmm_mask = 0x1F
-                    if '0F' in vex_parts:
-                        vex_mmmmm = int('00001', 2)
-                    elif '0F38' in vex_parts:
-                        vex_mmmmm = int('00010', 2)
-                        three_byte_only = True
-                    elif '0F3A' in vex_parts:
-                        vex_mmmmm = int('00011', 2)
-                        three_byte_only = True
-                    else:
-                        vex_mmmmm = 0 # I use this to imply that it isn't needed.
-
-                    # VEX.W
-                    if 'W0' in vex_parts:
-                        vex_w = 0
-                        vex_w_mask = 1
-                    elif 'W1' in vex_parts:
-                        vex_w = 1
-                        vex_w_mask = 1
-                        three_byte_only = True
-                    elif 'WIG' in vex_parts:
-                        vex_w = 0
-                        vex_w_mask = 0
-                    else:
-                        vex_w = 0
-                        vex_w_mask = 1
-
-                    if not three_byte_only:
-                        # Can use the 2-byte version
-                        valmask_base = valmasks[0].copy()
-                        valmasks[0].append((0xC5, 0xFF))
-                        valmasks[0].append(((vex_l << 2)+vex_pp,
-                                            (vex_l_mask << 2)+vex_pp_mask))
-
-                        valmasks.append(valmask_base)
-                        valmasks[1].append((0xC4, 0xFF))
-                        valmasks[1].append((vex_mmmmm, vex_mmmmm_mask))
-                        valmasks[1].append(((vex_w << 7)+(vex_l << 2)+vex_pp,
-                                            (vex_w_mask << 7)+(vex_l_mask << 2)+vex_pp_mask))
-                    else:
-                        # Must use the 3-byte version only
-                        valmasks[0].append((0xC4, 0xFF))
-                        valmasks[0].append((vex_mmmmm, vex_mmmmm_mask))
-                        valmasks[0].append(((vex_w << 7)+(vex_l << 2)+vex_pp,
-                                            (vex_w_mask << 7)+(vex_l_mask << 2)+vex_pp_mask))
-
-                    op_i += 1
-                elif 'EVEX' == self.opcode_parts[op_i][0:4]:
-                    # EVEX prefix
-                    if len(valmasks) > 1:
-                        raise RuntimeError("Should only be one valmask at this point!")
-                    # Determine if we need to
-                    evex_parts = self.opcode_parts[op_i].split('.')[1:]
-
-                    # EVEX.LL
-                    if evex_parts[0] == '128':
-                        evex_ll = 0
-                        evex_ll_mask = 0x3
-                    elif evex_parts[0] == '256':
-                        evex_ll = 1
-                        evex_ll_mask = 0x3
-                    elif evex_parts[0] == '512':
-                        evex_ll = 2
-                        evex_ll_mask = 0x3
-                    elif evex_parts[0] == 'LIG':
-                        # I'll just default this to 0..
-                        evex_ll = 0
-                        evex_ll_mask = 0
-
-                    # EVEX.pp
-                    if '66' in evex_parts:
-                        evex_pp = int('01', 2)
-                        evex_pp_mask = 0x3
-                    elif 'F3' in evex_parts:
-                        evex_pp = int('10', 2)
-                        evex_pp_mask = 0x3
-                    elif 'F2' in evex_parts:
-                        evex_pp = int('11', 2)
-                        evex_pp_mask = 0x3
-                    else:
-                        evex_pp = 0
-                        evex_pp_mask = 0
-
-                    # EVEX.mmm
-                    evex_mm_mask = 0x3
-                    if '0F' in evex_parts:
-                        evex_mm = int('01', 2)
-                    elif '0F38' in evex_parts:
-                        evex_mm = int('10', 2)
-                    elif '0F3A' in evex_parts:
-                        evex_mm = int('11', 2)
-                    else:
-                        raise RuntimeError("EVEX docs indicates the mm mask should never be empty.")
-
-                    # EVEX.W
-                    if 'W0' in evex_parts:
-                        evex_w = 0
-                        evex_w_mask = 1
-                    elif 'W1' in evex_parts:
-                        evex_w = 1
-                        evex_w_mask = 1
-                    elif 'WIG' in evex_parts:
-                        evex_w = 0
-                        evex_w_mask = 0
-                    else:
-                        # Lets look for this case until we're sure in the wild
-                        evex_w = 0
-                        evex_w_mask = 1
-    
-                    for valmask in valmasks:
-                        valmask.append((0x62, 0xFF))
-                        valmask.append((evex_mm, evex_mm_mask))
-                        valmask.append(((evex_w << 7)+evex_pp,(evex_w_mask << 7)+evex_pp_mask))
-                        valmask.append(((evex_ll << 5), (evex_ll_mask << 5)))
-                    op_i += 1
-                else:
-                    raise RuntimeError("Unrecognized prefix!!")
-                # Indicate that a 'EX' prefix has been defined.
-                ex_prefix_defined = True
-            elif '/is4' == self.opcode_parts[op_i]:
-                # is4 is another immediate byte
-                for valmask in valmasks:
-                    valmask.append((0x0, 0x0))
-                op_i += 1
-            elif 'imm8' == self.opcode_parts[op_i]:
-                # imm8 is an immediate byte
-                for valmask in valmasks:
-                    valmask.append((0x0, 0x0))
-                op_i += 1
-            elif 'NP' == self.opcode_parts[op_i]:
-                # Can't use 0x66, 0xF2, or 0xF3 with this instruction
-                op_i += 1
-            elif 'NFx' == self.opcode_parts[op_i]:
-                # Can't use 0xF2 or 0xF3 with this instruction
-                op_i += 1
-            elif True in [True if im_op in self.opcode_parts[op_i] else False for im_op in InstructionDefinition.immediate_operands]:
-                # we have an immediate operand
-                found = False
-                i = 0
-                while i < len(InstructionDefinition.immediate_operands):
-                    if InstructionDefinition.immediate_operands[i] in self.opcode_parts[op_i]:
-                        for j in range(2**i):
-                            # Could be anything
-                            for valmask in valmasks:
-                                valmask.append((0x00, 0x00))
-                        op_i += 2**i
-                        found = True
-                        break
-                    i += 1
-                if not found:
-                    raise RuntimeError("Didn't correctly handle immediate operand!")
-            elif True in [True if op_mod in self.opcode_parts[op_i] else False for op_mod in InstructionDefinition.opcode_byte_modifiers]:
-                for i in range(len(valmasks)):
-                    valmask = valmasks[i]
-                    valmask[-1] = (valmask[-1][0] & 0xF8, # Remove bottom 3 bits from value
-                                   valmask[-1][1] & 0xF8) # Remove bottom 3 bits from mask
-                op_i += 1
-            elif True in [True if cs_so in self.opcode_parts[op_i] else False for (cs_so, _) in InstructionDefinition.code_segment_offset]:
-                for (cs_so, cs_size) in InstructionDefinition.code_segment_offset:
-                    if cs_so in self.opcode_parts[op_i]:
-                        for valmask in valmasks:
-                            for i in range(cs_size):
-                                valmask.append((0x0, 0x0))
-                        break
-                op_i += 1
-            elif InstructionDefinition.digit_matcher.match(self.opcode_parts[op_i]):
-                digit = int(self.opcode_parts[op_i][1:])
-                # We add a val and mask for the ModR/M byte.
-                # mmrrrbbb the digit goes into the reg(r) field.
-                for valmask in valmasks:
-                    valmask.append((digit << 3,0x38))
-                mod_rm_i = op_i # Record that we have a mod_rm byte.
-                op_i += 1
-            elif '/r' == self.opcode_parts[op_i]:
-                # From manual: Indicates that the ModR/M byte of the instruction
-                # contains a register operand and an r/m operand
-                # This doesn't really change our processing of the ModR/M byte
-
-                # We can however, add an 'open' modrm byte
-                if mod_rm_i == -1:
-                    # No requirement on the value means the mask will zero it out.
-                    for valmask in valmasks:
-                        valmask.append((0x00,0x00))
-                    op_i += 1
-            elif '+i' == self.opcode_parts[op_i]:
-                # We need to remove 3 bits from the previous opcode.
-                for i in range(len(valmasks)):
-                    valmask = valmasks[i]
-                    valmask[-1] = (valmask[-1][0] & 0xF8, valmask[-1][1] & 0xF8)
-                op_i += 1
-            else:
-                raise RuntimeError(f"Unrecognized opcode part {op_i} {self.opcode_parts[op_i]}")
-
-    def valmask_string(self):
-        res_string = ""
-        begin = True
-        for valmask in self.valmasks:
-            if not begin:
-                res_string += " | "
-            if begin:
-                begin = False
-            valmask_string = ""
-            begin_valmask = True
-            for (val, mask) in valmask:
-                if not begin_valmask:
-                    valmask_string += ", "
-                if begin_valmask:
-                    begin_valmask = False
-                valmask_string += f"{val:02X}:{mask:02X}"
-            res_string += valmask_string
-        return res_string
-
-    @staticmethod
-    def valmask_check_match(valmask, inst_bytes):
-        match = True
-        for j in range(min(len(valmask), len(inst_bytes))):
-            (val, mask) = valmask[j]
-            inst_byte = int(inst_bytes[j], 16)
-            if (inst_byte&mask) != val:
-                match = False
-                break
-        return match
-
-    def plain_match_strategy(self, inst_bytes):
-        # Check for match to instruction
-        match = True
-        for valmask in self.valmasks:
-            match = InstructionDefinition.valmask_check_match(valmask, inst_bytes)
-            if match:
-                break
-        return (match, 0)
-
-    def extra_rex_match_strategy(self, inst_bytes):
-        # Check for initial REX byte.
-        val = 0x40
-        mask = 0xF0
-
-        if val == int(inst_bytes[0], 16)&mask:
-            # we have an initial REX prefix
-            match = True
-            for valmask in self.valmasks:
-                match = InstructionDefinition.valmask_check_match(valmask, inst_bytes[1:])
-                if match:
-                    break
-            return (match, 1)
-        else:
-            return (False, 1)
-
-    def extra_legacy_prefix_match_strategy(self, inst_bytes):
-        if self.instruction.split(' ')[0] == 'NP':
-            check_NP = True
-        else:
-            check_NP = False
-
-        if self.instruction.split(' ')[0] == 'NFx':
-            check_NFx = True
-        else:
-            check_NFx = False
-
-        prefixes_exhausted = False
-        num_prefixes = 0
-        while not prefixes_exhausted:
-            prefixes_exhausted = True
-            prefix_search_terminate = False
-            for legacy_prefix_group in InstructionDefinition.legacy_prefix_groups:
-                for prefix in legacy_prefix_group:
-                    if check_NP:
-                        if prefix in [0x66, 0xF2, 0xF3]:
-                            # These prefixes are not allowed for this instruction.
-                            continue
-                    if check_NFx:
-                        if prefix in [0xF2, 0xF3]:
-                            # These prefixes are not allowed for this instruction.
-                            continue
-    
-                    if int(inst_bytes[num_prefixes],16) == prefix:
-                        # This prefix is here!
-                        prefixes_exhausted = False
-                        prefix_search_terminate = True
-                        num_prefixes += 1
-
-                        match = True
-                        for valmask in self.valmasks:
-                            match = InstructionDefinition.valmask_check_match(valmask, inst_bytes[num_prefixes:])
-                            if match:
-                                break
-                        if match:
-                            return (match, num_prefixes)
-                    if prefix_search_terminate:
-                        break
-                if prefix_search_terminate:
-                    break
-        # We didn't find a match..
-        return (False, num_prefixes)
-
-    def insert_rex_strategy(self, inst_bytes):
-        for valmask in self.valmasks:
-            # Test whether the initial byte in the definition is a legacy prefix.
-            is_legacy_prefix = False
-            v_i = 0
-            i_i = 0
-            for legacy_prefix_group in InstructionDefinition.legacy_prefix_groups:
-                for prefix in legacy_prefix_group:
-                    if valmask[v_i][0] == prefix:
-                        is_legacy_prefix = True
-                        break
-                if is_legacy_prefix:
-                    break
-            if not is_legacy_prefix:
-                return (False, 0)
-
-            # Check for the matching prefix in the instruction bytes
-            if valmask[v_i][0] != int(inst_bytes[i_i],16):
-                return (False, 0)
-
-            v_i += 1
-            i_i += 1
-
-            # Test for an inserted rex byte.
-            if int(inst_bytes[i_i],16)&0xF0 != 0x40:
-                return (False, 0)
-            i_i += 1
-
-            # Check for match on the rest.
-            match = InstructionDefinition.valmask_check_match(valmask[v_i:], inst_bytes[i_i:])
-            if match:
-                break
-        return (match, 1)
-
-    def get_match_strategies(self):
-        return [self.plain_match_strategy,
-                self.extra_rex_match_strategy,
-                self.extra_legacy_prefix_match_strategy,
-                self.insert_rex_strategy]
-
-    def check_for_match(self, inst_bytes, file_type='64'):
-        # Check whether this instruction is appropriate for this file type
-        if self.val64 != 'V':
-            return False
-
-        match = False
-        strat_result = None
-        for strategy in self.get_match_strategies():
-            strat_result = strategy(inst_bytes)
-            if strat_result[0]:
-                return strat_result
-
-        return strat_result
-
-    @property
-    def opcode_parts(self):
-        return self._opcode_parts
-
-    def __repr__(self):
-        return f"{self._name} {self.opcode_parts} \"{self._instruction}\" 64:{self.val64} 32:{self.val32} {self.cpuid} {self.valmask_string()}"
+from instruction_definitions import load_definitions, load_compiled_definitions
+from instruction_matching import matchers
+from disassembly import objdump_disassemble, sharded_objdump_disassemble, elf_disassemble
+from extension_analysis import ExtensionAnalyzer, print_report, print_functions, print_unsupported, check_policy, print_violation
+from batch_analysis import find_binaries, read_file_list, analyze_binaries, analyze_binaries_async, BatchSummary
+from result_cache import ResultCache, binary_key, analysis_fingerprint
+from dependencies import DependencyResolver, merge_closure_results
+from cpu_policy import parse_allowed, policy_presets
+from json_report import JsonReporter
+from scan_profile import ScanProfile
 
 parser = argparse.ArgumentParser("Tool to get the instruction extensions required for a given program.")
 
-parser.add_argument("-i", "--input", help="The binary file to inspect", type=str, required=True)
+parser.add_argument("-i", "--input", help="The binary file to inspect. Several files or directories scan every 64 bit x86 ELF file among them in batch mode", type=str, nargs='+', default=[])
+parser.add_argument("--file-list", help="File listing binaries or directories to scan in batch mode, one per line. - reads the list from stdin", type=str)
+parser.add_argument("--processes", help="Number of processes analyzing binaries in parallel in batch mode", type=int, default=os.cpu_count())
 parser.add_argument("-d", "--definitions", help="The file containing instruction definitions. Should be a .csv file", default="instructions_fixed.csv")
+parser.add_argument("--compiled-definitions", help="Compiled definitions file from compile_definitions.py, used instead of the .csv file when up to date. Defaults to the definitions file with a .bin extension", type=str)
 parser.add_argument("-v", "--verbose", help="Verbose output", action='store_true')
 parser.add_argument("-p", "--progress", help="Show progress", action='store_true')
 parser.add_argument("-c", "--careful", help="Scrutinize all instructions instead of just non-trivial requirement instructions", action='store_true')
+parser.add_argument("--disassembler", help="Disassembler to use. builtin decodes the ELF file in process instead of running objdump", choices=['objdump', 'builtin'], default='objdump')
 parser.add_argument("--objdump-location", help="Location of object dump command to use", type=str)
+parser.add_argument("--disassemblers", help="Number of objdump processes run at once in batch mode, each streaming its output to an analysis process", type=int, default=os.cpu_count())
+parser.add_argument("--timeout", help="Seconds a binary may take to disassemble and analyze in batch mode with objdump, counted from when an analysis process takes it, before it's reported as failed", type=float)
+parser.add_argument("-j", "--jobs", help="Number of objdump processes to run in parallel. Above 1 the executable sections are sharded at function boundaries", type=int, default=1)
 parser.add_argument("--full-stats", help="Record and report full instruction stats", action='store_true')
+parser.add_argument("--memo-size", help="Maximum number of resolved instruction encodings to remember. 0 disables the memo", type=int, default=65536)
+parser.add_argument("--no-dedup", help="Resolve every instruction as it streams in, instead of collapsing each binary into its unique encodings first", action='store_true')
+parser.add_argument("--dependencies", help="Also analyze the shared libraries each binary loads and report their combined requirements. Each library is analyzed once per run", action='store_true')
+parser.add_argument("--allow", help=f"Extensions binaries may use, as comma separated extension names or presets ({', '.join(sorted(policy_presets))} or host for this machine). Analysis stops at the first instruction needing anything else and exits with status 2", type=str, action='append')
+parser.add_argument("--result-cache", help="SQLite file caching results by build-id or content hash, so unchanged binaries aren't disassembled again", type=str)
+parser.add_argument("--output-format", help="Report format. ndjson streams one JSON record per line as results become available, json writes one document at the end. Other messages go to stderr", choices=['text', 'ndjson', 'json'], default='text')
+parser.add_argument("--instruction-hits", help="Report the address, mnemonic and bytes of every instruction with extension requirements in the ndjson and json formats", action='store_true')
+parser.add_argument("--functions", help="Attribute the instructions with extension requirements to their functions, using the ELF symbol tables", action='store_true')
+parser.add_argument("--profile", help="Record wall and CPU time per stage, matching counters, the mnemonics taking longest to resolve and peak memory use, reported at the end", action='store_true')
+parser.add_argument("--matcher", help="Engine used to match instruction bytes against candidate definitions", choices=sorted(matchers), default='trie')
+parser.add_argument("--strategy-stats", help="File the adaptive matcher keeps its match strategy statistics in between runs", type=str,
+                    default=os.path.join(os.path.expanduser('~'), '.cache', 'binx86ext', 'strategy_stats.json'))
 
 args = parser.parse_args()
 
+# Machine readable reports get stdout to themselves, everything else printed goes to stderr
+report_stream = sys.stdout
+if args.output_format != 'text':
+    sys.stdout = sys.stderr
+
 # Input Validation
-if not os.path.isfile(args.input):
-    print(f"Input file {args.input} doesn't exist or is a directory!")
+input_paths = list(args.input)
+if args.file_list is not None:
+    if args.file_list != '-' and not os.path.isfile(args.file_list):
+        print(f"File list {args.file_list} doesn't exist or is a directory!")
+        sys.exit(0)
+    input_paths += read_file_list(args.file_list)
+
+if len(input_paths) == 0:
+    print("No input files given!")
     sys.exit(0)
 
+# Batch mode scans every binary found in the inputs with the definitions loaded once
+batch_mode = len(input_paths) > 1 or args.file_list is not None or os.path.isdir(input_paths[0])
+
+for input_path in input_paths:
+    if not os.path.exists(input_path) or (not batch_mode and os.path.isdir(input_path)):
+        print(f"Input file {input_path} doesn't exist or is a directory!")
+        sys.exit(0)
+
+if args.processes < 1 or args.disassemblers < 1:
+    print("At least one process and one disassembler are needed!")
+    sys.exit(1)
+
 if not os.path.isfile(args.definitions):
     print(f"Definitions file {args.definitions} doesn't exist or is a directory!")
     sys.exit(0)
 
-input_file = args.input
 definitions_file = args.definitions
 verbose = args.verbose
 progress = args.progress
@@ -581,307 +89,294 @@ full_stats = args.full_stats
 # We need to find an appropriate dissassembler
 disassemble = None
 
+if disassemble is None and args.disassembler == 'builtin':
+    disassemble = elf_disassemble
+
 if disassemble is None:
     if args.objdump_location is None:
         objdump_location = subprocess.check_output(['which', 'objdump']).decode().strip()
     else:
         objdump_location = args.objdump_location
 
-    def objdump_disassemble(binary_path):
-        global objdump_location
-        disassembly_lines = subprocess.check_output([objdump_location,
-                                                     '--disassemble',
-                                                     '-M', 'intel',
-                                                     binary_path]).decode().split('\n')
-
-        file_mode = None
-        match_res = re.search(r'file format ([\S]*)', disassembly_lines[1])
-        if match_res is None:
-            print(f"Wrongly formatted output!")
-            return None
-        file_types_64 = ['elf64-x86-64']
-        file_type = match_res.group(1)
-        if file_type in file_types_64:
-            file_mode = '64'
-        else:
-            print(f"Unsupported file type {file_type}!")
-            return None
-
-        # Extract instructions and match with definitions
-        instruction_heading_matcher = re.compile(r'^ [0-9a-f]*:$')
-        instruction_list = []
-        for line in disassembly_lines:
-            tab_list = line.split('\t')
-            if len(tab_list) == 3:
-                if instruction_heading_matcher.match(tab_list[0]):
-                    # We have a line which is an instruction
-                    inst_name_portion = tab_list[2].strip()
-                    inst_name = inst_name_portion.split(' ')[0]
-
-                    # Get byte stream
-                    inst_bytes = tab_list[1].strip().upper().split(' ')
-                    instruction_list.append((inst_name, inst_bytes, inst_name_portion))
-
-        return (file_mode, instruction_list)
-    disassemble = objdump_disassemble
+    def objdump_disassemble_input(binary_path):
+        if args.jobs > 1:
+            return sharded_objdump_disassemble(binary_path, objdump_location, args.jobs)
+        return objdump_disassemble(binary_path, objdump_location)
+    disassemble = objdump_disassemble_input
 
 
 if disassemble is None:
     print("Couldn't find an appropriate disassembly tool")
     sys.exit(1)
 
-# Load instruction definition data
-definitions_raw = {}
-supported_duplicates = ['JZ', 'LEAVE', 'POP', 'REP']
-def_col_idx = {'name':0, 'opcode':1, 'instruction':2,
-                  '64-val':3, '32-val':4, 'cpuid':5, 'val-mask':6}
-with open(definitions_file, 'r') as def_file:
-    def_reader = csv.reader(def_file, delimiter=',', quotechar='"')
-
+# Load instruction definition data, preferring an up to date compiled definitions file
+compiled_definitions_file = args.compiled_definitions
+if compiled_definitions_file is None:
+    compiled_definitions_file = os.path.splitext(definitions_file)[0]+'.bin'
+
+definitions_raw = None
+if os.path.isfile(compiled_definitions_file):
+    try:
+        definitions_raw = load_compiled_definitions(compiled_definitions_file, definitions_file)
+    except RuntimeError as e:
+        print(f"WARNING: {e}")
+    if definitions_raw is None:
+        print(f"WARNING: {compiled_definitions_file} is stale, falling back to {definitions_file}")
+    elif verbose:
+        print(f"Using compiled definitions {compiled_definitions_file}")
+
+if definitions_raw is None:
+    try:
+        definitions_raw = load_definitions(definitions_file, verbose=verbose)
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+reporter = None
+if args.output_format != 'text':
+    reporter = JsonReporter(report_stream, args.output_format, definitions_raw)
+
+# Extensions binaries are allowed to use
+allowed = None
+if args.allow is not None:
+    known_extensions = set(extension for definition in definitions_raw.values() for extension in definition.cpuid)
+    try:
+        allowed = parse_allowed(args.allow, known_extensions)
+    except (ValueError, RuntimeError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
     if verbose:
-        print("==== Registering Instructions: ====")
-
-    begin = True
-    for row in def_reader:
-        if begin:
-            begin = False
-            continue
-
-        definition = InstructionDefinition(inrow=row)
-
-        if definition.def_hash in definitions_raw:
-            if row[def_col_idx['name']] not in supported_duplicates:
-                print("ERROR: instruction definitions had a hash collision")
-                print(f"row {row}")
-                print(f"collided with {definitions_raw[def_hash]}")
-                sys.exit(1)
-        else:
-            if verbose:
-                print(f"{definition}")
-            definitions_raw[definition.def_hash] = definition
-
-# Group instruction definitions
-def_name_dict = {}
-unsupported_instructions = ['repz', 'data16', 'data32', 'movabs', 'endbr66', 'movbe']
-for def_hash in definitions_raw:
-    definition = definitions_raw[def_hash]
-    name = definition.name.lower()
-    if name in unsupported_instructions:
-        continue
-    if name not in def_name_dict:
-        def_name_dict[name] = [def_hash]
+        print(f"Allowed extensions: {sorted(allowed)}")
+
+# Results of binaries which were already analyzed with the same definitions and options
+result_cache = None
+if args.result_cache is not None:
+    result_cache = ResultCache(args.result_cache)
+    fingerprint = analysis_fingerprint(definitions_file, args.disassembler, careful)
+
+analyzer = ExtensionAnalyzer(definitions_raw, matcher=args.matcher, careful=careful, memo_size=args.memo_size, full_stats=full_stats, allowed=allowed, record_hits=args.instruction_hits, attribute_functions=args.functions,
+                             profile=args.profile, dedup=not args.no_dedup)
+
+if verbose:
+    # Pseudo-ops share the plan of their target
+    plans = set(plan for (name, plan) in analyzer.plans.items() if name is not None and not plan.segment_override)
+    num_trivial = sum(1 for plan in plans if plan.trivial)
+    num_uniform = sum(1 for plan in plans if plan.uniform and not plan.trivial)
+    print(f"Candidate plans: {num_trivial} trivial, {num_uniform} requirement uniform, {len(plans)-num_trivial-num_uniform} with decision tables")
+    for plan in sorted(plans, key=lambda plan: plan.target):
+        for (hash_a, hash_b) in plan.unresolved_pairs(definitions_raw):
+            print(f"WARNING: {plan.target} candidates with differing requirements can't be told apart: "
+                  f"{definitions_raw[hash_a]} and {definitions_raw[hash_b]}")
+
+# The adaptive matcher starts from the statistics of earlier runs. Batch worker
+# processes hand what they learn back with their results.
+if hasattr(analyzer.matcher, 'load'):
+    analyzer.matcher.load(args.strategy_stats)
+    atexit.register(analyzer.matcher.save, args.strategy_stats)
+
+# Profile of every binary analyzed in this run
+run_profile = None
+if args.profile:
+    run_profile = ScanProfile()
+
+def add_profile(result):
+    if run_profile is None or result is None:
+        return
+    if result.profile is None:
+        run_profile.count('cached results')
     else:
-        def_name_dict[name].append(def_hash)
-
-# Disassemble input file
-(file_type, instruction_list) = disassemble(input_file)
-
-
-if file_type != '64':
-    raise RuntimeError("binary types other than 64 bit are not supported at this time.")
-
-# A list of unsupported instructions which were encountered and how often
-unsupported_inst_encounters = {}
+        run_profile.merge(result.profile)
+
+def report_profile():
+    if run_profile is None:
+        return
+    run_profile.update_peak_rss()
+    if reporter is not None:
+        reporter.profile(run_profile)
+    else:
+        run_profile.print()
+
+# Analyze binaries, answering from the result cache where possible. handle_result is
+# called with the path, result, captured output and error of each binary as it finishes.
+def analyze_cached(binaries, handle_result):
+    binary_keys = {}
+    if result_cache is not None:
+        uncached_binaries = []
+        for input_file in binaries:
+            binary_keys[input_file] = binary_key(input_file)
+            result = result_cache.lookup(binary_keys[input_file], fingerprint, input_file, definitions_raw, full_stats, args.functions)
+            if result is None:
+                uncached_binaries.append(input_file)
+            else:
+                if allowed is not None:
+                    check_policy(result, allowed)
+                add_profile(result)
+                handle_result(input_file, result, "Using cached result\n" if verbose else '', None)
+        binaries = uncached_binaries
+
+    # A single objdump per binary is run from an event loop, so timeouts can stop it
+    if args.disassembler == 'objdump' and args.jobs <= 1:
+        results = analyze_binaries_async(binaries, analyzer, objdump_location, args.processes, args.disassemblers, args.timeout)
+    else:
+        results = analyze_binaries(binaries, analyzer, disassemble, args.processes)
+    for (input_file, result, output, error) in results:
+        add_profile(result)
+        # Analyses stopped by a policy violation are incomplete, so aren't cached
+        if result_cache is not None and error is None and result.violation is None:
+            result_cache.store(binary_keys[input_file], fingerprint, result, definitions_raw, full_stats)
+        handle_result(input_file, result, output, error)
+
+if args.dependencies:
+    executables = find_binaries(input_paths)
+    resolver = DependencyResolver()
+    closures = {}
+    for executable in executables:
+        closures[executable] = resolver.closure(executable)
+
+    # Every library is analyzed once, however many executables load it
+    binaries = find_binaries(executables+[library for (libraries, _) in closures.values() for library in libraries])
+    if verbose:
+        print(f"Found {len(executables)} binaries loading {len(binaries)-len(executables)} more libraries")
 
-byte_matcher = re.compile(r'[0-9A-F][0-9A-F]')
+    if progress:
+        bar = progressbar.ProgressBar(max_value=len(binaries), redirect_stdout=True)
+        bar.start()
 
-extension_requirements = []
-instruction_count = lib.counting_dict()
+    results = {}
+    def collect_result(input_file, result, output, error):
+        print(output, end='')
+        results[input_file] = (result, error)
+        if reporter is not None:
+            reporter.binary(input_file, result, error)
+        if progress:
+            bar.update(len(results))
 
-# Primary program loop. Here we are looping through each line of the disassembly output
+    analyze_cached(binaries, collect_result)
 
-if progress:
-    bar_widgets = [
-        progressbar.Bar(),
-        progressbar.Counter(format='%(value)i/%(max_value)i')
-    ]
-    bar = progressbar.ProgressBar(max_value=len(instruction_list), widgets=bar_widgets, redirect_stdout=True)
-    bar.start()
+    if progress:
+        bar.finish()
+
+    incomplete = False
+    violated = False
+    for executable in executables:
+        (libraries, missing) = closures[executable]
+        (merged, requiring, failed) = merge_closure_results(executable, libraries, results)
+        violations = [(binary, results[binary][0].violation) for binary in [executable]+libraries
+                      if results[binary][0] is not None and results[binary][0].violation is not None]
+        if len(missing) != 0 or len(failed) != 0:
+            incomplete = True
+        if len(violations) != 0:
+            violated = True
+
+        if reporter is not None:
+            reporter.dependencies(executable, libraries, missing, merged, requiring, failed, violations)
+            continue
 
-inst_mem_matcher = re.compile('m(32|64|128)')
+        print(f"== {executable} ==")
+        print(f"Loads {len(libraries)} libraries")
+        if len(merged.extension_requirements) == 0:
+            print(f"No special extensions are required to run {executable} and its libraries")
+        else:
+            print("Extension Requirements:")
+            for cpuid_reqs in merged.extension_requirements:
+                print(f"{cpuid_reqs} <- {', '.join(os.path.basename(binary) for binary in requiring[tuple(cpuid_reqs)])}")
+        print_unsupported(merged.unsupported_inst_encounters)
+        if len(missing) != 0:
+            print(f"WARNING: Libraries which couldn't be found: {', '.join(missing)}")
+        for (binary, error) in failed:
+            print(f"ERROR: {binary}: {error}")
+        for (binary, _) in violations:
+            print_violation(results[binary][0])
+
+    report_profile()
+    if reporter is not None:
+        reporter.close()
+    sys.exit(2 if violated else (1 if incomplete else 0))
+
+if batch_mode:
+    binaries = find_binaries(input_paths)
+    if verbose:
+        print(f"Found {len(binaries)} binaries to scan")
 
-inst_num = 0
-for (inst_name, inst_bytes, inst_decode) in instruction_list:
-    inst_num += 1
     if progress:
-        bar.update(inst_num)
-    # Check whether this instruction is unsupported
-    if inst_name in unsupported_instructions:
-        if inst_name not in unsupported_inst_encounters:
-            unsupported_inst_encounters[inst_name] = 1
+        bar = progressbar.ProgressBar(max_value=len(binaries), redirect_stdout=True)
+        bar.start()
+
+    summary = BatchSummary()
+    def report_binary(input_file, result, output, error):
+        if reporter is None:
+            print(f"== {input_file} ==")
+        print(output, end='')
+        if reporter is not None:
+            reporter.binary(input_file, result, error)
+        elif error is None and result.violation is not None:
+            print_violation(result)
+        elif error is None:
+            print_report(result, definitions_raw, full_stats)
+            print_functions(result)
+            print_unsupported(result.unsupported_inst_encounters)
         else:
-            unsupported_inst_encounters[inst_name] += 1
-        continue
-
-    # Get list of candidate hashes
-    cand_records = []
-    while True:
-        try:
-            for def_hash in def_name_dict[inst_name]:
-                if definitions_raw[def_hash].val64 == 'V':
-                    cand_records.append((def_hash,0))
-            break
-        except KeyError as e:
-            tryagain = False
-            for (pseudo_op_map,target) in InstructionDefinition.pseudo_op_maps:
-                if inst_name in pseudo_op_map:
-                    inst_name = target
-                    tryagain = True
-                    break
-            if not tryagain:
-                if inst_name in ['cs', 'ds']:
-                    # Chance this is a jump with a segment override.
-                    inst_name = inst_decode.split(' ')[1]
-                    tryagain = True
-            if not tryagain:
-                print(f"Couldn't find instruction {inst_name}({inst_num})! {inst_bytes} {inst_decode}")
-                raise e
-        
-    # Check whether any candidate has a non-trivial extension requirement
-    if not args.careful:
-        is_nontrivial = False
-        for cand_record in cand_records:
-            definition = definitions_raw[cand_record[0]]
-            if definition.cpuid != []:
-                is_nontrivial = True
-                break
-        if not is_nontrivial:
-            # Skip trivial instruction
-            continue
+            print(f"ERROR: {error}")
+        summary.add(input_file, result, error)
+        if progress:
+            bar.update(summary.num_binaries)
 
-    # Attempt to match each hash's valmask to the instruction bytes.
-    i = 0
-    while i < len(cand_records):
-        # Fetch definition
-        definition = definitions_raw[cand_records[i][0]]
+    analyze_cached(binaries, report_binary)
 
-        def_match = definition.check_for_match(inst_bytes)
-        if not def_match[0]:
-            del cand_records[i]
-        else:
-            cand_records[i] = (cand_records[i][0], def_match[1])
-            i += 1
-
-    if len(cand_records) == 0:
-        print("Problem instruction binary:")
-        for byte in inst_bytes:
-            by_num = int(byte, 16)
-            print(f"{by_num:08b}")
-        raise RuntimeError(f"No candidates for this instruction ({inst_num})! {inst_name} {inst_bytes}")
-
-    # Prune list of candidates to the candidate which had the fewest additional prefixes
-    fewest_prefixes = None
-    for cand_record in cand_records:
-        if fewest_prefixes is None:
-            fewest_prefixes = cand_record[1]
-        else:
-            if cand_record[1] < fewest_prefixes:
-                fewest_prefixes = cand_record[1]
-    i = 0
-    while i < len(cand_records):
-        if cand_records[i][1] > fewest_prefixes:
-            del cand_records[i]
-        else:
-            i += 1
-
-    # Check that the remaining candidates have identical extension requirements
-    uniform_requirements = True
-    for i in range(len(cand_records)-1):
-        def_i = definitions_raw[cand_records[i][0]]
-        for j in range(i,len(cand_records)):
-            def_j = definitions_raw[cand_records[j][0]]
-            if def_i.cpuid != def_j.cpuid:
-                uniform_requirements = False
-                break
-        if not uniform_requirements:
-            break
-
-    if not uniform_requirements:
-        uniform_req_failure = True
-        # Strategies to resolve Final ambiguities
-        if len(cand_records) == 2:
-            # Can do something for these cases.
-            # Check for differing instruction statements.
-            def_a = definitions_raw[cand_records[0][0]]
-            def_b = definitions_raw[cand_records[1][0]]
-            if def_a.instruction != def_b.instruction:
-                res_a = inst_mem_matcher.search(def_a.instruction)
-                res_b = inst_mem_matcher.search(def_b.instruction)
-                # Check that one has a memory specifier and the other doesn't
-                def_a_mem = True if inst_mem_matcher.search(def_a.instruction) else False
-                def_b_mem = True if inst_mem_matcher.search(def_b.instruction) else False
-                if def_a_mem != def_b_mem:
-                    # Check that the disassembler tells us an operand is a memory pointer.
-                    uniform_req_failure = False
-                    if 'PTR' in inst_decode:
-                        # We want the memory version
-                        if def_a_mem:
-                            # Eliminate b
-                            del cand_records[1]
-                        else:
-                            # Eliminate a
-                            del cand_records[0]
-                    else:
-                        # We want the xmm-ymm version
-                        if def_a_mem:
-                            # Eliminate a
-                            del cand_records[0]
-                        else:
-                            # Eliminate b
-                            del cand_records[1]
-
-        if uniform_req_failure:
-            print(f"Candidates for instruction ({inst_num}) {inst_name}, {inst_bytes}, {inst_decode}")
-            for byte in inst_bytes:
-                by_num = int(byte, 16)
-                print(f"{by_num:08b}")
-            for cand_record in cand_records:
-                print(f"{definitions_raw[cand_record[0]]}")
-            raise RuntimeError("Error, not all candidates have the same cpuid requirements!")
-
-    cpuid_reqs = definitions_raw[cand_records[0][0]].cpuid
-    if full_stats:
-    	instruction_count[cand_records[0][0]] += 1
-    if len(cpuid_reqs) != 0:
-        if cpuid_reqs not in extension_requirements:
-            extension_requirements.append(cpuid_reqs)
-
-if progress:
-    bar.finish()
-
-if len(extension_requirements) == 0:
-    print(f"No special extensions are required to run {input_file}")
-else:
-    if full_stats:
-        print(f"Full Instruction Statistics:")
-        def hash_cpuid(cpuid):
-            hash_answer = 0
-            for component in cpuid:
-                hash_answer += hash(component)
-            return hash_answer
-        cpuid_name_hash_map = {}
-        cpuid_hash_map = {}
-        for def_hash in sorted(instruction_count.keys()):
-            definition = definitions_raw[def_hash]
-            cpuid_hash = hash_cpuid(definition.cpuid)
-            if cpuid_hash not in cpuid_name_hash_map:
-                cpuid_name_hash_map[cpuid_hash] = {}
-            cpuid_name_hash_map[cpuid_hash][definition.name] = def_hash
-            if cpuid_hash not in cpuid_hash_map:
-                cpuid_hash_map[cpuid_hash] = definition.cpuid
-            
-        for cpuid_hash in sorted(list(cpuid_hash_map.keys())):
-            cpuid = cpuid_hash_map[cpuid_hash]
-            print(f"-- {cpuid} --")
-            for name in sorted(list(cpuid_name_hash_map[cpuid_hash].keys())):
-                definition = definitions_raw[cpuid_name_hash_map[cpuid_hash][name]]
-                print(f"{definition.name} -> {instruction_count[cpuid_name_hash_map[cpuid_hash][name]]}")
-    print("Extension Requirements:")
-    for cpuid_reqs in extension_requirements:
-        print(cpuid_reqs)
-
-if len(unsupported_inst_encounters) != 0:
-    print("WARNING: The following instructions were encountered which are not supported")
-    for key in sorted(list(unsupported_inst_encounters)):
-        print(f'{key} -> {unsupported_inst_encounters[key]} times')
+    if progress:
+        bar.finish()
 
+    if reporter is not None:
+        reporter.summary(summary)
+    else:
+        print("== Summary ==")
+        summary.print()
+        print_unsupported(summary.unsupported_inst_encounters)
+    report_profile()
+    if reporter is not None:
+        reporter.close()
+    sys.exit(2 if len(summary.violations) != 0 else (1 if len(summary.failed) != 0 else 0))
+
+input_file = input_paths[0]
+result = None
+if result_cache is not None:
+    input_key = binary_key(input_file)
+    result = result_cache.lookup(input_key, fingerprint, input_file, definitions_raw, full_stats, args.functions)
+    if result is not None and verbose:
+        print(f"Using cached result for {input_file}")
+
+if result is None:
+    # Disassemble input file. The instructions may be a generator streaming them as the
+    # disassembler produces them.
+    result = analyzer.analyze_file(input_file, disassemble, progress=progress)
+    if result is None:
+        sys.exit(1)
+    if result_cache is not None and result.violation is None:
+        result_cache.store(input_key, fingerprint, result, definitions_raw, full_stats)
+elif allowed is not None:
+    check_policy(result, allowed)
+add_profile(result)
+
+if reporter is not None:
+    reporter.binary(input_file, result)
+    report_profile()
+    reporter.close()
+    sys.exit(2 if result.violation is not None else 0)
+
+if result.violation is not None:
+    print_violation(result)
+    report_profile()
+    sys.exit(2)
+
+print_report(result, definitions_raw, full_stats)
+print_functions(result)
+
+if allowed is not None:
+    print("All required extensions are allowed")
+
+if verbose and analyzer.memo is not None:
+    print(f"Match memo: {analyzer.memo.hits} hits, {analyzer.memo.misses} misses")
+
+print_unsupported(result.unsupported_inst_encounters)
+
+report_profile()
@@ -0,0 +1,918 @@
+import csv
+import hashlib
+import mmap
+import re
+import struct
+
+def_col_idx = {'name':0, 'opcode':1, 'instruction':2,
+               '64-val':3, '32-val':4, 'cpuid':5, 'val-mask':6}
+
+class InstructionDefinition(object):
+    def_col_idx = {'name':0, 'opcode':1, 'instruction':2,
+                   '64-val':3, '32-val':4, 'cpuid':5, 'val-mask':6}
+    plain_byte_matcher = re.compile('^[0-9A-F][0-9A-F]$')
+    immediate_operands = ['ib', 'iw', 'id', 'io' ]
+    opcode_byte_modifiers = ['+rb', '+rw', '+rd', '+ro']
+    code_segment_offset = [('cb', 1), ('cw', 2), ('cd', 4), ('cp', 6), ('co', 8), ('ct', 10)]
+    digit_matcher = re.compile('^/[0-7]$')
+    legacy_prefix_groups = [[0xF0, 0xF2, 0xF3],
+                            [0x2E, 0x36, 0x3E, 0x26, 0x64, 0x65, 0x2E, 0x3E],
+                            [0x66],
+                            [0x67]]
+    pseudo_op_maps = [(['cmpeqps', 'cmpltps', 'cmpleps', 'cmpunordps',
+                        'cmpneqps', 'cmpnltps', 'cmpnleps', 'cmpordps'],'cmpps'),
+                      (['vcmpeqps', 'vcmpltps', 'vcmpleps', 'vcmpunordps',
+                        'vcmpneqps', 'vcmpnltps', 'vcmpnleps', 'vcmpordps',
+                        'vcmpeq_uqps', 'vcmpngeps', 'vcmpngtps', 'vcmpfalseps',
+                        'vcmpneq_oqps', 'vcmpgeps', 'vcmpgtps', 'vcmptrueps',
+                        'vcmpeq_osps', 'vcmplt_oqps', 'vcmple_oqps', 'vcmpunord_sps',
+                        'vcmpneq_usps', 'vcmpnlt_uqps', 'vcmpnle_uqps', 'vcmpord_sps',
+                        'vcmpeq_usps', 'vcmpnge_uqps', 'vcmpngt_uqps', 'vcmpfalse_osps',
+                        'vcmpneq_osps', 'vcmpge_oqps', 'vcmpgt_oqps', 'vcmptrue_usps'], 'vcmpps'),
+                      (['cmpeqss', 'cmpltss', 'cmpless', 'cmpunordss',
+                        'cmpneqss', 'cmpnltss', 'cmpnless', 'cmpordss'], 'cmpss'),
+                      (['vcmpeqss', 'vcmpltss', 'vcmpless', 'vcmpunordss',
+                        'vcmpneqss', 'vcmpnltss', 'vcmpnless', 'vcmpordss',
+                        'vcmpeq_uqss', 'vcmpngess', 'vcmpngtss', 'vcmpfalsess',
+                        'vcmpneq_oqss', 'vcmpgess', 'vcmpgtss', 'vcmptruess',
+                        'vcmpeq_osss', 'vcmplt_oqss', 'vcmple_oqss', 'vcmpunord_sss',
+                        'vcmpneq_usss', 'vcmpnlt_uqss', 'vcmpnle_uqss', 'vcmpord_sss',
+                        'vcmpeq_usss', 'vcmpnge_uqss', 'vcmpngt_uqss', 'vcmpfalse_osss',
+                        'vcmpneq_osss', 'vcmpge_oqss', 'vcmpgt_oqss', 'vcmptrue_usss'], 'vcmpss'),
+                      (['cmpeqpd', 'cmpltpd', 'cmplepd', 'cmpunordpd',
+                        'cmpneqpd', 'cmpnltpd', 'cmpnlepd', 'cmpordpd'], 'cmppd'),
+                      (['vcmpeqpd', 'vcmpltpd', 'vcmplepd', 'vcmpunordpd',
+                        'vcmpneqpd', 'vcmpnltpd', 'vcmpnlepd', 'vcmpordpd',
+                        'vcmpeq_uqpd', 'vcmpngepd', 'vcmpngtpd', 'vcmpfalsepd',
+                        'vcmpneq_oqpd', 'vcmpgepd', 'vcmpgtpd', 'vcmptruepd',
+                        'vcmpeq_ospd', 'vcmplt_oqpd', 'vcmple_oqpd', 'vcmpunord_spd',
+                        'vcmpneq_uspd', 'vcmpnlt_uqpd', 'vcmpnle_uqpd', 'vcmpord_spd',
+                        'vcmpeq_uspd', 'vcmpnge_uqpd', 'vcmpngt_uqpd', 'vcmpfalse_ospd',
+                        'vcmpneq_ospd', 'vcmpge_oqpd', 'vcmpgt_oqpd', 'vcmptrue_uspd'], 'vcmppd'),
+                      (['cmpeqsd', 'cmpltsd', 'cmplesd', 'cmpunordsd',
+                        'cmpneqsd', 'cmpnltsd', 'cmpnlesd', 'cmpordsd'], 'cmpsd'),
+                      (['vcmpeqsd', 'vcmpltsd', 'vcmplesd', 'vcmpunordsd',
+                        'vcmpneqsd', 'vcmpnltsd', 'vcmpnlesd', 'vcmpordsd',
+                        'vcmpeq_uqsd', 'vcmpngesd', 'vcmpngtsd', 'vcmpfalsesd',
+                        'vcmpneq_oqsd', 'vcmpgesd', 'vcmpgtsd', 'vcmptruesd',
+                        'vcmpeq_ossd', 'vcmplt_oqsd', 'vcmple_oqsd', 'vcmpunord_ssd',
+                        'vcmpneq_ussd', 'vcmpnlt_uqsd', 'vcmpnle_uqsd', 'vcmpord_ssd',
+                        'vcmpeq_ussd', 'vcmpnge_uqsd', 'vcmpngt_uqsd', 'vcmpfalse_ossd',
+                        'vcmpneq_ossd', 'vcmpge_oqsd', 'vcmpgt_oqsd', 'vcmptrue_ussd'], 'vcmpsd'),
+                      (['vpcmpeq', 'vpcmplt', 'vpcmple', 'vpcmpneq',
+                        'vpcmpnlt', 'vpcmpnle'], 'vpcmp'),
+                      (['pclmullqlqdq', 'pclmulhqlqdq', 'pclmullqhqdq', 'pclmulhqhqdq'], 'pclmulqdq'),
+                      (['vpclmullqlqdq', 'vpclmulhqlqdq', 'vpclmullqhqdq', 'vpclmulhqhqdq'], 'vpclmulqdq')]
+    pseudo_op_maps += [ ([ ('vpcmp'+var+Type) for var in [ 'eq', 'lt', 'le', 'false', 'neq', 'nlt', 'nle', 'true' ]],('vpcmp'+Type)) for Type in [ 'b', 'd', 'q', 'w', 'ub', 'ud', 'uq', 'uw' ]]
+
+    def __init__(self, inrow=[]):
+        self._name = inrow[def_col_idx['name']]
+        self._opcode = inrow[def_col_idx['opcode']]
+        self._opcode_parts = self._opcode.split(' ')
+        self._instruction = inrow[def_col_idx['instruction']]
+        self._64val = inrow[def_col_idx['64-val']]
+        self._32val = inrow[def_col_idx['32-val']]
+        if inrow[def_col_idx['cpuid']] == '':
+            self._cpuid = []
+        else:
+            self._cpuid = inrow[def_col_idx['cpuid']].split('|')
+        self._valmasks = []
+        self.build_valmasks()
+
+    @property
+    def def_hash(self):
+        return hash(self.opcode+self.instruction)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def opcode(self):
+        return self._opcode
+
+    @property
+    def instruction(self):
+        return self._instruction
+
+    @property
+    def val64(self):
+        return self._64val
+
+    @property
+    def val32(self):
+        return self._32val
+
+    @property
+    def cpuid(self):
+        return self._cpuid
+
+    @property
+    def valmasks(self):
+        return self._valmasks
+
+    # Build values/masks for this instruction
+    def build_valmasks(self):
+        # Initialize values and masks variables
+        self._valmasks = [[]]
+        valmasks = self._valmasks
+
+        # Retrieve instruction definition
+        op_i = 0
+        ex_prefix_defined = False
+
+        # Go through remaining opcode_parts
+        last_simple_i = op_i # We need to track this as +rb, +rw etcc modify the opcode.
+        mod_rm_i = -1
+        while op_i < len(self.opcode_parts):
+            if InstructionDefinition.plain_byte_matcher.match(self.opcode_parts[op_i]):
+                # We have a simple byte.
+                for valmask in valmasks:
+                    valmask.append((int(self.opcode_parts[op_i],16), 0xFF))
+                last_simple_i = op_i
+                op_i += 1
+            elif 'EX' in self.opcode_parts[op_i]:
+                # We have a REX, VEX, EVEX prefix.
+                if 'REX' == self.opcode_parts[op_i][0:3]:
+                    # REX prefix
+                    if 'REX' == self.opcode_parts[op_i]:
+                        for valmask in valmasks:
+                            valmask.append((0x40, 0xF0))
+                    elif 'REX.W' == self.opcode_parts[op_i] or 'REX.w' == self.opcode_parts[op_i]:
+                        for valmask in valmasks:
+                            valmask.append((0x48, 0xF8))
+                    elif 'REX.R' == self.opcode_parts[op_i]:
+                        for valmask in valmasks:
+                            valmask.append((0x42, 0xF2))
+                    else:
+                        raise RuntimeError("Unrecognized REX prefix!")
+                    op_i += 1
+                elif 'VEX' == self.opcode_parts[op_i][0:3]:
+                    # VEX prefix
+                    if len(valmasks) > 1:
+                        raise RuntimeError("Should only be one valmask at this point!")
+                    # Determine if we need to
+                    vex_parts = self.opcode_parts[op_i].split('.')[1:]
+                    three_byte_only = False
+
+                    # VEX.L
+                    if vex_parts[0] == '128':
+                        vex_l = 0
+                        vex_l_mask = 1
+                    elif vex_parts[0] == '256':
+                        vex_l = 1
+                        vex_l_mask = 1
+                    elif vex_parts[0] == 'LZ':
+                        vex_l = 0
+                        vex_l_mask = 1
+                    elif vex_parts[0] == 'LIG':
+                        # I'll just default this to 0..
+                        vex_l = 0
+                        vex_l_mask = 0
+                    elif vex_parts[0] == 'L1':
+                        vex_l = 1
+                        vex_l_mask = 1
+                    elif vex_parts[0] == 'L0':
+                        vex_l = 0
+                        vex_l_mask = 1
+                    else:
+                        raise RuntimeError(f"Unrecognized VEX.L! {vex_parts[0]} {self}")
+
+                    # VEX.pp
+                    if '66' in vex_parts:
+                        vex_pp = int('01', 2)
+                        vex_pp_mask = 0x3
+                    elif 'F3' in vex_parts:
+                        vex_pp = int('10', 2)
+                        vex_pp_mask = 0x3
+                    elif 'F2' in vex_parts:
+                        vex_pp = int('11', 2)
+                        vex_pp_mask = 0x3
+                    else:
+                        vex_pp = 0
+                        vex_pp_mask = 0
+
+                    # VEX.mmmmm
+                    vex_mmmmm_mask = 0x1F
+                    if '0F' in vex_parts:
+                        vex_mmmmm = int('00001', 2)
+                    elif '0F38' in vex_parts:
+                        vex_mmmmm = int('00010', 2)
+                        three_byte_only = True
+                    elif '0F3A' in vex_parts:
+                        vex_mmmmm = int('00011', 2)
+                        three_byte_only = True
+                    else:
+                        vex_mmmmm = 0 # I use this to imply that it isn't needed.
+
+                    # VEX.W
+                    if 'W0' in vex_parts:
+                        vex_w = 0
+                        vex_w_mask = 1
+                    elif 'W1' in vex_parts:
+                        vex_w = 1
+                        vex_w_mask = 1
+                        three_byte_only = True
+                    elif 'WIG' in vex_parts:
+                        vex_w = 0
+                        vex_w_mask = 0
+                    else:
+                        vex_w = 0
+                        vex_w_mask = 1
+
+                    if not three_byte_only:
+                        # Can use the 2-byte version
+                        valmask_base = valmasks[0].copy()
+                        valmasks[0].append((0xC5, 0xFF))
+                        valmasks[0].append(((vex_l << 2)+vex_pp,
+                                            (vex_l_mask << 2)+vex_pp_mask))
+
+                        valmasks.append(valmask_base)
+                        valmasks[1].append((0xC4, 0xFF))
+                        valmasks[1].append((vex_mmmmm, vex_mmmmm_mask))
+                        valmasks[1].append(((vex_w << 7)+(vex_l << 2)+vex_pp,
+                                            (vex_w_mask << 7)+(vex_l_mask << 2)+vex_pp_mask))
+                    else:
+                        # Must use the 3-byte version only
+                        valmasks[0].append((0xC4, 0xFF))
+                        valmasks[0].append((vex_mmmmm, vex_mmmmm_mask))
+                        valmasks[0].append(((vex_w << 7)+(vex_l << 2)+vex_pp,
+                                            (vex_w_mask << 7)+(vex_l_mask << 2)+vex_pp_mask))
+
+                    op_i += 1
+                elif 'EVEX' == self.opcode_parts[op_i][0:4]:
+                    # EVEX prefix
+                    if len(valmasks) > 1:
+                        raise RuntimeError("Should only be one valmask at this point!")
+                    # Determine if we need to
+                    evex_parts = self.opcode_parts[op_i].split('.')[1:]
+
+                    # EVEX.LL
+                    if evex_parts[0] == '128':
+                        evex_ll = 0
+                        evex_ll_mask = 0x3
+                    elif evex_parts[0] == '256':
+                        evex_ll = 1
+                        evex_ll_mask = 0x3
+                    elif evex_parts[0] == '512':
+                        evex_ll = 2
+                        evex_ll_mask = 0x3
+                    elif evex_parts[0] == 'LIG':
+                        # I'll just default this to 0..
+                        evex_ll = 0
+                        evex_ll_mask = 0
+
+                    # EVEX.pp
+                    if '66' in evex_parts:
+                        evex_pp = int('01', 2)
+                        evex_pp_mask = 0x3
+                    elif 'F3' in evex_parts:
+                        evex_pp = int('10', 2)
+                        evex_pp_mask = 0x3
+                    elif 'F2' in evex_parts:
+                        evex_pp = int('11', 2)
+                        evex_pp_mask = 0x3
+                    else:
+                        evex_pp = 0
+                        evex_pp_mask = 0
+
+                    # EVEX.mmm
+                    evex_mm_mask = 0x3
+                    if '0F' in evex_parts:
+                        evex_mm = int('01', 2)
+                    elif '0F38' in evex_parts:
+                        evex_mm = int('10', 2)
+                    elif '0F3A' in evex_parts:
+                        evex_mm = int('11', 2)
+                    else:
+                        raise RuntimeError("EVEX docs indicates the mm mask should never be empty.")
+
+                    # EVEX.W
+                    if 'W0' in evex_parts:
+                        evex_w = 0
+                        evex_w_mask = 1
+                    elif 'W1' in evex_parts:
+                        evex_w = 1
+                        evex_w_mask = 1
+                    elif 'WIG' in evex_parts:
+                        evex_w = 0
+                        evex_w_mask = 0
+                    else:
+                        # Lets look for this case until we're sure in the wild
+                        evex_w = 0
+                        evex_w_mask = 1
+    
+                    for valmask in valmasks:
+                        valmask.append((0x62, 0xFF))
+                        valmask.append((evex_mm, evex_mm_mask))
+                        valmask.append(((evex_w << 7)+evex_pp,(evex_w_mask << 7)+evex_pp_mask))
+                        valmask.append(((evex_ll << 5), (evex_ll_mask << 5)))
+                    op_i += 1
+                else:
+                    raise RuntimeError("Unrecognized prefix!!")
+                # Indicate that a 'EX' prefix has been defined.
+                ex_prefix_defined = True
+            elif '/is4' == self.opcode_parts[op_i]:
+                # is4 is another immediate byte
+                for valmask in valmasks:
+                    valmask.append((0x0, 0x0))
+                op_i += 1
+            elif 'imm8' == self.opcode_parts[op_i]:
+                # imm8 is an immediate byte
+                for valmask in valmasks:
+                    valmask.append((0x0, 0x0))
+                op_i += 1
+            elif 'NP' == self.opcode_parts[op_i]:
+                # Can't use 0x66, 0xF2, or 0xF3 with this instruction
+                op_i += 1
+            elif 'NFx' == self.opcode_parts[op_i]:
+                # Can't use 0xF2 or 0xF3 with this instruction
+                op_i += 1
+            elif True in [True if im_op in self.opcode_parts[op_i] else False for im_op in InstructionDefinition.immediate_operands]:
+                # we have an immediate operand
+                found = False
+                i = 0
+                while i < len(InstructionDefinition.immediate_operands):
+                    if InstructionDefinition.immediate_operands[i] in self.opcode_parts[op_i]:
+                        for j in range(2**i):
+                            # Could be anything
+                            for valmask in valmasks:
+                                valmask.append((0x00, 0x00))
+                        op_i += 2**i
+                        found = True
+                        break
+                    i += 1
+                if not found:
+                    raise RuntimeError("Didn't correctly handle immediate operand!")
+            elif True in [True if op_mod in self.opcode_parts[op_i] else False for op_mod in InstructionDefinition.opcode_byte_modifiers]:
+                for i in range(len(valmasks)):
+                    valmask = valmasks[i]
+                    valmask[-1] = (valmask[-1][0] & 0xF8, # Remove bottom 3 bits from value
+                                   valmask[-1][1] & 0xF8) # Remove bottom 3 bits from mask
+                op_i += 1
+            elif True in [True if cs_so in self.opcode_parts[op_i] else False for (cs_so, _) in InstructionDefinition.code_segment_offset]:
+                for (cs_so, cs_size) in InstructionDefinition.code_segment_offset:
+                    if cs_so in self.opcode_parts[op_i]:
+                        for valmask in valmasks:
+                            for i in range(cs_size):
+                                valmask.append((0x0, 0x0))
+                        break
+                op_i += 1
+            elif InstructionDefinition.digit_matcher.match(self.opcode_parts[op_i]):
+                digit = int(self.opcode_parts[op_i][1:])
+                # We add a val and mask for the ModR/M byte.
+                # mmrrrbbb the digit goes into the reg(r) field.
+                for valmask in valmasks:
+                    valmask.append((digit << 3,0x38))
+                mod_rm_i = op_i # Record that we have a mod_rm byte.
+                op_i += 1
+            elif '/r' == self.opcode_parts[op_i]:
+                # From manual: Indicates that the ModR/M byte of the instruction
+                # contains a register operand and an r/m operand
+                # This doesn't really change our processing of the ModR/M byte
+
+                # We can however, add an 'open' modrm byte
+                if mod_rm_i == -1:
+                    # No requirement on the value means the mask will zero it out.
+                    for valmask in valmasks:
+                        valmask.append((0x00,0x00))
+                    op_i += 1
+            elif '+i' == self.opcode_parts[op_i]:
+                # We need to remove 3 bits from the previous opcode.
+                for i in range(len(valmasks)):
+                    valmask = valmasks[i]
+                    valmask[-1] = (valmask[-1][0] & 0xF8, valmask[-1][1] & 0xF8)
+                op_i += 1
+            else:
+                raise RuntimeError(f"Unrecognized opcode part {op_i} {self.opcode_parts[op_i]}")
+
+    def valmask_string(self):
+        res_string = ""
+        begin = True
+        for valmask in self.valmasks:
+            if not begin:
+                res_string += " | "
+            if begin:
+                begin = False
+            valmask_string = ""
+            begin_valmask = True
+            for (val, mask) in valmask:
+                if not begin_valmask:
+                    valmask_string += ", "
+                if begin_valmask:
+                    begin_valmask = False
+                valmask_string += f"{val:02X}:{mask:02X}"
+            res_string += valmask_string
+        return res_string
+
+    # Check a valmask from valmask[val_start] against the instruction bytes from
+    # inst_bytes[start]. inst_bytes is a bytes like object, and the offsets save
+    # slicing either of them.
+    @staticmethod
+    def valmask_check_match(valmask, inst_bytes, start=0, val_start=0):
+        match = True
+        for j in range(min(len(valmask)-val_start, len(inst_bytes)-start)):
+            (val, mask) = valmask[val_start+j]
+            if (inst_bytes[start+j]&mask) != val:
+                match = False
+                break
+        return match
+
+    def plain_match_strategy(self, inst_bytes):
+        # Check for match to instruction
+        match = True
+        for valmask in self.valmasks:
+            match = InstructionDefinition.valmask_check_match(valmask, inst_bytes)
+            if match:
+                break
+        return (match, 0)
+
+    def extra_rex_match_strategy(self, inst_bytes):
+        # Check for initial REX byte.
+        val = 0x40
+        mask = 0xF0
+
+        if val == inst_bytes[0]&mask:
+            # we have an initial REX prefix
+            match = True
+            for valmask in self.valmasks:
+                match = InstructionDefinition.valmask_check_match(valmask, inst_bytes, 1)
+                if match:
+                    break
+            return (match, 1)
+        else:
+            return (False, 1)
+
+    def extra_legacy_prefix_match_strategy(self, inst_bytes):
+        if self.instruction.split(' ')[0] == 'NP':
+            check_NP = True
+        else:
+            check_NP = False
+
+        if self.instruction.split(' ')[0] == 'NFx':
+            check_NFx = True
+        else:
+            check_NFx = False
+
+        prefixes_exhausted = False
+        num_prefixes = 0
+        while not prefixes_exhausted:
+            prefixes_exhausted = True
+            prefix_search_terminate = False
+            for legacy_prefix_group in InstructionDefinition.legacy_prefix_groups:
+                for prefix in legacy_prefix_group:
+                    if check_NP:
+                        if prefix in [0x66, 0xF2, 0xF3]:
+                            # These prefixes are not allowed for this instruction.
+                            continue
+                    if check_NFx:
+                        if prefix in [0xF2, 0xF3]:
+                            # These prefixes are not allowed for this instruction.
+                            continue
+    
+                    if inst_bytes[num_prefixes] == prefix:
+                        # This prefix is here!
+                        prefixes_exhausted = False
+                        prefix_search_terminate = True
+                        num_prefixes += 1
+
+                        match = True
+                        for valmask in self.valmasks:
+                            match = InstructionDefinition.valmask_check_match(valmask, inst_bytes, num_prefixes)
+                            if match:
+                                break
+                        if match:
+                            return (match, num_prefixes)
+                    if prefix_search_terminate:
+                        break
+                if prefix_search_terminate:
+                    break
+        # We didn't find a match..
+        return (False, num_prefixes)
+
+    def insert_rex_strategy(self, inst_bytes):
+        for valmask in self.valmasks:
+            # Test whether the initial byte in the definition is a legacy prefix.
+            is_legacy_prefix = False
+            v_i = 0
+            i_i = 0
+            for legacy_prefix_group in InstructionDefinition.legacy_prefix_groups:
+                for prefix in legacy_prefix_group:
+                    if valmask[v_i][0] == prefix:
+                        is_legacy_prefix = True
+                        break
+                if is_legacy_prefix:
+                    break
+            if not is_legacy_prefix:
+                return (False, 0)
+
+            # Check for the matching prefix in the instruction bytes
+            if valmask[v_i][0] != inst_bytes[i_i]:
+                return (False, 0)
+
+            v_i += 1
+            i_i += 1
+
+            # Test for an inserted rex byte.
+            if inst_bytes[i_i]&0xF0 != 0x40:
+                return (False, 0)
+            i_i += 1
+
+            # Check for match on the rest.
+            match = InstructionDefinition.valmask_check_match(valmask, inst_bytes, i_i, v_i)
+            if match:
+                break
+        return (match, 1)
+
+    def get_match_strategies(self):
+        return [self.plain_match_strategy,
+                self.extra_rex_match_strategy,
+                self.extra_legacy_prefix_match_strategy,
+                self.insert_rex_strategy]
+
+    def check_for_match(self, inst_bytes, file_type='64'):
+        # Check whether this instruction is appropriate for this file type
+        if self.val64 != 'V':
+            return False
+
+        match = False
+        strat_result = None
+        for strategy in self.get_match_strategies():
+            strat_result = strategy(inst_bytes)
+            if strat_result[0]:
+                return strat_result
+
+        return strat_result
+
+    @property
+    def opcode_parts(self):
+        return self._opcode_parts
+
+    def __repr__(self):
+        return f"{self._name} {self.opcode_parts} \"{self._instruction}\" 64:{self.val64} 32:{self.val32} {self.cpuid} {self.valmask_string()}"
+
+# Instructions with multiple definitions sharing an opcode and instruction string
+supported_duplicates = ['JZ', 'LEAVE', 'POP', 'REP']
+
+# Segment override prefixes objdump reports as the mnemonic, with the instruction's
+# own mnemonic following in the decoded text
+segment_override_mnemonics = ['cs', 'ds']
+
+# Instructions objdump reports which we can't currently handle
+unsupported_instructions = ['repz', 'data16', 'data32', 'movabs', 'endbr66', 'movbe']
+
+# Load instruction definition data
+def load_definitions(definitions_file, verbose=False):
+    definitions_raw = {}
+    with open(definitions_file, 'r') as def_file:
+        def_reader = csv.reader(def_file, delimiter=',', quotechar='"')
+
+        if verbose:
+            print("==== Registering Instructions: ====")
+
+        begin = True
+        for row in def_reader:
+            if begin:
+                begin = False
+                continue
+
+            definition = InstructionDefinition(inrow=row)
+
+            if definition.def_hash in definitions_raw:
+                if row[def_col_idx['name']] not in supported_duplicates:
+                    raise RuntimeError(f"Instruction definitions had a hash collision: row {row} "
+                                       f"collided with {definitions_raw[definition.def_hash]}")
+            else:
+                if verbose:
+                    print(f"{definition}")
+                definitions_raw[definition.def_hash] = definition
+    return definitions_raw
+
+# Group instruction definitions by lower case mnemonic
+def group_definitions(definitions_raw):
+    def_name_dict = {}
+    for def_hash in definitions_raw:
+        definition = definitions_raw[def_hash]
+        name = definition.name.lower()
+        if name in unsupported_instructions:
+            continue
+        if name not in def_name_dict:
+            def_name_dict[name] = [def_hash]
+        else:
+            def_name_dict[name].append(def_hash)
+    return def_name_dict
+
+# Instruction forms taking a memory operand
+inst_mem_matcher = re.compile('m(32|64|128)')
+
+# The (memory form, register form) of two definitions with differing requirements
+# which the operand type tells apart, or None. The forms are told apart when their
+# instruction statements differ in exactly one of them taking a memory operand.
+def operand_split(definitions_raw, hash_a, hash_b):
+    def_a = definitions_raw[hash_a]
+    def_b = definitions_raw[hash_b]
+    if def_a.cpuid == def_b.cpuid or def_a.instruction == def_b.instruction:
+        return None
+    def_a_mem = True if inst_mem_matcher.search(def_a.instruction) else False
+    def_b_mem = True if inst_mem_matcher.search(def_b.instruction) else False
+    if def_a_mem == def_b_mem:
+        return None
+    return (hash_a, hash_b) if def_a_mem else (hash_b, hash_a)
+
+# Whether two valmasks accept a common encoding, comparing their overlapping bytes
+def valmasks_overlap(valmask_a, valmask_b):
+    for ((val_a, mask_a), (val_b, mask_b)) in zip(valmask_a, valmask_b):
+        if (val_a^val_b)&mask_a&mask_b != 0:
+            return False
+    return True
+
+# How to resolve an objdump mnemonic, worked out once when the definitions are loaded.
+# target is the definition group the candidates come from, which differs from the
+# mnemonic for pseudo-ops and is None for instructions without a mnemonic. Trivial
+# plans have no candidate with extension requirements. Segment override plans have no
+# candidates, the mnemonic following the override in the decoded text is used instead.
+#
+# Uniform plans have candidates which all share their extension requirements, so the
+# requirements are known without matching any bytes. For the others, cpuid_classes
+# numbers each candidate's requirements so matched candidates are compared in one
+# pass, and the decision table holds the operand_split of every pair of candidates
+# with differing requirements. undecided_pairs are the pairs with differing
+# requirements which the operand type doesn't tell apart. The plan of instructions
+# without a mnemonic spans every definition, so its table is filled in as pairs come
+# up instead. Plans are built without reading any valmask, which compiled definitions
+# only decode once they're matched.
+class CandidatePlan(object):
+    __slots__ = ('_target', '_cand_hashes', '_trivial', '_segment_override', '_uniform', '_cpuid_classes',
+                 '_decisions', '_undecided_pairs', '_definitions')
+
+    def __init__(self, target, cand_hashes, trivial, segment_override=False, uniform=None, cpuid_classes=None,
+                 decisions=None, undecided_pairs=(), definitions=None):
+        self._target = target
+        self._cand_hashes = tuple(cand_hashes)
+        self._trivial = trivial
+        self._segment_override = segment_override
+        self._uniform = trivial if uniform is None else uniform
+        self._cpuid_classes = {} if cpuid_classes is None else cpuid_classes
+        self._decisions = {} if decisions is None else decisions
+        self._undecided_pairs = tuple(undecided_pairs)
+        # Definitions to fill the decision table from, when it's filled lazily
+        self._definitions = definitions
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def cand_hashes(self):
+        return self._cand_hashes
+
+    @property
+    def trivial(self):
+        return self._trivial
+
+    @property
+    def segment_override(self):
+        return self._segment_override
+
+    @property
+    def uniform(self):
+        return self._uniform
+
+    @property
+    def cpuid_classes(self):
+        return self._cpuid_classes
+
+    # The undecided pairs whose encodings overlap, which nothing resolves
+    def unresolved_pairs(self, definitions_raw):
+        return [(hash_a, hash_b) for (hash_a, hash_b) in self._undecided_pairs
+                if any(valmasks_overlap(valmask_a, valmask_b)
+                       for valmask_a in definitions_raw[hash_a].valmasks
+                       for valmask_b in definitions_raw[hash_b].valmasks)]
+
+    # Whether resolving may depend on the operand type, which is the case when the
+    # decision table has or may get entries
+    @property
+    def decides_by_operand(self):
+        return len(self._decisions) != 0 or self._definitions is not None
+
+    # Look up the (memory form, register form) of two candidates in the decision table
+    def decide(self, hash_a, hash_b):
+        key = (hash_a, hash_b) if hash_a < hash_b else (hash_b, hash_a)
+        if key in self._decisions:
+            return self._decisions[key]
+        if self._definitions is None:
+            return None
+        decision = self._decisions[key] = operand_split(self._definitions, hash_a, hash_b)
+        return decision
+
+# Analyze a plan's candidates: their requirement classes, the decision table of the
+# pairs with differing requirements and the pairs it doesn't decide
+def analyze_candidates(definitions_raw, cand_hashes):
+    cpuid_classes = {}
+    class_ids = {}
+    for def_hash in cand_hashes:
+        reqs_key = tuple(definitions_raw[def_hash].cpuid)
+        cpuid_classes[def_hash] = class_ids.setdefault(reqs_key, len(class_ids))
+
+    decisions = {}
+    undecided_pairs = []
+    if len(class_ids) > 1:
+        for (i, hash_a) in enumerate(cand_hashes):
+            for hash_b in cand_hashes[i+1:]:
+                if cpuid_classes[hash_a] == cpuid_classes[hash_b]:
+                    continue
+                decision = operand_split(definitions_raw, hash_a, hash_b)
+                if decision is not None:
+                    decisions[(hash_a, hash_b) if hash_a < hash_b else (hash_b, hash_a)] = decision
+                else:
+                    undecided_pairs.append((hash_a, hash_b))
+    return (cpuid_classes, len(class_ids) <= 1, decisions, undecided_pairs)
+
+# Build the plan of every mnemonic objdump may report: the definition groups, the
+# pseudo-ops of InstructionDefinition.pseudo_op_maps and the segment override forms.
+# The plan of None holds every 64 bit valid definition, for instructions without a
+# mnemonic. Pseudo-ops whose target has no definitions get no plan.
+def build_candidate_plans(definitions_raw, def_name_dict):
+    def make_plan(target, def_hashes):
+        cand_hashes = [def_hash for def_hash in def_hashes if definitions_raw[def_hash].val64 == 'V']
+        trivial = all(definitions_raw[def_hash].cpuid == [] for def_hash in cand_hashes)
+        (cpuid_classes, uniform, decisions, undecided_pairs) = analyze_candidates(definitions_raw, cand_hashes)
+        return CandidatePlan(target, cand_hashes, trivial, uniform=uniform, cpuid_classes=cpuid_classes,
+                             decisions=decisions, undecided_pairs=undecided_pairs)
+
+    plans = {}
+    for (name, def_hashes) in def_name_dict.items():
+        plans[name] = make_plan(name, def_hashes)
+
+    # Like a definition group, the first map listing a pseudo-op wins. A pseudo-op which
+    # is also an instruction's mnemonic may be either, objdump prints the EVEX vpcmpb
+    # forms with predicate 0 as vpcmpeqb, so its plan covers the candidates of both.
+    colliding = {}
+    for (pseudo_ops, target) in InstructionDefinition.pseudo_op_maps:
+        if target not in def_name_dict:
+            continue
+        for pseudo_op in pseudo_ops:
+            if pseudo_op in def_name_dict:
+                def_hashes = colliding.setdefault(pseudo_op, list(def_name_dict[pseudo_op]))
+                def_hashes += [def_hash for def_hash in def_name_dict[target] if def_hash not in def_hashes]
+            elif pseudo_op not in plans:
+                plans[pseudo_op] = plans[target]
+    for (name, def_hashes) in colliding.items():
+        plans[name] = make_plan(name, def_hashes)
+
+    for name in segment_override_mnemonics:
+        if name not in plans:
+            plans[name] = CandidatePlan(None, [], False, segment_override=True)
+
+    cand_hashes = [def_hash for def_hash in definitions_raw if definitions_raw[def_hash].val64 == 'V']
+    class_ids = {}
+    cpuid_classes = {def_hash: class_ids.setdefault(tuple(definitions_raw[def_hash].cpuid), len(class_ids))
+                     for def_hash in cand_hashes}
+    plans[None] = CandidatePlan(None, cand_hashes, False, uniform=False, cpuid_classes=cpuid_classes,
+                                definitions=definitions_raw)
+    return plans
+
+# Compiled definitions file layout. All integers are little endian. After the header:
+#   string offsets   uint32[num_strings+1] into the string blob
+#   string blob      utf-8, padded to 4 bytes
+#   definitions      uint32[num_defs*9]: name, opcode, instruction, 64-val, 32-val string ids,
+#                    cpuid start/end into the cpuid table, valmask start/end into the valmask offsets
+#   cpuid table      uint32[num_cpuid] string ids of cpuid flags
+#   valmask offsets  uint32[num_valmasks+1] into the flat value and mask arrays
+#   values           uint8[num_valmask_bytes], padded to 4 bytes
+#   masks            uint8[num_valmask_bytes]
+compiled_magic = b'BX86DEFS'
+compiled_version = 1
+compiled_header = struct.Struct('<8sI32sIIIIII')
+compiled_def_fields = 9
+
+# Checksum of a definitions .csv file, used to key compiled definitions files
+def definitions_checksum(definitions_file):
+    with open(definitions_file, 'rb') as def_file:
+        return hashlib.sha256(def_file.read()).digest()
+
+def _pad4(data):
+    return data + bytes(-len(data) % 4)
+
+# Write definitions to a compiled definitions file keyed by the checksum of their .csv file
+def compile_definitions(definitions_raw, definitions_file, output_file):
+    strings = []
+    string_ids = {}
+    def string_id(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    def_table = []
+    cpuid_table = []
+    valmask_offsets = [0]
+    values = bytearray()
+    masks = bytearray()
+    for definition in definitions_raw.values():
+        def_table += [string_id(definition.name), string_id(definition.opcode),
+                      string_id(definition.instruction), string_id(definition.val64),
+                      string_id(definition.val32), len(cpuid_table)]
+        cpuid_table += [string_id(flag) for flag in definition.cpuid]
+        def_table += [len(cpuid_table), len(valmask_offsets)-1]
+        for valmask in definition.valmasks:
+            values += bytes(val for (val, _) in valmask)
+            masks += bytes(mask for (_, mask) in valmask)
+            valmask_offsets.append(len(values))
+        def_table.append(len(valmask_offsets)-1)
+
+    encoded = [string.encode() for string in strings]
+    string_offsets = [0]
+    for string in encoded:
+        string_offsets.append(string_offsets[-1]+len(string))
+
+    header = compiled_header.pack(compiled_magic, compiled_version, definitions_checksum(definitions_file),
+                                  len(strings), string_offsets[-1], len(definitions_raw),
+                                  len(cpuid_table), len(valmask_offsets)-1, len(values))
+    with open(output_file, 'wb') as out_file:
+        out_file.write(_pad4(header))
+        out_file.write(struct.pack(f'<{len(string_offsets)}I', *string_offsets))
+        out_file.write(_pad4(b''.join(encoded)))
+        out_file.write(struct.pack(f'<{len(def_table)}I', *def_table))
+        out_file.write(struct.pack(f'<{len(cpuid_table)}I', *cpuid_table))
+        out_file.write(struct.pack(f'<{len(valmask_offsets)}I', *valmask_offsets))
+        out_file.write(_pad4(bytes(values)))
+        out_file.write(bytes(masks))
+
+# A memory mapped compiled definitions file. The tables are memoryviews into the
+# mapping, so forked workers share one copy of the definitions.
+class CompiledDefinitionTable(object):
+    def __init__(self, compiled_file):
+        with open(compiled_file, 'rb') as in_file:
+            self._mmap = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        (magic, version, self.checksum, num_strings, string_bytes, self.num_defs,
+         num_cpuid, num_valmasks, num_valmask_bytes) = compiled_header.unpack_from(view)
+        if magic != compiled_magic or version != compiled_version:
+            raise RuntimeError(f"{compiled_file} isn't a version {compiled_version} compiled definitions file")
+
+        pos = compiled_header.size + (-compiled_header.size % 4)
+        def section(length, fmt='B', pad=False):
+            nonlocal pos
+            itemsize = struct.calcsize(fmt)
+            data = view[pos:pos+length*itemsize].cast(fmt)
+            pos += length*itemsize
+            if pad:
+                pos += -pos % 4
+            return data
+        self.string_offsets = section(num_strings+1, 'I')
+        self.string_blob = section(string_bytes, pad=True)
+        self.definitions = section(self.num_defs*compiled_def_fields, 'I')
+        self.cpuid_table = section(num_cpuid, 'I')
+        self.valmask_offsets = section(num_valmasks+1, 'I')
+        self.values = section(num_valmask_bytes, pad=True)
+        self.masks = section(num_valmask_bytes)
+        self._strings = [None]*num_strings
+
+    def string(self, string_idx):
+        if self._strings[string_idx] is None:
+            self._strings[string_idx] = str(self.string_blob[self.string_offsets[string_idx]:self.string_offsets[string_idx+1]], 'utf-8')
+        return self._strings[string_idx]
+
+    def field(self, def_idx, field_idx):
+        return self.definitions[def_idx*compiled_def_fields+field_idx]
+
+# An instruction definition read from a compiled definitions file. Valmasks are
+# decoded from the mapped value and mask arrays on first use instead of being built
+# from the opcode string.
+class CompiledDefinition(InstructionDefinition):
+    def __init__(self, table, def_idx):
+        self._table = table
+        self._def_idx = def_idx
+        self._name = table.string(table.field(def_idx, 0))
+        self._opcode = table.string(table.field(def_idx, 1))
+        self._opcode_parts = self._opcode.split(' ')
+        self._instruction = table.string(table.field(def_idx, 2))
+        self._64val = table.string(table.field(def_idx, 3))
+        self._32val = table.string(table.field(def_idx, 4))
+        self._cpuid = [table.string(table.cpuid_table[i])
+                       for i in range(table.field(def_idx, 5), table.field(def_idx, 6))]
+        self._valmasks = None
+
+    @property
+    def valmasks(self):
+        if self._valmasks is None:
+            table = self._table
+            self._valmasks = []
+            for valmask_idx in range(self._table.field(self._def_idx, 7), self._table.field(self._def_idx, 8)):
+                start = table.valmask_offsets[valmask_idx]
+                end = table.valmask_offsets[valmask_idx+1]
+                self._valmasks.append(list(zip(table.values[start:end], table.masks[start:end])))
+        return self._valmasks
+
+# Load instruction definitions from a compiled definitions file. Returns None when the
+# file was compiled from a different version of the definitions .csv file.
+def load_compiled_definitions(compiled_file, definitions_file):
+    table = CompiledDefinitionTable(compiled_file)
+    if table.checksum != definitions_checksum(definitions_file):
+        return None
+    definitions_raw = {}
+    for def_idx in range(table.num_defs):
+        definition = CompiledDefinition(table, def_idx)
+        definitions_raw[definition.def_hash] = definition
+    return definitions_raw
@@ -0,0 +1,856 @@
+import collections
+import json
+import os
+import numpy as np
+from instruction_definitions import InstructionDefinition
+from x86_decoder import decode_fields
+
+# Every byte value appearing in a legacy prefix group
+legacy_prefixes = set(prefix for group in InstructionDefinition.legacy_prefix_groups for prefix in group)
+
+# Names of the match strategies of InstructionDefinition.check_for_match, in the order
+# they're tried
+match_strategy_names = ['plain', 'extra_rex', 'extra_legacy_prefix', 'insert_rex']
+
+# The instruction bytes each match strategy reads before looking at a valmask. The
+# prefix strategies read the first byte, and insert_rex_strategy the byte after it.
+strategy_min_bytes = [0, 1, 1, 2]
+
+# Attempts and wins of each match strategy, by index into match_strategy_names. Engines
+# count with the granularity they work at: StrategyMatcher and PackedMatcher per
+# candidate, TrieMatcher per trie walk and NumpyMatcher per instruction row. A win is
+# a candidate resolved by the strategy.
+class MatchStats(object):
+    def __init__(self):
+        self.attempts = [0]*len(match_strategy_names)
+        self.wins = [0]*len(match_strategy_names)
+
+    def merge(self, other):
+        for i in range(len(match_strategy_names)):
+            self.attempts[i] += other.attempts[i]
+            self.wins[i] += other.wins[i]
+
+# The legacy prefixes extra_legacy_prefix_match_strategy may skip for a definition
+def allowed_legacy_prefixes(definition):
+    allowed = legacy_prefixes
+    inst_prefix = definition.instruction.split(' ')[0]
+    if inst_prefix == 'NP':
+        allowed = allowed - set([0x66, 0xF2, 0xF3])
+    if inst_prefix == 'NFx':
+        allowed = allowed - set([0xF2, 0xF3])
+    return allowed
+
+# The valmasks insert_rex_strategy can match, with their leading legacy prefix removed.
+# The strategy gives up at the first valmask whose initial byte isn't the instruction's
+# first byte, so only the leading valmasks sharing a legacy prefix value can ever match.
+def insert_rex_valmasks(definition):
+    first_val = definition.valmasks[0][0][0] if len(definition.valmasks[0]) != 0 else None
+    if first_val not in legacy_prefixes:
+        return (None, [])
+    valmasks = []
+    for valmask in definition.valmasks:
+        if valmask[0][0] != first_val:
+            break
+        valmasks.append(valmask[1:])
+    return (first_val, valmasks)
+
+# Matches a disassembled instruction against its candidate definitions by running
+# each candidate's match strategies in turn.
+class StrategyMatcher(object):
+    def __init__(self, definitions_raw):
+        self._definitions = definitions_raw
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    # Returns a list of (def_hash, num_prefixes) for the candidates which match,
+    # in the order the candidates were given.
+    def match(self, inst_bytes, cand_hashes):
+        if self.stats is not None:
+            return self.match_counted(inst_bytes, cand_hashes)
+        cand_records = []
+        for def_hash in cand_hashes:
+            def_match = self._definitions[def_hash].check_for_match(inst_bytes)
+            if def_match[0]:
+                cand_records.append((def_hash, def_match[1]))
+        return cand_records
+
+    # match, running the strategies of check_for_match one at a time to count them
+    def match_counted(self, inst_bytes, cand_hashes):
+        stats = self.stats
+        cand_records = []
+        for def_hash in cand_hashes:
+            for (i, strategy) in enumerate(self._definitions[def_hash].get_match_strategies()):
+                stats.attempts[i] += 1
+                strat_result = strategy(inst_bytes)
+                if strat_result[0]:
+                    stats.wins[i] += 1
+                    cand_records.append((def_hash, strat_result[1]))
+                    break
+        return cand_records
+
+# Whether a (val, mask) byte of a valmask accepts any of the given byte values
+def byte_accepts(val_mask, values):
+    (val, mask) = val_mask
+    return any((value & mask) == val for value in values)
+
+rex_prefixes = range(0x40, 0x50)
+
+# Pairs (i, j) of match strategies, by index, which may both match an instruction for
+# a definition. When strategy j matches, an earlier strategy i can only match too if
+# the definition's valmasks accept a REX or legacy prefix where j skips one. Other
+# pairs exclude each other: REX and legacy prefixes never share a byte value.
+def strategy_conflicts(definition):
+    valmasks = definition.valmasks
+    if any(len(valmask) == 0 for valmask in valmasks):
+        return set((i, j) for j in range(len(match_strategy_names)) for i in range(j))
+    rex_first = any(byte_accepts(valmask[0], rex_prefixes) for valmask in valmasks)
+    legacy_first = any(byte_accepts(valmask[0], allowed_legacy_prefixes(definition)) for valmask in valmasks)
+    rex_second = any(len(valmask) > 1 and byte_accepts(valmask[1], rex_prefixes) for valmask in valmasks)
+    conflicts = set()
+    if rex_first:
+        conflicts |= set([(0, 1), (2, 3)])
+    if legacy_first:
+        conflicts.add((0, 2))
+    if rex_second:
+        conflicts.add((0, 3))
+    return conflicts
+
+# Runs the match strategies of InstructionDefinition.check_for_match, but tries each
+# definition's strategies in the order they've succeeded most for it and the
+# candidates of a mnemonic in order of how often they've matched. A strategy matching
+# out of order is only accepted once the earlier strategies which could also match
+# have failed, so results are the same as StrategyMatcher's. Once a candidate matches
+# without prefixes, the rest are only tried without prefixes, since matches needing
+# more are pruned by resolve_instruction anyway. The win counts persist in a JSON
+# file through load and save.
+class AdaptiveMatcher(object):
+    stats_version = 1
+    # Matches of a candidate list between reorderings of its candidates
+    reorder_interval = 64
+
+    def __init__(self, definitions_raw):
+        self._definitions = definitions_raw
+        self._strategies = {}
+        self._conflicts = {}
+        # Wins of each strategy per definition, and the strategy order they give
+        self._wins = {}
+        self._orders = {}
+        # Wins as of the last take_new_wins or load, per definition
+        self._taken_wins = {}
+        # [candidate index order, matches until the next reordering] per candidate list
+        self._cand_orders = {}
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    def _prepare(self, def_hash):
+        definition = self._definitions[def_hash]
+        self._strategies[def_hash] = definition.get_match_strategies()
+        self._conflicts[def_hash] = strategy_conflicts(definition)
+        wins = self._wins.setdefault(def_hash, [0]*len(match_strategy_names))
+        self._orders[def_hash] = sorted(range(len(match_strategy_names)), key=lambda i: (-wins[i], i))
+
+    def _probe(self, strategies, strategy, inst_bytes):
+        if self.stats is not None:
+            self.stats.attempts[strategy] += 1
+        # Strategies would read past the end of instructions too short for them, which
+        # check_for_match only reaches when no earlier strategy matched
+        if len(inst_bytes) < strategy_min_bytes[strategy]:
+            return (False, 0)
+        return strategies[strategy](inst_bytes)
+
+    # Match a definition, returning (strategy, num_prefixes) of the strategy
+    # check_for_match would have matched with, or None
+    def match_definition(self, def_hash, inst_bytes):
+        if def_hash not in self._strategies:
+            self._prepare(def_hash)
+        strategies = self._strategies[def_hash]
+        conflicts = self._conflicts[def_hash]
+        tried = []
+        for strategy in self._orders[def_hash]:
+            (matched, num_prefixes) = self._probe(strategies, strategy, inst_bytes)
+            if matched:
+                # An earlier strategy which may also match takes precedence
+                for earlier in range(strategy):
+                    if earlier not in tried and (earlier, strategy) in conflicts:
+                        (earlier_matched, earlier_prefixes) = self._probe(strategies, earlier, inst_bytes)
+                        if earlier_matched:
+                            (strategy, num_prefixes) = (earlier, earlier_prefixes)
+                            break
+                self.record_win(def_hash, strategy)
+                return (strategy, num_prefixes)
+            tried.append(strategy)
+        return None
+
+    def record_win(self, def_hash, strategy):
+        if self.stats is not None:
+            self.stats.wins[strategy] += 1
+        wins = self._wins[def_hash]
+        wins[strategy] += 1
+        order = self._orders[def_hash]
+        if order[0] != strategy and wins[strategy] > wins[order[0]]:
+            self._orders[def_hash] = sorted(range(len(match_strategy_names)), key=lambda i: (-wins[i], i))
+
+    # Indices of a candidate list in order of their total wins
+    def candidate_order(self, cand_hashes):
+        entry = self._cand_orders.get(cand_hashes)
+        if entry is None or entry[1] == 0:
+            def total_wins(i):
+                wins = self._wins.get(cand_hashes[i])
+                return sum(wins) if wins is not None else 0
+            entry = self._cand_orders[cand_hashes] = [sorted(range(len(cand_hashes)), key=lambda i: (-total_wins(i), i)),
+                                                      AdaptiveMatcher.reorder_interval]
+        entry[1] -= 1
+        return entry[0]
+
+    # Returns a list of (def_hash, num_prefixes) for the candidates which match,
+    # in the order the candidates were given.
+    def match(self, inst_bytes, cand_hashes):
+        cand_hashes = tuple(cand_hashes)
+        matched = []
+        found_plain = False
+        for i in self.candidate_order(cand_hashes):
+            def_hash = cand_hashes[i]
+            if found_plain:
+                if def_hash not in self._strategies:
+                    self._prepare(def_hash)
+                if self._probe(self._strategies[def_hash], 0, inst_bytes)[0]:
+                    self.record_win(def_hash, 0)
+                    matched.append((i, def_hash, 0))
+                continue
+            result = self.match_definition(def_hash, inst_bytes)
+            if result is not None:
+                matched.append((i, def_hash, result[1]))
+                if result[1] == 0:
+                    found_plain = True
+        matched.sort()
+        return [(def_hash, num_prefixes) for (_, def_hash, num_prefixes) in matched]
+
+    # Read win counts saved by save, keyed by definition opcode and instruction.
+    # Missing or unreadable files leave the counts empty.
+    def load(self, stats_file):
+        try:
+            with open(stats_file, 'r') as in_file:
+                saved = json.load(in_file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(saved, dict) or saved.get('version') != AdaptiveMatcher.stats_version:
+            return
+        saved_wins = saved.get('wins', {})
+        for def_hash in self._definitions:
+            definition = self._definitions[def_hash]
+            wins = saved_wins.get(f"{definition.opcode}\t{definition.instruction}")
+            if wins is not None and len(wins) == len(match_strategy_names):
+                self._wins[def_hash] = list(wins)
+                self._taken_wins[def_hash] = list(wins)
+                self._strategies.pop(def_hash, None)
+        self._cand_orders = {}
+
+    # Wins counted since the last call, keyed by definition hash. Batch worker
+    # processes hand them back to the process which saves them.
+    def take_new_wins(self):
+        new_wins = {}
+        for (def_hash, wins) in self._wins.items():
+            taken = self._taken_wins.get(def_hash)
+            if taken is None:
+                taken = [0]*len(match_strategy_names)
+            if wins != taken:
+                new_wins[def_hash] = [count-taken_count for (count, taken_count) in zip(wins, taken)]
+                self._taken_wins[def_hash] = list(wins)
+        return new_wins
+
+    # Add wins taken from a worker process forked from this one, whose definition
+    # hashes are the same
+    def merge_wins(self, new_wins):
+        for (def_hash, counts) in new_wins.items():
+            wins = self._wins.setdefault(def_hash, [0]*len(match_strategy_names))
+            for (strategy, count) in enumerate(counts):
+                wins[strategy] += count
+            self._strategies.pop(def_hash, None)
+        self._cand_orders = {}
+
+    def save(self, stats_file):
+        saved_wins = {}
+        for (def_hash, wins) in self._wins.items():
+            if sum(wins) != 0:
+                definition = self._definitions[def_hash]
+                saved_wins[f"{definition.opcode}\t{definition.instruction}"] = wins
+        stats_dir = os.path.dirname(stats_file)
+        if stats_dir != '':
+            os.makedirs(stats_dir, exist_ok=True)
+        temp_file = f"{stats_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w') as out_file:
+            json.dump({'version': AdaptiveMatcher.stats_version, 'wins': saved_wins}, out_file, sort_keys=True)
+        os.replace(temp_file, stats_file)
+
+# A node of the byte trie. Children are grouped by mask so each step costs
+# one dictionary lookup per distinct mask rather than one per edge.
+class TrieNode(object):
+    __slots__ = ('children', 'terminal', 'reachable')
+
+    def __init__(self):
+        self.children = {} # mask -> {val: TrieNode}
+        self.terminal = set() # Definitions with a valmask ending at this node
+        self.reachable = set() # Definitions with a valmask passing through or ending at this node
+
+    def insert(self, valmask, def_hash):
+        node = self
+        node.reachable.add(def_hash)
+        for (val, mask) in valmask:
+            vals = node.children.setdefault(mask, {})
+            if val not in vals:
+                vals[val] = TrieNode()
+            node = vals[val]
+            node.reachable.add(def_hash)
+        node.terminal.add(def_hash)
+
+    # Return the definitions with a valmask matching inst_bytes[start:]. Like
+    # InstructionDefinition.valmask_check_match only the overlapping bytes are compared,
+    # so running out of instruction bytes matches everything still reachable.
+    def walk(self, inst_bytes, start):
+        matched = set()
+        num_bytes = len(inst_bytes)
+        stack = [(self, start)]
+        while stack:
+            (node, pos) = stack.pop()
+            if pos >= num_bytes:
+                matched |= node.reachable
+                continue
+            matched |= node.terminal
+            byte = inst_bytes[pos]
+            for mask, vals in node.children.items():
+                child = vals.get(byte & mask)
+                if child is not None:
+                    stack.append((child, pos+1))
+        return matched
+
+# Byte tries over the valmasks of candidate definitions. One walk per match strategy
+# replaces running every strategy on every candidate, while producing the same
+# candidates and prefix counts as StrategyMatcher. Each candidate list gets its own
+# trie when it's first matched, and instructions without a mnemonic one over every 64
+# bit valid definition, so valmasks are only read for the mnemonics a binary uses.
+class TrieMatcher(object):
+    def __init__(self, definitions_raw):
+        self._definitions = definitions_raw
+        # (root, insert_rex_roots) of each candidate list, and of every definition under None
+        self._tries = {}
+        # Prefixes the legacy prefix strategy may skip for each definition
+        self._allowed_prefixes = {}
+        # Position of each 64 bit valid definition in definition order, for match_any
+        self._order = None
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    # Build the trie of some definitions, and the tries of their valmasks starting with
+    # a legacy prefix, indexed by that prefix with the prefix removed, for the inserted
+    # REX strategy
+    def build(self, def_hashes):
+        root = TrieNode()
+        insert_rex_roots = {}
+        for def_hash in def_hashes:
+            definition = self._definitions[def_hash]
+            if definition.val64 != 'V':
+                continue
+            for valmask in definition.valmasks:
+                root.insert(valmask, def_hash)
+
+            (first_val, valmasks) = insert_rex_valmasks(definition)
+            if first_val is not None:
+                rex_root = insert_rex_roots.setdefault(first_val, TrieNode())
+                for valmask in valmasks:
+                    rex_root.insert(valmask, def_hash)
+
+            if def_hash not in self._allowed_prefixes:
+                self._allowed_prefixes[def_hash] = allowed_legacy_prefixes(definition)
+        return (root, insert_rex_roots)
+
+    # Map each definition of a trie matching the instruction to its prefix count. Only
+    # definitions in cand_set are considered, or every definition when cand_set is None.
+    def prefix_counts(self, inst, trie, cand_set):
+        (root, insert_rex_roots) = trie
+        num_prefixes = {}
+        remaining = cand_set
+        stats = self.stats
+
+        def unresolved():
+            return remaining is None or len(remaining) != 0
+
+        def record(strategy, matched, count):
+            if remaining is not None:
+                matched &= remaining
+            num_resolved = len(num_prefixes)
+            for def_hash in matched:
+                if def_hash not in num_prefixes:
+                    num_prefixes[def_hash] = count
+            if remaining is not None:
+                remaining.difference_update(num_prefixes)
+            if stats is not None:
+                stats.attempts[strategy] += 1
+                stats.wins[strategy] += len(num_prefixes)-num_resolved
+
+        # plain_match_strategy
+        record(0, root.walk(inst, 0), 0)
+
+        # extra_rex_match_strategy
+        if unresolved() and inst[0]&0xF0 == 0x40:
+            record(1, root.walk(inst, 1), 1)
+
+        # extra_legacy_prefix_match_strategy
+        num_legacy = 0
+        while unresolved() and num_legacy < len(inst) and inst[num_legacy] in legacy_prefixes:
+            num_legacy += 1
+            # Every skipped prefix must be permitted for the definition
+            record(2, set(def_hash for def_hash in root.walk(inst, num_legacy)
+                          if all(prefix in self._allowed_prefixes[def_hash] for prefix in inst[:num_legacy])),
+                   num_legacy)
+
+        # insert_rex_strategy
+        if unresolved() and len(inst) > 1 and inst[1]&0xF0 == 0x40:
+            rex_root = insert_rex_roots.get(inst[0])
+            if rex_root is not None:
+                record(3, rex_root.walk(inst, 2), 1)
+
+        return num_prefixes
+
+    def match(self, inst_bytes, cand_hashes):
+        cand_key = tuple(cand_hashes)
+        trie = self._tries.get(cand_key)
+        if trie is None:
+            trie = self._tries[cand_key] = self.build(cand_key)
+        num_prefixes = self.prefix_counts(inst_bytes, trie, set(cand_key))
+        return [(def_hash, num_prefixes[def_hash]) for def_hash in cand_key if def_hash in num_prefixes]
+
+    # Match an instruction whose mnemonic isn't known against every definition.
+    # Records are in definition order.
+    def match_any(self, inst_bytes):
+        trie = self._tries.get(None)
+        if trie is None:
+            self._order = {}
+            for def_hash in self._definitions:
+                if self._definitions[def_hash].val64 == 'V':
+                    self._order[def_hash] = len(self._order)
+            trie = self._tries[None] = self.build(self._order)
+        num_prefixes = self.prefix_counts(inst_bytes, trie, None)
+        return sorted(num_prefixes.items(), key=lambda record: self._order[record[0]])
+
+# Compile a valmask into a single (value, mask, length) triple of integers. Bytes are
+# packed little endian so the first instruction byte is the lowest one.
+def pack_valmask(valmask):
+    val = 0
+    mask = 0
+    for (i, (byte_val, byte_mask)) in enumerate(valmask):
+        val |= byte_val << (8*i)
+        mask |= byte_mask << (8*i)
+    return (val, mask, len(valmask))
+
+# A definition's valmasks compiled to integers for PackedMatcher
+class PackedDefinition(object):
+    __slots__ = ('valmasks', 'insert_rex_prefix', 'insert_rex_valmasks', 'allowed_prefixes')
+
+    def __init__(self, definition):
+        self.valmasks = [pack_valmask(valmask) for valmask in definition.valmasks]
+        (self.insert_rex_prefix, valmasks) = insert_rex_valmasks(definition)
+        self.insert_rex_valmasks = [pack_valmask(valmask) for valmask in valmasks]
+        self.allowed_prefixes = allowed_legacy_prefixes(definition)
+
+# Returns whether any packed valmask matches the packed instruction bytes x of length
+# num_bytes. Only the overlapping bytes are compared, as in valmask_check_match.
+def packed_check_match(valmasks, x, num_bytes):
+    for (val, mask, length) in valmasks:
+        if length <= num_bytes:
+            if (x & mask) == val:
+                return True
+        elif (x & mask) == val & ((1 << (8*num_bytes))-1):
+            return True
+    return False
+
+# Runs the same four match strategies as InstructionDefinition.check_for_match, but
+# each valmask is one integer compare against the instruction packed into an integer.
+class PackedMatcher(object):
+    def __init__(self, definitions_raw):
+        self._packed = {}
+        for def_hash in definitions_raw:
+            definition = definitions_raw[def_hash]
+            if definition.val64 == 'V':
+                self._packed[def_hash] = PackedDefinition(definition)
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    def match(self, inst_bytes, cand_hashes):
+        inst = inst_bytes
+        num_bytes = len(inst)
+        x = int.from_bytes(inst, 'little')
+        has_rex = inst[0]&0xF0 == 0x40
+        inserted_rex = num_bytes > 1 and inst[1]&0xF0 == 0x40
+        num_legacy = 0
+        while num_legacy < num_bytes and inst[num_legacy] in legacy_prefixes:
+            num_legacy += 1
+
+        cand_records = []
+        for def_hash in cand_hashes:
+            packed = self._packed[def_hash]
+            if self.stats is not None:
+                self.count_strategies(packed, inst, x, num_bytes, has_rex, inserted_rex, num_legacy)
+            # plain_match_strategy
+            if packed_check_match(packed.valmasks, x, num_bytes):
+                cand_records.append((def_hash, 0))
+                continue
+            # extra_rex_match_strategy
+            if has_rex and packed_check_match(packed.valmasks, x >> 8, num_bytes-1):
+                cand_records.append((def_hash, 1))
+                continue
+            # extra_legacy_prefix_match_strategy
+            matched = False
+            for num_prefixes in range(1, num_legacy+1):
+                if inst[num_prefixes-1] not in packed.allowed_prefixes:
+                    break
+                if packed_check_match(packed.valmasks, x >> (8*num_prefixes), num_bytes-num_prefixes):
+                    cand_records.append((def_hash, num_prefixes))
+                    matched = True
+                    break
+            if matched:
+                continue
+            # insert_rex_strategy
+            if inserted_rex and inst[0] == packed.insert_rex_prefix and \
+               packed_check_match(packed.insert_rex_valmasks, x >> 16, num_bytes-2):
+                cand_records.append((def_hash, 1))
+        return cand_records
+
+    # Count the strategies match tries for a candidate, and the one which matches it
+    def count_strategies(self, packed, inst, x, num_bytes, has_rex, inserted_rex, num_legacy):
+        stats = self.stats
+        stats.attempts[0] += 1
+        if packed_check_match(packed.valmasks, x, num_bytes):
+            stats.wins[0] += 1
+            return
+        stats.attempts[1] += 1
+        if has_rex and packed_check_match(packed.valmasks, x >> 8, num_bytes-1):
+            stats.wins[1] += 1
+            return
+        stats.attempts[2] += 1
+        for num_prefixes in range(1, num_legacy+1):
+            if inst[num_prefixes-1] not in packed.allowed_prefixes:
+                break
+            if packed_check_match(packed.valmasks, x >> (8*num_prefixes), num_bytes-num_prefixes):
+                stats.wins[2] += 1
+                return
+        stats.attempts[3] += 1
+        if inserted_rex and inst[0] == packed.insert_rex_prefix and \
+           packed_check_match(packed.insert_rex_valmasks, x >> 16, num_bytes-2):
+            stats.wins[3] += 1
+
+# A definition's valmasks split into the fields decode_fields splits instructions
+# into: a mandatory legacy prefix, a REX requirement and the packed remainder. Forms
+# are (prefix, rex_val, rex_mask, packed core, insert_rex). Definitions whose valmasks
+# don't split unambiguously, because the byte after the prefixes could itself be a
+# prefix, have forms None.
+class FieldDefinition(object):
+    __slots__ = ('forms', 'allowed_prefixes')
+
+    def __init__(self, definition):
+        self.allowed_prefixes = allowed_legacy_prefixes(definition)
+        (_, insert_rex) = insert_rex_valmasks(definition)
+        self.forms = []
+        for (i, valmask) in enumerate(definition.valmasks):
+            pos = 0
+            prefix = None
+            if len(valmask) != 0 and valmask[0][0] in legacy_prefixes:
+                if valmask[0][1] != 0xFF:
+                    self.forms = None
+                    return
+                prefix = valmask[0][0]
+                pos = 1
+            (rex_val, rex_mask) = (None, None)
+            if pos < len(valmask) and (valmask[pos][0]&0xF0) == 0x40 and (valmask[pos][1]&0xF0) == 0xF0:
+                (rex_val, rex_mask) = valmask[pos]
+                pos += 1
+            core = valmask[pos:]
+            if len(core) == 0 or byte_accepts(core[0], legacy_prefixes) or byte_accepts(core[0], rex_prefixes):
+                self.forms = None
+                return
+            self.forms.append((prefix, rex_val, rex_mask, pack_valmask(core), i < len(insert_rex)))
+
+# Matches instructions decoded by decode_fields against definitions compiled into
+# FieldDefinition forms. The legacy prefixes, REX prefix and core of the instruction
+# decide which of the four match strategies a form can match with, so each form costs
+# one packed compare of the core instead of one per strategy and prefix count. The
+# results are the ones check_for_match gives. Instructions whose core starts with
+# another prefix byte, and definitions without forms, go through PackedMatcher.
+class FieldMatcher(object):
+    def __init__(self, definitions_raw):
+        self._fields = {}
+        for def_hash in definitions_raw:
+            definition = definitions_raw[def_hash]
+            if definition.val64 == 'V':
+                self._fields[def_hash] = FieldDefinition(definition)
+        self._fallback = PackedMatcher(definitions_raw)
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    def match(self, inst_bytes, cand_hashes):
+        return self.match_fields(decode_fields(inst_bytes), cand_hashes)
+
+    def match_fields(self, fields, cand_hashes):
+        data = fields.data
+        core = fields.core
+        num_bytes = len(data)-core
+        if num_bytes == 0 or data[core] in legacy_prefixes or data[core]&0xF0 == 0x40:
+            return self._fallback.match(data, cand_hashes)
+        legacy = fields.legacy_prefixes
+        num_legacy = len(legacy)
+        rex = fields.rex
+        # The core bytes packed little endian, shifted out of the whole instruction
+        # rather than sliced
+        x = int.from_bytes(data, 'little') >> (8*core)
+        stats = self.stats
+
+        cand_records = []
+        for def_hash in cand_hashes:
+            field_def = self._fields[def_hash]
+            if field_def.forms is None:
+                cand_records += self._fallback.match(data, [def_hash])
+                continue
+            # (strategy, num_prefixes) of the earliest strategy any form matches with
+            best = None
+            for (prefix, rex_val, rex_mask, (val, mask, length), insert_rex) in field_def.forms:
+                if stats is not None:
+                    stats.attempts[0] += 1
+                if length <= num_bytes:
+                    if (x & mask) != val:
+                        continue
+                elif (x & mask) != val & ((1 << (8*num_bytes))-1):
+                    continue
+                if rex_val is None:
+                    rex_match = rex is None
+                else:
+                    rex_match = rex is not None and (rex & rex_mask) == rex_val
+                # plain_match_strategy
+                if rex_match and ((prefix is None and num_legacy == 0) or (num_legacy == 1 and legacy[0] == prefix)):
+                    best = (0, 0)
+                    break
+                # extra_rex_match_strategy
+                if num_legacy == 0 and rex is not None and prefix is None and rex_val is None:
+                    record = (1, 1)
+                # extra_legacy_prefix_match_strategy, skipping all but a mandatory prefix
+                elif rex_match and num_legacy >= 2 and legacy[-1] == prefix and \
+                     all(skipped in field_def.allowed_prefixes for skipped in legacy[:-1]):
+                    record = (2, num_legacy-1)
+                # extra_legacy_prefix_match_strategy, skipping every prefix
+                elif rex_match and num_legacy >= 1 and prefix is None and \
+                     all(skipped in field_def.allowed_prefixes for skipped in legacy):
+                    record = (2, num_legacy)
+                # insert_rex_strategy
+                elif insert_rex and num_legacy == 1 and legacy[0] == prefix and rex is not None and rex_val is None:
+                    record = (3, 1)
+                else:
+                    continue
+                if best is None or record < best:
+                    best = record
+            if best is not None:
+                if stats is not None:
+                    stats.wins[best[0]] += 1
+                cand_records.append((def_hash, best[1]))
+        return cand_records
+
+# Value/mask matrices for the valmasks of one group of candidate definitions.
+# Each valmask is a row, padded with zero masks which match anything.
+class ValmaskMatrix(object):
+    def __init__(self, valmasks, width):
+        self.owners = np.array([owner for (owner, _) in valmasks], dtype=np.intp)
+        self.vals = np.zeros((len(valmasks), width), dtype=np.uint8)
+        self.masks = np.zeros((len(valmasks), width), dtype=np.uint8)
+        for (row, (_, valmask)) in enumerate(valmasks):
+            for (col, (val, mask)) in enumerate(valmask):
+                self.vals[row, col] = val
+                self.masks[row, col] = mask
+
+    # Returns a (num instructions, num owners) boolean matrix of whether any valmask of
+    # each owner matches the instruction bytes starting at the given per row offsets.
+    def check_match(self, inst_matrix, lengths, offsets, num_owners):
+        num_insts = inst_matrix.shape[0]
+        width = self.vals.shape[1]
+        cols = offsets[:, None] + np.arange(width)[None, :]
+        shifted = np.take_along_axis(inst_matrix, cols, axis=1)
+        # Like valmask_check_match, bytes past the end of the instruction always match
+        beyond_end = cols >= lengths[:, None]
+        byte_match = ((shifted[:, None, :] & self.masks[None, :, :]) == self.vals[None, :, :]) | beyond_end[:, None, :]
+        valmask_match = byte_match.all(axis=2)
+        owner_match = np.zeros((num_insts, num_owners), dtype=bool)
+        for owner in range(num_owners):
+            owner_match[:, owner] = valmask_match[:, self.owners == owner].any(axis=1)
+        return owner_match
+
+# Matches whole lists of instructions sharing a mnemonic at once with vectorized
+# numpy reductions. Instructions are a padded uint8 matrix plus a length column.
+# Runs the same four match strategies as InstructionDefinition.check_for_match.
+class NumpyMatcher(object):
+    max_inst_bytes = 15
+    chunk_size = 4096
+
+    def __init__(self, definitions_raw):
+        self._definitions = definitions_raw
+        self._width = max(len(valmask) for definition in definitions_raw.values() for valmask in definition.valmasks)
+        self._width = max(self._width, NumpyMatcher.max_inst_bytes)
+        self._groups = {}
+        legacy_table = np.zeros(256, dtype=bool)
+        legacy_table[list(legacy_prefixes)] = True
+        self._legacy_table = legacy_table
+        # MatchStats to count strategy attempts and wins in, when profiling
+        self.stats = None
+
+    # Valmask matrices and prefix tables of a group of candidates, built on first use
+    def get_group(self, cand_hashes):
+        key = tuple(cand_hashes)
+        if key not in self._groups:
+            plain = []
+            insert_rex = []
+            insert_rex_prefix = np.full(len(cand_hashes), -1, dtype=np.int16)
+            allowed = np.zeros((len(cand_hashes), 256), dtype=bool)
+            for (owner, def_hash) in enumerate(cand_hashes):
+                definition = self._definitions[def_hash]
+                for valmask in definition.valmasks:
+                    plain.append((owner, valmask))
+                (first_val, valmasks) = insert_rex_valmasks(definition)
+                if first_val is not None:
+                    insert_rex_prefix[owner] = first_val
+                    for valmask in valmasks:
+                        insert_rex.append((owner, valmask))
+                allowed[owner, list(allowed_legacy_prefixes(definition))] = True
+            self._groups[key] = (ValmaskMatrix(plain, self._width),
+                                 ValmaskMatrix(insert_rex, self._width),
+                                 insert_rex_prefix, allowed)
+        return self._groups[key]
+
+    # Encode instructions' bytes as a zero padded uint8 matrix and a length column.
+    # The padding leaves room to shift by every possible prefix count.
+    def encode(self, inst_bytes_list):
+        inst_matrix = np.zeros((len(inst_bytes_list), 2*self._width+1), dtype=np.uint8)
+        lengths = np.zeros(len(inst_bytes_list), dtype=np.intp)
+        for (row, inst_bytes) in enumerate(inst_bytes_list):
+            inst_matrix[row, :len(inst_bytes)] = np.frombuffer(inst_bytes, dtype=np.uint8)
+            lengths[row] = len(inst_bytes)
+        return (inst_matrix, lengths)
+
+    # Returns a (num instructions, num candidates) matrix holding the prefix count of
+    # each matching candidate and -1 for candidates which don't match.
+    def match_matrix(self, inst_matrix, lengths, cand_hashes):
+        (plain, insert_rex, insert_rex_prefix, allowed) = self.get_group(cand_hashes)
+        num_insts = inst_matrix.shape[0]
+        num_cands = len(cand_hashes)
+        result = np.full((num_insts, num_cands), -1, dtype=np.int16)
+        stats = self.stats
+
+        def record(strategy, rows, matched, num_prefixes):
+            unresolved = result[rows] == -1
+            update = result[rows]
+            update[matched & unresolved] = num_prefixes
+            result[rows] = update
+            if stats is not None:
+                stats.attempts[strategy] += len(rows)
+                stats.wins[strategy] += int((matched & unresolved).sum())
+
+        # plain_match_strategy
+        all_rows = np.arange(num_insts)
+        record(0, all_rows, plain.check_match(inst_matrix, lengths, np.zeros(num_insts, dtype=np.intp), num_cands), 0)
+
+        # extra_rex_match_strategy
+        rows = np.nonzero((inst_matrix[:, 0] & 0xF0) == 0x40)[0]
+        if len(rows) != 0:
+            record(1, rows, plain.check_match(inst_matrix[rows], lengths[rows], np.ones(len(rows), dtype=np.intp), num_cands), 1)
+
+        # extra_legacy_prefix_match_strategy
+        is_legacy = self._legacy_table[inst_matrix]
+        num_legacy = np.cumprod(is_legacy, axis=1).sum(axis=1)
+        for num_prefixes in range(1, int(num_legacy.max(initial=0))+1):
+            rows = np.nonzero(num_legacy >= num_prefixes)[0]
+            matched = plain.check_match(inst_matrix[rows], lengths[rows], np.full(len(rows), num_prefixes, dtype=np.intp), num_cands)
+            # Every skipped prefix must be permitted for the candidate
+            prefixes_allowed = allowed[:, inst_matrix[rows, :num_prefixes]].all(axis=2).T
+            record(2, rows, matched & prefixes_allowed, num_prefixes)
+
+        # insert_rex_strategy
+        if len(insert_rex.owners) != 0:
+            rows = np.nonzero(((inst_matrix[:, 1] & 0xF0) == 0x40) & (lengths > 1))[0]
+            if len(rows) != 0:
+                matched = insert_rex.check_match(inst_matrix[rows], lengths[rows], np.full(len(rows), 2, dtype=np.intp), num_cands)
+                matched &= inst_matrix[rows, 0][:, None] == insert_rex_prefix[None, :]
+                record(3, rows, matched, 1)
+
+        return result
+
+    # Match a list of instruction byte lists which all share the given candidates.
+    # Returns one list of (def_hash, num_prefixes) records per instruction.
+    def match_batch(self, inst_bytes_list, cand_hashes):
+        results = []
+        for start in range(0, len(inst_bytes_list), NumpyMatcher.chunk_size):
+            (inst_matrix, lengths) = self.encode(inst_bytes_list[start:start+NumpyMatcher.chunk_size])
+            result = self.match_matrix(inst_matrix, lengths, cand_hashes)
+            for row in result.tolist():
+                results.append([(cand_hashes[i], num_prefixes) for (i, num_prefixes) in enumerate(row) if num_prefixes != -1])
+        return results
+
+    def match(self, inst_bytes, cand_hashes):
+        return self.match_batch([inst_bytes], cand_hashes)[0]
+
+# Hex strings of the bytes which may lead an instruction ahead of the bytes the
+# match strategies compare: legacy prefixes and REX prefixes.
+leading_prefix_bytes = legacy_prefixes | set(range(0x40, 0x50))
+
+# Number of leading bytes of an instruction, past its legacy and REX prefixes, which can
+# influence matching against the given definitions. Bytes after the last nonzero mask
+# byte of every valmask never do, which masks out displacements and immediates.
+def significant_length(definitions_raw, cand_hashes):
+    length = 0
+    for def_hash in cand_hashes:
+        for valmask in definitions_raw[def_hash].valmasks:
+            for (i, (_, mask)) in enumerate(valmask):
+                if mask != 0 and i+1 > length:
+                    length = i+1
+    return length
+
+# A bounded least recently used memo of resolved instructions. Keys are the mnemonic
+# plus only the instruction bytes which can affect matching, so the same encoding
+# with different displacements or immediates resolves once.
+class MatchMemo(object):
+    def __init__(self, definitions_raw, max_size):
+        self._definitions = definitions_raw
+        self._max_size = max_size
+        self._cache = collections.OrderedDict()
+        self._lengths = {}
+        self.hits = 0
+        self.misses = 0
+
+    # Build the memo key of an instruction. operand_is_memory is None for mnemonics
+    # whose resolution doesn't depend on the operand type. Returns None until the
+    # mnemonic's candidates have been registered.
+    def key(self, inst_name, inst_bytes, operand_is_memory):
+        if inst_name not in self._lengths:
+            return None
+        num_prefixes = 0
+        while num_prefixes < len(inst_bytes) and inst_bytes[num_prefixes] in leading_prefix_bytes:
+            num_prefixes += 1
+        return (inst_name, inst_bytes[:num_prefixes+self._lengths[inst_name]], operand_is_memory)
+
+    def register(self, inst_name, cand_hashes):
+        if inst_name not in self._lengths:
+            self._lengths[inst_name] = significant_length(self._definitions, cand_hashes)
+
+    def get(self, key):
+        if key is None or key not in self._cache:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def put(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+matchers = {'trie': TrieMatcher,
+            'adaptive': AdaptiveMatcher,
+            'fields': FieldMatcher,
+            'numpy': NumpyMatcher,
+            'packed': PackedMatcher,
+            'strategies': StrategyMatcher}
@@ -0,0 +1,96 @@
+from array import array
+
+# The instructions of a disassembled binary stored column by column instead of as one
+# tuple per instruction. Addresses and interned mnemonic ids are packed arrays, the
+# encodings share one buffer indexed by an offsets array, and the decoded text is
+# only kept for the mnemonics in decode_mnemonics, which need it to be resolved. The
+# decode of every other instruction reads back as ''.
+class InstructionStore(object):
+    def __init__(self, decode_mnemonics=()):
+        self.addresses = array('Q')
+        self.mnemonic_ids = array('I')
+        # Mnemonic of each id, None for instructions without one
+        self.mnemonics = []
+        self._mnemonic_ids = {}
+        self.encodings = bytearray()
+        # Instruction i's bytes are encodings[offsets[i]:offsets[i+1]]
+        self.offsets = array('Q', [0])
+        self.decodes = {}
+        self._decode_mnemonics = set(decode_mnemonics)
+
+    # Store the instructions of an (address, inst_name, inst_bytes, inst_decode) stream
+    @classmethod
+    def from_stream(cls, instructions, decode_mnemonics=()):
+        store = cls(decode_mnemonics)
+        store.extend(instructions)
+        return store
+
+    def append(self, address, inst_name, inst_bytes, inst_decode):
+        mnemonic_id = self._mnemonic_ids.get(inst_name)
+        if mnemonic_id is None:
+            mnemonic_id = self._mnemonic_ids[inst_name] = len(self.mnemonics)
+            self.mnemonics.append(inst_name)
+        if inst_name in self._decode_mnemonics:
+            self.decodes[len(self.addresses)] = inst_decode
+        self.addresses.append(address)
+        self.mnemonic_ids.append(mnemonic_id)
+        self.encodings += inst_bytes
+        self.offsets.append(len(self.encodings))
+
+    def extend(self, instructions):
+        for (address, inst_name, inst_bytes, inst_decode) in instructions:
+            self.append(address, inst_name, inst_bytes, inst_decode)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def mnemonic(self, index):
+        return self.mnemonics[self.mnemonic_ids[index]]
+
+    def encoding(self, index):
+        return bytes(self.encodings[self.offsets[index]:self.offsets[index+1]])
+
+    def decode(self, index):
+        return self.decodes.get(index, '')
+
+    # Yield (address, inst_name, inst_bytes, inst_decode) tuples like a disassembler
+    # stream. The bytes are copied out of a view of the shared buffer, so only the
+    # instruction being worked on exists as objects.
+    def __iter__(self):
+        view = memoryview(self.encodings)
+        try:
+            addresses = self.addresses
+            mnemonic_ids = self.mnemonic_ids
+            mnemonics = self.mnemonics
+            offsets = self.offsets
+            decodes = self.decodes
+            for index in range(len(addresses)):
+                yield (addresses[index], mnemonics[mnemonic_ids[index]],
+                       bytes(view[offsets[index]:offsets[index+1]]), decodes.get(index, ''))
+        finally:
+            view.release()
+
+    # Approximate memory held by the columns in bytes
+    def nbytes(self):
+        return (self.addresses.itemsize*len(self.addresses)+self.mnemonic_ids.itemsize*len(self.mnemonic_ids)
+                + len(self.encodings)+self.offsets.itemsize*len(self.offsets))
+
+# Collapse an (address, inst_name, inst_bytes, inst_decode) stream into its unique
+# (mnemonic, encoding) pairs. Returns an InstructionStore holding the first occurrence
+# of each pair in stream order, with its representative address, and an array of
+# how many times each occurs. Equal bytes decode to the same instruction, so every
+# occurrence resolves like its representative.
+def deduplicate(instructions, decode_mnemonics=()):
+    store = InstructionStore(decode_mnemonics)
+    counts = array('Q')
+    unique_idxs = {}
+    for (address, inst_name, inst_bytes, inst_decode) in instructions:
+        key = (inst_name, inst_bytes)
+        unique_idx = unique_idxs.get(key)
+        if unique_idx is None:
+            unique_idxs[key] = len(counts)
+            store.append(address, inst_name, inst_bytes, inst_decode)
+            counts.append(1)
+        else:
+            counts[unique_idx] += 1
+    return (store, counts)
@@ -0,0 +1,120 @@
+import json
+
+def violation_record(violation):
+    if violation is None:
+        return None
+    return {
+        'address': violation.address,
+        'mnemonic': violation.mnemonic,
+        'bytes': None if violation.inst_bytes is None else violation.inst_bytes.hex().upper(),
+        'cpuid': violation.cpuid_reqs,
+        'function': violation.function,
+    }
+
+# Machine readable reports. In ndjson mode every record is written as a line as soon as
+# it's available. In json mode the records are collected into one document written by
+# close(), with each binary's details nested under it.
+class JsonReporter(object):
+    def __init__(self, stream, mode, definitions_raw):
+        self.stream = stream
+        self.mode = mode
+        self.definitions_raw = definitions_raw
+        self.document = {'binaries': [], 'dependencies': [], 'summary': None}
+
+    def _emit(self, record):
+        self.stream.write(json.dumps(record)+'\n')
+        self.stream.flush()
+
+    # Report the result of a binary, or the error its analysis failed with
+    def binary(self, input_file, result, error=None):
+        record = {
+            'type': 'binary',
+            'path': input_file,
+            'error': error,
+        }
+        details = {}
+        if result is not None:
+            record['cached'] = result.cached
+            record['num_instructions'] = result.num_instructions
+            record['extension_requirements'] = result.extension_requirements
+            record['uncertain'] = result.uncertain
+            record['violation'] = violation_record(result.violation)
+            details['extension'] = [{'cpuid': cpuid_reqs, 'count': result.requirement_counts.get(tuple(cpuid_reqs), 0)}
+                                    for cpuid_reqs in result.extension_requirements]
+            details['unsupported'] = [{'name': name, 'count': result.unsupported_inst_encounters[name]}
+                                      for name in sorted(result.unsupported_inst_encounters)]
+            details['definition'] = []
+            for def_hash in result.instruction_count.keys():
+                definition = self.definitions_raw[def_hash]
+                details['definition'].append({'name': definition.name, 'instruction': definition.instruction,
+                                              'cpuid': definition.cpuid, 'count': result.instruction_count[def_hash]})
+            details['instruction'] = [{'address': address, 'mnemonic': mnemonic, 'bytes': inst_bytes.hex().upper(), 'cpuid': cpuid_reqs}
+                                      for (address, mnemonic, inst_bytes, cpuid_reqs) in result.instruction_hits]
+            if result.function_requirements is not None:
+                details['function'] = [{'name': function, 'cpuid': cpuid_reqs, 'count': count, 'first_address': first_address}
+                                       for cpuid_reqs in result.extension_requirements
+                                       for (function, (count, first_address)) in sorted(result.function_requirements.get(tuple(cpuid_reqs), {}).items(),
+                                                                                        key=lambda item: item[1][1])]
+
+        if self.mode == 'ndjson':
+            self._emit(record)
+            for (record_type, records) in details.items():
+                for detail in records:
+                    self._emit(dict({'type': record_type, 'path': input_file}, **detail))
+        else:
+            del record['type']
+            for (record_type, records) in details.items():
+                record[f"{record_type}s"] = records
+            self.document['binaries'].append(record)
+
+    # Report the combined requirements of a binary and the libraries it loads
+    def dependencies(self, executable, libraries, missing, merged, requiring, failed, violations):
+        record = {
+            'type': 'dependencies',
+            'path': executable,
+            'libraries': libraries,
+            'missing': missing,
+            'extension_requirements': [{'cpuid': cpuid_reqs, 'binaries': requiring[tuple(cpuid_reqs)]}
+                                       for cpuid_reqs in merged.extension_requirements],
+            'errors': [{'path': binary, 'error': error} for (binary, error) in failed],
+            'violations': [dict({'path': binary}, **violation_record(violation)) for (binary, violation) in violations],
+        }
+        if self.mode == 'ndjson':
+            self._emit(record)
+        else:
+            del record['type']
+            self.document['dependencies'].append(record)
+
+    # Report the totals of a batch
+    def summary(self, summary):
+        record = {
+            'type': 'summary',
+            'num_binaries': summary.num_binaries,
+            'num_instructions': summary.num_instructions,
+            'requirement_counts': [{'cpuid': list(cpuid_reqs), 'binaries': count}
+                                   for (cpuid_reqs, count) in sorted(summary.requirement_counts.items(), key=lambda item: (-item[1], item[0]))],
+            'unsupported': [{'name': name, 'count': summary.unsupported_inst_encounters[name]}
+                            for name in sorted(summary.unsupported_inst_encounters)],
+            'violations': [dict({'path': input_file}, **violation_record(violation)) for (input_file, violation) in summary.violations],
+            'errors': [{'path': input_file, 'error': error} for (input_file, error) in summary.failed],
+        }
+        if self.mode == 'ndjson':
+            self._emit(record)
+        else:
+            del record['type']
+            self.document['summary'] = record
+
+    # Report the profile of a run
+    def profile(self, profile):
+        record = dict({'type': 'profile'}, **profile.record())
+        if self.mode == 'ndjson':
+            self._emit(record)
+        else:
+            del record['type']
+            self.document['profile'] = record
+
+    def close(self):
+        if self.mode == 'json':
+            json.dump(self.document, self.stream, indent=2)
+            self.stream.write('\n')
+            self.stream.flush()
@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import sys
+from cpu_policy import policy_presets
+from analysis_service import request_analysis, default_socket_path
+
+parser = argparse.ArgumentParser("Tool sending binaries to analysis_daemon.py and printing its report. Exits with the status get_extension_requirements.py would.")
+
+parser.add_argument("inputs", help="Binaries or directories to analyze. Directories are scanned for every 64 bit x86 ELF file", type=str, nargs='+')
+parser.add_argument("--socket", help="Unix domain socket the daemon listens on", type=str, default=default_socket_path)
+parser.add_argument("-c", "--careful", help="Scrutinize all instructions instead of just non-trivial requirement instructions", action='store_true')
+parser.add_argument("--disassembler", help="Disassembler the daemon uses. builtin decodes the ELF file in process instead of running objdump", choices=['objdump', 'builtin'], default='objdump')
+parser.add_argument("--full-stats", help="Record and report full instruction stats", action='store_true')
+parser.add_argument("--allow", help=f"Extensions binaries may use, as comma separated extension names or presets ({', '.join(sorted(policy_presets))} or host for the daemon's machine). Exits with status 2 when a binary needs anything else", type=str, action='append')
+parser.add_argument("--functions", help="Attribute the instructions with extension requirements to their functions, using the ELF symbol tables", action='store_true')
+parser.add_argument("--instruction-hits", help="Report every instruction with extension requirements in the ndjson format", action='store_true')
+parser.add_argument("--output-format", help="Report format. ndjson prints the daemon's records one per line as they arrive", choices=['text', 'ndjson'], default='text')
+
+args = parser.parse_args()
+
+options = {
+    'careful': args.careful,
+    'disassembler': args.disassembler,
+    'full_stats': args.full_stats,
+    'functions': args.functions,
+    'instruction_hits': args.instruction_hits,
+    'allow': args.allow,
+}
+
+# The daemon has its own working directory
+paths = [os.path.abspath(path) for path in args.inputs]
+
+status = None
+try:
+    for record in request_analysis(args.socket, paths, options, args.output_format):
+        if record['type'] == 'status':
+            status = record['status']
+        elif record['type'] == 'error':
+            print(f"ERROR: {record['error']}", file=sys.stderr)
+        elif args.output_format == 'ndjson':
+            print(json.dumps(record), flush=True)
+        else:
+            print(record['text'], end='', flush=True)
+except OSError as e:
+    print(f"ERROR: Couldn't reach the analysis daemon at {args.socket}: {e}")
+    sys.exit(1)
+
+if status is None:
+    print("ERROR: The analysis daemon closed the connection before finishing")
+    sys.exit(1)
+sys.exit(status)
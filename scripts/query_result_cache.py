@@ -0,0 +1,62 @@
+import argparse
+import os
+import sqlite3
+import sys
+from result_cache import ResultCache, analysis_fingerprint
+
+parser = argparse.ArgumentParser("Query the results cached by get_extension_requirements.py --result-cache")
+
+parser.add_argument("--cache", help="The result cache file", type=str, required=True)
+parser.add_argument("-d", "--definitions", help="Only consider results from these instruction definitions", type=str)
+parser.add_argument("--disassembler", help="Only consider results from this disassembler, with --definitions", choices=['objdump', 'builtin'], default='objdump')
+parser.add_argument("-c", "--careful", help="Only consider results of careful scans, with --definitions", action='store_true')
+
+subparsers = parser.add_subparsers(dest='command', required=True)
+requires_parser = subparsers.add_parser("requires", help="List cached binaries requiring all of the given extensions")
+requires_parser.add_argument("extensions", help="Extensions such as AVX512F", nargs='+')
+show_parser = subparsers.add_parser("show", help="Show the cached requirements of binaries")
+show_parser.add_argument("paths", help="Binary paths", nargs='+')
+functions_parser = subparsers.add_parser("functions", help="List the functions of cached binaries using all of the given extensions, for results analyzed with --functions")
+functions_parser.add_argument("extensions", help="Extensions such as AVX512F", nargs='+')
+subparsers.add_parser("extensions", help="Count the cached binaries requiring each extension")
+
+args = parser.parse_args()
+
+if not os.path.isfile(args.cache):
+    print(f"Result cache {args.cache} doesn't exist or is a directory!")
+    sys.exit(1)
+
+fingerprint = None
+if args.definitions is not None:
+    if not os.path.isfile(args.definitions):
+        print(f"Definitions file {args.definitions} doesn't exist or is a directory!")
+        sys.exit(1)
+    fingerprint = analysis_fingerprint(args.definitions, args.disassembler, args.careful)
+
+# Queries never change the cache, so one of another version is reported rather than emptied
+try:
+    cache = ResultCache(args.cache, read_only=True)
+except (RuntimeError, sqlite3.Error) as e:
+    print(f"ERROR: {e}")
+    sys.exit(1)
+
+if args.command == 'requires':
+    for (path, key, _) in cache.query_requires(args.extensions, fingerprint):
+        print(f"{path} ({key})")
+elif args.command == 'functions':
+    for (path, function, cpuid_reqs, count, first_address) in cache.query_functions(args.extensions, fingerprint):
+        print(f"{path}: {function} {cpuid_reqs} -> {count} instructions, first at 0x{first_address:x}")
+elif args.command == 'show':
+    for path in args.paths:
+        results = cache.query_path(os.path.realpath(path))
+        if len(results) == 0:
+            print(f"{path}: not cached")
+        for (key, result_fingerprint, requirements) in results:
+            if fingerprint is not None and result_fingerprint != fingerprint:
+                continue
+            print(f"{path} ({key}): {requirements}")
+elif args.command == 'extensions':
+    for (extension, count) in cache.extension_counts(fingerprint):
+        print(f"{extension} -> {count} binaries")
+
+cache.close()
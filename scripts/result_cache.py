@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from elf import ElfFile
+from instruction_definitions import definitions_checksum
+from extension_analysis import AnalysisResult
+
+# Key identifying the contents of a binary. The GNU build-id is used when the binary has
+# one, otherwise the file is hashed.
+def binary_key(path):
+    try:
+        elf_file = ElfFile(path)
+    except ValueError:
+        elf_file = None
+    if elf_file is not None:
+        try:
+            build_id = elf_file.build_id()
+        finally:
+            elf_file.close()
+        if build_id is not None:
+            return f"build-id:{build_id}"
+
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as binary_file:
+        for block in iter(lambda: binary_file.read(1 << 20), b''):
+            content_hash.update(block)
+    return f"sha256:{content_hash.hexdigest()}"
+
+# Fingerprint of everything besides the binary which determines the result of an analysis
+def analysis_fingerprint(definitions_file, disassembler, careful):
+    return f"{definitions_checksum(definitions_file).hex()}:{disassembler}:{'careful' if careful else 'nontrivial'}"
+
+# Bumped when the layout changes. Caches of other versions are emptied when opened
+# for writing.
+cache_schema_version = 4
+
+cache_schema = """
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    binary_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    num_instructions INTEGER NOT NULL,
+    full_stats INTEGER NOT NULL,
+    functions INTEGER NOT NULL,
+    scanned_at REAL NOT NULL,
+    UNIQUE (binary_key, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    binary_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paths_by_key ON paths (binary_key);
+CREATE TABLE IF NOT EXISTS requirements (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    cpuid TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (result_id, position)
+);
+CREATE TABLE IF NOT EXISTS extensions (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    extension TEXT NOT NULL,
+    PRIMARY KEY (extension, result_id)
+);
+CREATE TABLE IF NOT EXISTS requirement_extensions (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    extension TEXT NOT NULL,
+    PRIMARY KEY (extension, result_id, position)
+);
+CREATE INDEX IF NOT EXISTS requirement_extensions_by_result ON requirement_extensions (result_id);
+CREATE TABLE IF NOT EXISTS function_requirements (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    function TEXT,
+    count INTEGER NOT NULL,
+    first_address INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS function_requirements_by_requirement ON function_requirements (result_id, position);
+CREATE TABLE IF NOT EXISTS unsupported (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS unsupported_by_result ON unsupported (result_id);
+CREATE TABLE IF NOT EXISTS instruction_stats (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    opcode TEXT NOT NULL,
+    instruction TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS instruction_stats_by_result ON instruction_stats (result_id);
+"""
+
+# SQLite store of analysis results keyed by binary_key and analysis_fingerprint, so
+# unchanged binaries are answered without disassembling them again. Every extension a
+# result requires is indexed for queries, along with the functions using each
+# requirement list when they were attributed. Instructions outside every function are
+# attributed to None, stored as NULL. A read only cache is opened without
+# creating or migrating anything, and raises RuntimeError if it's of another version.
+class ResultCache(object):
+    def __init__(self, cache_file, read_only=False):
+        if read_only:
+            self._db = sqlite3.connect(f"{pathlib.Path(cache_file).absolute().as_uri()}?mode=ro", uri=True)
+        else:
+            self._db = sqlite3.connect(cache_file)
+        (version,) = self._db.execute("PRAGMA user_version").fetchone()
+        if read_only:
+            if version != cache_schema_version:
+                self._db.close()
+                raise RuntimeError(f"Result cache {cache_file} has schema version {version}, this revision reads version {cache_schema_version}. "
+                                   f"Running get_extension_requirements.py --result-cache on it empties it for this version")
+            return
+        if version != cache_schema_version:
+            tables = [name for (name,) in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for table in tables:
+                self._db.execute(f"DROP TABLE {table}")
+            self._db.execute(f"PRAGMA user_version = {cache_schema_version}")
+        self._db.executescript(cache_schema)
+
+    def close(self):
+        self._db.close()
+
+    # Return the cached result of a binary, or None if it isn't cached. Results without
+    # instruction stats or function attribution don't satisfy a lookup which needs them.
+    def lookup(self, key, fingerprint, path, definitions_raw, full_stats=False, functions=False):
+        row = self._db.execute("SELECT id, num_instructions, full_stats, functions FROM results WHERE binary_key = ? AND fingerprint = ?",
+                               (key, fingerprint)).fetchone()
+        if row is None:
+            return None
+        (result_id, num_instructions, has_full_stats, has_functions) = row
+        if (full_stats and not has_full_stats) or (functions and not has_functions):
+            return None
+
+        result = AnalysisResult(path)
+        result.cached = True
+        result.num_instructions = num_instructions
+        for (cpuid, count) in self._db.execute("SELECT cpuid, count FROM requirements WHERE result_id = ? ORDER BY position", (result_id,)):
+            cpuid_reqs = json.loads(cpuid)
+            result.extension_requirements.append(cpuid_reqs)
+            result.requirement_counts[tuple(cpuid_reqs)] = count
+        if functions:
+            result.function_requirements = {}
+            for (position, function, count, first_address) in self._db.execute("SELECT position, function, count, first_address FROM function_requirements "
+                                                                               "WHERE result_id = ?", (result_id,)):
+                reqs_key = tuple(result.extension_requirements[position])
+                result.function_requirements.setdefault(reqs_key, {})[function] = [count, first_address]
+        for (name, count) in self._db.execute("SELECT name, count FROM unsupported WHERE result_id = ?", (result_id,)):
+            result.unsupported_inst_encounters[name] = count
+        if full_stats:
+            for (opcode, instruction, count) in self._db.execute("SELECT opcode, instruction, count FROM instruction_stats WHERE result_id = ?", (result_id,)):
+                # Definitions are keyed by a hash of their opcode and instruction
+                def_hash = hash(opcode+instruction)
+                if def_hash in definitions_raw:
+                    result.instruction_count[def_hash] = count
+        self.add_path(key, path)
+        return result
+
+    def add_path(self, key, path):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO paths (path, binary_key) VALUES (?, ?)", (os.path.realpath(path), key))
+
+    # Store the result of analyzing a binary, replacing any previous result
+    def store(self, key, fingerprint, result, definitions_raw, full_stats=False):
+        with self._db:
+            self._db.execute("DELETE FROM results WHERE binary_key = ? AND fingerprint = ?", (key, fingerprint))
+            has_functions = result.function_requirements is not None
+            cursor = self._db.execute("INSERT INTO results (binary_key, fingerprint, num_instructions, full_stats, functions, scanned_at) "
+                                      "VALUES (?, ?, ?, ?, ?, ?)",
+                                      (key, fingerprint, result.num_instructions, 1 if full_stats else 0, 1 if has_functions else 0, time.time()))
+            result_id = cursor.lastrowid
+            self._db.executemany("INSERT INTO requirements (result_id, position, cpuid, count) VALUES (?, ?, ?, ?)",
+                                 [(result_id, position, json.dumps(cpuid_reqs), result.requirement_counts.get(tuple(cpuid_reqs), 0))
+                                  for (position, cpuid_reqs) in enumerate(result.extension_requirements)])
+            extensions = set(extension for cpuid_reqs in result.extension_requirements for extension in cpuid_reqs)
+            self._db.executemany("INSERT INTO extensions (result_id, extension) VALUES (?, ?)",
+                                 [(result_id, extension) for extension in sorted(extensions)])
+            self._db.executemany("INSERT INTO requirement_extensions (result_id, position, extension) VALUES (?, ?, ?)",
+                                 [(result_id, position, extension) for (position, cpuid_reqs) in enumerate(result.extension_requirements)
+                                  for extension in sorted(set(cpuid_reqs))])
+            if has_functions:
+                self._db.executemany("INSERT INTO function_requirements (result_id, position, function, count, first_address) VALUES (?, ?, ?, ?, ?)",
+                                     [(result_id, position, function, count, first_address)
+                                      for (position, cpuid_reqs) in enumerate(result.extension_requirements)
+                                      for (function, (count, first_address)) in result.function_requirements.get(tuple(cpuid_reqs), {}).items()])
+            self._db.executemany("INSERT INTO unsupported (result_id, name, count) VALUES (?, ?, ?)",
+                                 [(result_id, name, count) for (name, count) in result.unsupported_inst_encounters.items()])
+            if full_stats:
+                self._db.executemany("INSERT INTO instruction_stats (result_id, opcode, instruction, count) VALUES (?, ?, ?, ?)",
+                                     [(result_id, definitions_raw[def_hash].opcode, definitions_raw[def_hash].instruction,
+                                       result.instruction_count[def_hash])
+                                      for def_hash in result.instruction_count.keys()])
+            self._db.execute("INSERT OR REPLACE INTO paths (path, binary_key) VALUES (?, ?)", (os.path.realpath(result.input_file), key))
+
+    # Cached binaries requiring every one of the given extensions. Yields the path,
+    # binary key and fingerprint of each result, with every known path of a binary.
+    def query_requires(self, extensions, fingerprint=None):
+        extensions = sorted(set(extensions))
+        placeholders = ', '.join('?'*len(extensions))
+        query = (f"SELECT paths.path, results.binary_key, results.fingerprint FROM results "
+                 f"JOIN paths ON paths.binary_key = results.binary_key "
+                 f"WHERE results.id IN (SELECT result_id FROM extensions WHERE extension IN ({placeholders}) "
+                 f"GROUP BY result_id HAVING COUNT(*) = ?)")
+        parameters = extensions+[len(extensions)]
+        if fingerprint is not None:
+            query += " AND results.fingerprint = ?"
+            parameters.append(fingerprint)
+        yield from self._db.execute(query+" ORDER BY paths.path", parameters)
+
+    # Functions of cached binaries using requirement lists with every one of the given
+    # extensions. Yields the path, function, requirement list, instruction count and
+    # first address of each, with every known path of a binary.
+    def query_functions(self, extensions, fingerprint=None):
+        extensions = sorted(set(extensions))
+        placeholders = ', '.join('?'*len(extensions))
+        query = (f"SELECT paths.path, function_requirements.function, requirements.cpuid, function_requirements.count, "
+                 f"function_requirements.first_address FROM function_requirements "
+                 f"JOIN requirements ON requirements.result_id = function_requirements.result_id "
+                 f"AND requirements.position = function_requirements.position "
+                 f"JOIN results ON results.id = function_requirements.result_id "
+                 f"JOIN paths ON paths.binary_key = results.binary_key "
+                 f"WHERE (function_requirements.result_id, function_requirements.position) IN "
+                 f"(SELECT result_id, position FROM requirement_extensions WHERE extension IN ({placeholders}) "
+                 f"GROUP BY result_id, position HAVING COUNT(*) = ?)")
+        parameters = extensions+[len(extensions)]
+        if fingerprint is not None:
+            query += " AND results.fingerprint = ?"
+            parameters.append(fingerprint)
+        for (path, function, cpuid, count, first_address) in self._db.execute(query+" ORDER BY paths.path, function_requirements.first_address",
+                                                                             parameters):
+            yield (path, function, json.loads(cpuid), count, first_address)
+
+    # The cached results of a path, as (binary key, fingerprint, requirement lists)
+    def query_path(self, path):
+        results = []
+        for (result_id, key, fingerprint) in self._db.execute("SELECT results.id, results.binary_key, results.fingerprint FROM results "
+                                                              "JOIN paths ON paths.binary_key = results.binary_key WHERE paths.path = ?",
+                                                              (path,)).fetchall():
+            requirements = [json.loads(cpuid) for (cpuid,) in
+                            self._db.execute("SELECT cpuid FROM requirements WHERE result_id = ? ORDER BY position", (result_id,))]
+            results.append((key, fingerprint, requirements))
+        return results
+
+    # Number of binaries requiring each extension
+    def extension_counts(self, fingerprint=None):
+        if fingerprint is None:
+            return self._db.execute("SELECT extension, COUNT(*) FROM extensions GROUP BY extension ORDER BY extension").fetchall()
+        return self._db.execute("SELECT extensions.extension, COUNT(*) FROM extensions JOIN results ON results.id = extensions.result_id "
+                                "WHERE results.fingerprint = ? GROUP BY extensions.extension ORDER BY extensions.extension",
+                                (fingerprint,)).fetchall()
@@ -0,0 +1,144 @@
+import resource
+import time
+from instruction_matching import MatchStats, match_strategy_names
+
+# Stages in report order. disassembly is the time spent waiting on the instruction
+# stream, which covers parsing objdump's output or decoding in process, and objdump
+# is the CPU time of the objdump processes themselves. Their wall time overlaps the
+# disassembly stage, so isn't counted separately. deduplication is collapsing the
+# stream into unique encodings.
+profile_stages = ['disassembly', 'objdump', 'deduplication', 'batch matching', 'memo lookup', 'candidate lookup',
+                  'matching', 'ambiguity resolution', 'bookkeeping']
+
+# Peak resident set size of this process and of its waited for children in kilobytes
+def peak_rss():
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime+usage.ru_stime
+
+# Wall and CPU time per stage and counters of a scan, recorded by ExtensionAnalyzer
+# with --profile. Timing brackets the stages of the primary loop directly rather than
+# sampling, and profiles of several binaries merge into one.
+class ScanProfile(object):
+    def __init__(self):
+        # [wall seconds, cpu seconds] of each stage
+        self.stages = {}
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.counters = {}
+        # Match strategy attempts and wins, filled in by the matching engine
+        self.match_stats = MatchStats()
+        # [resolutions, wall seconds] spent resolving each mnemonic
+        self.mnemonics = {}
+        self.peak_rss = 0
+        self.peak_children_rss = 0
+
+    @staticmethod
+    def clock():
+        return (time.perf_counter(), time.process_time())
+
+    # Add the time since start to a stage and return the current clock
+    def lap(self, stage, start):
+        now = (time.perf_counter(), time.process_time())
+        times = self.stages.get(stage)
+        if times is None:
+            times = self.stages[stage] = [0., 0.]
+        times[0] += now[0]-start[0]
+        times[1] += now[1]-start[1]
+        return now
+
+    def add_stage(self, stage, wall_time, cpu_time):
+        times = self.stages.setdefault(stage, [0., 0.])
+        times[0] += wall_time
+        times[1] += cpu_time
+
+    def count(self, counter, num=1):
+        self.counters[counter] = self.counters.get(counter, 0)+num
+
+    def add_resolution(self, mnemonic, wall_time):
+        entry = self.mnemonics.get(mnemonic)
+        if entry is None:
+            self.mnemonics[mnemonic] = [1, wall_time]
+        else:
+            entry[0] += 1
+            entry[1] += wall_time
+
+    # Yield the items of an iterable, charging the time spent waiting on it to a stage
+    def timed(self, iterable, stage):
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = self.clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self.lap(stage, start)
+                    return
+                self.lap(stage, start)
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def update_peak_rss(self):
+        (self_rss, children_rss) = peak_rss()
+        self.peak_rss = max(self.peak_rss, self_rss)
+        self.peak_children_rss = max(self.peak_children_rss, children_rss)
+
+    def merge(self, other):
+        for (stage, (wall_time, cpu_time)) in other.stages.items():
+            self.add_stage(stage, wall_time, cpu_time)
+        self.wall_time += other.wall_time
+        self.cpu_time += other.cpu_time
+        for (counter, num) in other.counters.items():
+            self.count(counter, num)
+        self.match_stats.merge(other.match_stats)
+        for (mnemonic, (num, wall_time)) in other.mnemonics.items():
+            entry = self.mnemonics.setdefault(mnemonic, [0, 0.])
+            entry[0] += num
+            entry[1] += wall_time
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+        self.peak_children_rss = max(self.peak_children_rss, other.peak_children_rss)
+
+    def top_mnemonics(self, num_top):
+        return sorted(self.mnemonics.items(), key=lambda item: (-item[1][1], item[0]))[:num_top]
+
+    # The profile as a JSON serializable dict
+    def record(self, num_top=20):
+        stages = [stage for stage in profile_stages if stage in self.stages]
+        stages += sorted(stage for stage in self.stages if stage not in profile_stages)
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'stages': [{'stage': stage, 'wall_time': self.stages[stage][0], 'cpu_time': self.stages[stage][1]}
+                       for stage in stages],
+            'counters': dict(sorted(self.counters.items())),
+            'strategies': [{'strategy': name, 'attempts': self.match_stats.attempts[i], 'wins': self.match_stats.wins[i]}
+                           for (i, name) in enumerate(match_strategy_names)],
+            'top_mnemonics': [{'mnemonic': mnemonic, 'resolutions': num, 'wall_time': wall_time}
+                              for (mnemonic, (num, wall_time)) in self.top_mnemonics(num_top)],
+            'peak_rss_kb': self.peak_rss,
+            'peak_children_rss_kb': self.peak_children_rss,
+        }
+
+    def print(self, num_top=20):
+        record = self.record(num_top)
+        print("Profile:")
+        print(f"Total: {record['wall_time']:.3f}s wall, {record['cpu_time']:.3f}s cpu")
+        print("Stages:")
+        for stage in record['stages']:
+            print(f"{stage['stage']} -> {stage['wall_time']:.3f}s wall, {stage['cpu_time']:.3f}s cpu")
+        print("Counters:")
+        for (counter, num) in record['counters'].items():
+            print(f"{counter} -> {num}")
+        print("Match strategies:")
+        for strategy in record['strategies']:
+            print(f"{strategy['strategy']} -> {strategy['attempts']} attempts, {strategy['wins']} wins")
+        if len(record['top_mnemonics']) != 0:
+            print(f"Top {len(record['top_mnemonics'])} mnemonics by resolution time:")
+            for mnemonic in record['top_mnemonics']:
+                print(f"{mnemonic['mnemonic']} -> {mnemonic['resolutions']} resolutions, {1000*mnemonic['wall_time']:.3f}ms")
+        print(f"Peak RSS: {record['peak_rss_kb']} kB, child processes {record['peak_children_rss_kb']} kB")
@@ -0,0 +1,114 @@
+import random
+import re
+from instruction_definitions import InstructionDefinition, unsupported_instructions
+from instruction_matching import legacy_prefixes
+from x86_decoder import decode_fields
+
+# Segment override prefixes. Every definition's legacy prefix strategy may skip them
+# and they never select a different instruction form, unlike 66, F2 and F3.
+segment_prefixes = sorted(set(InstructionDefinition.legacy_prefix_groups[1]))
+
+# VEX and EVEX escape bytes, which a REX prefix may not precede
+vex_escapes = [0xC4, 0xC5, 0x62]
+
+# A synthesized instruction. def_hash is the definition it was synthesized from.
+class SyntheticEncoding(object):
+    __slots__ = ('def_hash', 'variant', 'inst_name', 'inst_bytes', 'inst_decode')
+
+    def __init__(self, def_hash, variant, inst_name, inst_bytes, inst_decode):
+        self.def_hash = def_hash
+        self.variant = variant
+        self.inst_name = inst_name
+        self.inst_bytes = inst_bytes
+        self.inst_decode = inst_decode
+
+# Concrete bytes for a valmask, with the bits outside the mask filled randomly
+def fill_valmask(valmask, rng):
+    return [val | (rng.getrandbits(8) & ~mask & 0xFF) for (val, mask) in valmask]
+
+# The variants of an encoding the match strategies should see through: the plain
+# bytes, a skippable legacy prefix in front, and a REX prefix either in front or,
+# after a mandatory legacy prefix, inserted behind it. Returns (variant, bytes) pairs.
+def encoding_variants(encoding, rng):
+    variants = [('plain', encoding)]
+    variants.append(('legacy_prefix', [rng.choice(segment_prefixes)]+encoding))
+    if encoding[0] in legacy_prefixes:
+        if len(encoding) > 1 and encoding[1] not in vex_escapes and encoding[1]&0xF0 != 0x40:
+            variants.append(('insert_rex', encoding[:1]+[0x40]+encoding[1:]))
+    elif encoding[0] not in vex_escapes and encoding[0]&0xF0 != 0x40:
+        variants.append(('extra_rex', [0x40]+encoding))
+    return variants
+
+# A memory alternative of an operand, like m32, m16&64, m64bcst or mem. mm1 is an
+# MMX register and moffs has no ModR/M byte.
+operand_mem_matcher = re.compile('^m(\\d|em|$)')
+
+# Whether an instruction form's ModR/M byte must address memory (True), must name a
+# register (False), or may do either like r/m32 and xmm2/m128 (None)
+def form_operand_kind(instruction):
+    kind = False
+    for operand in instruction.split(' ', 1)[1].split(',') if ' ' in instruction else []:
+        parts = [part.split(' ')[0] for part in operand.strip().split('/')]
+        memory = [operand_mem_matcher.match(part) is not None for part in parts]
+        if all(memory):
+            return True
+        if any(memory):
+            kind = None
+    return kind
+
+# Fill a valmask until its ModR/M byte agrees with the form's operand kind, which
+# is what tells register and memory forms apart. Gives up after a few tries for
+# valmasks fixing the byte.
+def fill_form(valmask, operand_kind, rng):
+    for _ in range(16):
+        encoding = fill_valmask(valmask, rng)
+        fields = decode_fields(bytes(encoding))
+        if operand_kind is None or fields.modrm is None or fields.is_memory == operand_kind:
+            break
+    return (encoding, fields.is_memory)
+
+# Synthesize encodings of every 64 bit valid definition from its valmasks. Each
+# valmask is filled samples times, and every fill is expanded into its prefix
+# variants. The decoded text marks a memory operand with PTR like objdump when the
+# fill's ModR/M byte addresses memory.
+def synthesize_corpus(definitions_raw, samples=1, seed=0, prefixes=True):
+    rng = random.Random(seed)
+    corpus = []
+    for def_hash in definitions_raw:
+        definition = definitions_raw[def_hash]
+        inst_name = definition.name.lower()
+        if definition.val64 != 'V' or inst_name in unsupported_instructions:
+            continue
+        operand_kind = form_operand_kind(definition.instruction)
+        for valmask in definition.valmasks:
+            if len(valmask) == 0:
+                continue
+            for _ in range(samples):
+                (encoding, is_memory) = fill_form(valmask, operand_kind, rng)
+                inst_decode = 'PTR' if is_memory else ''
+                variants = encoding_variants(encoding, rng) if prefixes else [('plain', encoding)]
+                for (variant, inst) in variants:
+                    corpus.append(SyntheticEncoding(def_hash, variant, inst_name, bytes(inst), inst_decode))
+    return corpus
+
+# Write a corpus as tab separated lines, identifying definitions by opcode and instruction
+def write_corpus(corpus, definitions_raw, corpus_file):
+    with open(corpus_file, 'w') as out_file:
+        for encoding in corpus:
+            definition = definitions_raw[encoding.def_hash]
+            out_file.write('\t'.join([encoding.variant, encoding.inst_name, encoding.inst_bytes.hex().upper(),
+                                      encoding.inst_decode, definition.opcode, definition.instruction])+'\n')
+
+# Read a corpus written by write_corpus. Raises RuntimeError for definitions which
+# aren't among definitions_raw.
+def read_corpus(corpus_file, definitions_raw):
+    corpus = []
+    with open(corpus_file, 'r') as in_file:
+        for (line_num, line) in enumerate(in_file):
+            (variant, inst_name, inst_hex, inst_decode, opcode, instruction) = line.rstrip('\n').split('\t')
+            # Definitions are keyed by a hash of their opcode and instruction
+            def_hash = hash(opcode+instruction)
+            if def_hash not in definitions_raw:
+                raise RuntimeError(f"Line {line_num+1} of {corpus_file} uses an unknown definition {opcode} {instruction}")
+            corpus.append(SyntheticEncoding(def_hash, variant, inst_name, bytes.fromhex(inst_hex), inst_decode))
+    return corpus
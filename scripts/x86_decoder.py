@@ -0,0 +1,345 @@
+# x86-64 instruction length decoder. It finds where each instruction ends and whether
+# it has a memory operand, but doesn't name instructions.
+
+legacy_prefix_bytes = set([0xF0, 0xF2, 0xF3, 0x2E, 0x36, 0x3E, 0x26, 0x64, 0x65, 0x66, 0x67])
+max_instruction_length = 15
+
+# Opcode property flags
+MODRM = 0x1 # A ModR/M byte follows the opcode
+IMM8 = 0x2 # One byte immediate
+IMM16 = 0x4 # Two byte immediate
+IMMZ = 0x8 # Two or four byte immediate depending on operand size
+IMMV = 0x10 # Two, four or eight byte immediate depending on operand size
+MOFFS = 0x20 # Four or eight byte memory offset depending on address size
+REL32 = 0x40 # Four byte relative offset
+GROUP3 = 0x80 # TEST in /0 and /1 takes an immediate sized by the opcode
+INVALID = 0x100 # Not valid in 64 bit mode
+
+def _build_one_byte_map():
+    table = [0]*256
+    # ALU operations in the first quarter of the map
+    for base in range(0x00, 0x40, 0x08):
+        for op in range(base, base+4):
+            table[op] = MODRM
+        table[base+4] = IMM8
+        table[base+5] = IMMZ
+    for op in [0x06, 0x07, 0x0E, 0x16, 0x17, 0x1E, 0x1F, 0x27, 0x2F, 0x37, 0x3F]:
+        table[op] = INVALID
+    table[0x60] = INVALID
+    table[0x61] = INVALID
+    table[0x63] = MODRM
+    table[0x68] = IMMZ
+    table[0x69] = MODRM | IMMZ
+    table[0x6A] = IMM8
+    table[0x6B] = MODRM | IMM8
+    for op in range(0x70, 0x80):
+        table[op] = IMM8
+    table[0x80] = MODRM | IMM8
+    table[0x81] = MODRM | IMMZ
+    table[0x82] = INVALID
+    table[0x83] = MODRM | IMM8
+    for op in range(0x84, 0x90):
+        table[op] = MODRM
+    table[0x9A] = INVALID
+    for op in range(0xA0, 0xA4):
+        table[op] = MOFFS
+    table[0xA8] = IMM8
+    table[0xA9] = IMMZ
+    for op in range(0xB0, 0xB8):
+        table[op] = IMM8
+    for op in range(0xB8, 0xC0):
+        table[op] = IMMV
+    table[0xC0] = MODRM | IMM8
+    table[0xC1] = MODRM | IMM8
+    table[0xC2] = IMM16
+    table[0xC6] = MODRM | IMM8
+    table[0xC7] = MODRM | IMMZ
+    table[0xC8] = IMM16 | IMM8
+    table[0xCA] = IMM16
+    table[0xCD] = IMM8
+    table[0xCE] = INVALID
+    for op in range(0xD0, 0xD4):
+        table[op] = MODRM
+    for op in [0xD4, 0xD5, 0xD6]:
+        table[op] = INVALID
+    for op in range(0xD8, 0xE0):
+        table[op] = MODRM
+    for op in range(0xE0, 0xE8):
+        table[op] = IMM8
+    table[0xE8] = REL32
+    table[0xE9] = REL32
+    table[0xEA] = INVALID
+    table[0xEB] = IMM8
+    table[0xF6] = MODRM | GROUP3
+    table[0xF7] = MODRM | GROUP3
+    table[0xFE] = MODRM
+    table[0xFF] = MODRM
+    return table
+
+def _build_two_byte_map():
+    table = [MODRM]*256
+    for op in [0x05, 0x06, 0x07, 0x08, 0x09, 0x0B, 0x0E, 0x77,
+               0xA0, 0xA1, 0xA2, 0xA8, 0xA9, 0xAA] + list(range(0x30, 0x38)) + list(range(0xC8, 0xD0)):
+        table[op] = 0
+    for op in range(0x80, 0x90):
+        table[op] = REL32
+    for op in [0x70, 0x71, 0x72, 0x73, 0xA4, 0xAC, 0xBA, 0xC2, 0xC4, 0xC5, 0xC6]:
+        table[op] = MODRM | IMM8
+    # 3DNow! instructions end with an opcode suffix byte
+    table[0x0F] = MODRM | IMM8
+    return table
+
+one_byte_map = _build_one_byte_map()
+two_byte_map = _build_two_byte_map()
+
+# Opcodes of the VEX/EVEX 0F map taking an 8 bit immediate. Everything in the 0F3A map does.
+vex_map1_imm8 = set([0x70, 0x71, 0x72, 0x73, 0xC2, 0xC4, 0xC5, 0xC6])
+
+# Length of a ModR/M byte plus any SIB byte and displacement. Returns
+# (length, is_memory) or None if the bytes run out.
+def modrm_length(data, pos, end):
+    if pos >= end:
+        return None
+    modrm = data[pos]
+    mod = modrm >> 6
+    rm = modrm & 0x7
+    if mod == 3:
+        return (1, False)
+    length = 1
+    if rm == 4:
+        if pos+1 >= end:
+            return None
+        length += 1
+        if mod == 0 and (data[pos+1] & 0x7) == 5:
+            length += 4
+    elif mod == 0 and rm == 5:
+        # RIP relative
+        length += 4
+    if mod == 1:
+        length += 1
+    elif mod == 2:
+        length += 4
+    return (length, True)
+
+# Decode the instruction starting at data[pos], not reading past end. Returns
+# (length, is_memory) where is_memory tells whether the ModR/M byte addresses memory,
+# or None if the bytes aren't a valid 64 bit mode instruction.
+def decode_instruction(data, pos, end):
+    start = pos
+    operand_size_16 = False
+    address_size_32 = False
+    while pos < end and data[pos] in legacy_prefix_bytes:
+        if data[pos] == 0x66:
+            operand_size_16 = True
+        elif data[pos] == 0x67:
+            address_size_32 = True
+        pos += 1
+    rex_w = False
+    if pos < end and (data[pos] & 0xF0) == 0x40:
+        rex_w = (data[pos] & 0x8) != 0
+        pos += 1
+    if pos >= end:
+        return None
+
+    opcode = data[pos]
+    if opcode in [0xC4, 0xC5, 0x62]:
+        # VEX and EVEX prefixes
+        if opcode == 0xC5:
+            opcode_map = 1
+            pos += 2
+        elif opcode == 0xC4:
+            if pos+1 >= end:
+                return None
+            opcode_map = data[pos+1] & 0x1F
+            pos += 3
+        else:
+            if pos+1 >= end:
+                return None
+            opcode_map = data[pos+1] & 0x7
+            pos += 4
+        if pos >= end:
+            return None
+        vex_opcode = data[pos]
+        pos += 1
+        is_memory = False
+        # VZEROUPPER and VZEROALL have no ModR/M byte
+        if not (opcode != 0x62 and opcode_map == 1 and vex_opcode == 0x77):
+            modrm = modrm_length(data, pos, end)
+            if modrm is None:
+                return None
+            pos += modrm[0]
+            is_memory = modrm[1]
+        if opcode_map == 3 or (opcode_map == 1 and vex_opcode in vex_map1_imm8):
+            pos += 1
+    else:
+        if opcode == 0x0F:
+            if pos+1 >= end:
+                return None
+            if data[pos+1] == 0x38:
+                flags = MODRM
+                pos += 3
+            elif data[pos+1] == 0x3A:
+                flags = MODRM | IMM8
+                pos += 3
+            else:
+                flags = two_byte_map[data[pos+1]]
+                pos += 2
+        elif opcode == 0x9B and pos+1 < end and data[pos+1] in [0xD9, 0xDB, 0xDD, 0xDF]:
+            # WAIT followed by the x87 control instructions with a WAIT form
+            modrm = modrm_length(data, pos+2, end)
+            if modrm is not None:
+                reg = (data[pos+2] >> 3) & 0x7
+                if data[pos+1] in [0xD9, 0xDD] and modrm[1] and reg in [6, 7]:
+                    return (pos-start+2+modrm[0], True)
+                if data[pos+1] == 0xDB and data[pos+2] in [0xE2, 0xE3] or \
+                   data[pos+1] == 0xDF and data[pos+2] == 0xE0:
+                    return (pos-start+3, False)
+            flags = 0
+            pos += 1
+        else:
+            flags = one_byte_map[opcode]
+            pos += 1
+        if flags & INVALID:
+            return None
+
+        is_memory = False
+        if flags & MODRM:
+            modrm = modrm_length(data, pos, end)
+            if modrm is None:
+                return None
+            if flags & GROUP3 and (data[pos] >> 3) & 0x7 in [0, 1]:
+                flags |= IMM8 if opcode == 0xF6 else IMMZ
+            pos += modrm[0]
+            is_memory = modrm[1]
+        if flags & IMM8:
+            pos += 1
+        if flags & IMM16:
+            pos += 2
+        if flags & IMMZ:
+            pos += 2 if operand_size_16 else 4
+        if flags & IMMV:
+            pos += 8 if rex_w else (2 if operand_size_16 else 4)
+        if flags & MOFFS:
+            pos += 4 if address_size_32 else 8
+        if flags & REL32:
+            pos += 4
+
+    length = pos-start
+    if pos > end or length > max_instruction_length:
+        return None
+    return (length, is_memory)
+
+# Walk a block of code, yielding (offset, length, is_memory) for each instruction.
+# Bytes which don't decode are yielded one at a time with a length of 1 and
+# is_memory None, the way objdump reports them as (bad).
+def decode_instructions(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    pos = start
+    while pos < end:
+        decoded = decode_instruction(data, pos, end)
+        if decoded is None:
+            yield (pos, 1, None)
+            pos += 1
+        else:
+            yield (pos, decoded[0], decoded[1])
+            pos += decoded[0]
+
+# The prefix, VEX/EVEX and opcode fields of an instruction, decoded once so matching
+# and operand checks compare fields instead of rescanning the bytes. core is the
+# offset of the first byte after the legacy prefixes and REX prefix. vex is None,
+# 'vex2', 'vex3' or 'evex', with map, pp, L (LL for EVEX) and W decoded from it.
+# modrm is None for opcodes without a ModR/M byte.
+class InstructionFields(object):
+    __slots__ = ('data', 'legacy_prefixes', 'rex', 'core', 'vex', 'vex_map', 'vex_pp', 'vex_l', 'vex_w', 'opcode', 'modrm')
+
+    def __init__(self, data, legacy_prefixes=b'', rex=None, core=0, vex=None, vex_map=None, vex_pp=None,
+                 vex_l=None, vex_w=None, opcode=b'', modrm=None):
+        self.data = data
+        self.legacy_prefixes = legacy_prefixes
+        self.rex = rex
+        self.core = core
+        self.vex = vex
+        self.vex_map = vex_map
+        self.vex_pp = vex_pp
+        self.vex_l = vex_l
+        self.vex_w = vex_w
+        self.opcode = opcode
+        self.modrm = modrm
+
+    # Whether the ModR/M byte addresses memory
+    @property
+    def is_memory(self):
+        return self.modrm is not None and self.modrm < 0xC0
+
+# Decode the fields of the instruction in data, a bytes like object holding one
+# instruction. Fields the bytes run out before are left unset.
+def decode_fields(data):
+    end = len(data)
+    pos = 0
+    while pos < end and data[pos] in legacy_prefix_bytes:
+        pos += 1
+    legacy_prefixes = bytes(data[:pos])
+    rex = None
+    if pos < end and (data[pos] & 0xF0) == 0x40:
+        rex = data[pos]
+        pos += 1
+    core = pos
+    if pos >= end:
+        return InstructionFields(data, legacy_prefixes, rex, core)
+
+    opcode = data[pos]
+    if opcode == 0xC4 or opcode == 0xC5 or opcode == 0x62:
+        if opcode == 0xC5:
+            if pos+1 >= end:
+                return InstructionFields(data, legacy_prefixes, rex, core)
+            vex = 'vex2'
+            vex_map = 1
+            vex_pp = data[pos+1] & 0x3
+            vex_l = (data[pos+1] >> 2) & 0x1
+            vex_w = 0
+            pos += 2
+        elif opcode == 0xC4:
+            if pos+2 >= end:
+                return InstructionFields(data, legacy_prefixes, rex, core)
+            vex = 'vex3'
+            vex_map = data[pos+1] & 0x1F
+            vex_pp = data[pos+2] & 0x3
+            vex_l = (data[pos+2] >> 2) & 0x1
+            vex_w = data[pos+2] >> 7
+            pos += 3
+        else:
+            if pos+3 >= end:
+                return InstructionFields(data, legacy_prefixes, rex, core)
+            vex = 'evex'
+            vex_map = data[pos+1] & 0x7
+            vex_pp = data[pos+2] & 0x3
+            vex_l = (data[pos+3] >> 5) & 0x3
+            vex_w = data[pos+2] >> 7
+            pos += 4
+        if pos >= end:
+            return InstructionFields(data, legacy_prefixes, rex, core, vex, vex_map, vex_pp, vex_l, vex_w)
+        # VZEROUPPER and VZEROALL have no ModR/M byte
+        has_modrm = not (opcode != 0x62 and vex_map == 1 and data[pos] == 0x77)
+        opcode_bytes = bytes(data[pos:pos+1])
+        pos += 1
+    else:
+        vex = vex_map = vex_pp = vex_l = vex_w = None
+        if opcode == 0x0F:
+            if pos+1 >= end:
+                return InstructionFields(data, legacy_prefixes, rex, core)
+            if data[pos+1] == 0x38 or data[pos+1] == 0x3A:
+                opcode_bytes = bytes(data[pos:pos+3])
+                has_modrm = True
+                pos += 3
+            else:
+                opcode_bytes = bytes(data[pos:pos+2])
+                has_modrm = (two_byte_map[data[pos+1]] & MODRM) != 0
+                pos += 2
+        else:
+            opcode_bytes = bytes(data[pos:pos+1])
+            has_modrm = (one_byte_map[opcode] & MODRM) != 0
+            pos += 1
+
+    modrm = data[pos] if has_modrm and pos < end else None
+    return InstructionFields(data, legacy_prefixes, rex, core, vex, vex_map, vex_pp, vex_l, vex_w, opcode_bytes, modrm)
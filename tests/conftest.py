@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts import each other by module name
+sys.path.insert(0, os.path.join(repo_dir, 'scripts'))
+
+from instruction_definitions import load_definitions
+
+definitions_file = os.path.join(repo_dir, 'instructions_fixed.csv')
+
+@pytest.fixture(scope='session')
+def definitions_raw():
+    return load_definitions(definitions_file)
+
+# Write an objdump stand-in which prints output for any file, then optionally hangs
+def write_fake_objdump(objdump_file, output, hang=False):
+    with open(objdump_file, 'w') as out_file:
+        out_file.write(f"#!{sys.executable}\n"
+                       f"import sys, time\n"
+                       f"sys.stdout.write({output!r})\n"
+                       f"sys.stdout.flush()\n")
+        if hang:
+            out_file.write("time.sleep(60)\n")
+    os.chmod(objdump_file, 0o755)
+    return str(objdump_file)
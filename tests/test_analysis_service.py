@@ -0,0 +1,96 @@
+import shutil
+import threading
+import time
+import pytest
+import analysis_service
+from conftest import definitions_file, write_fake_objdump
+from analysis_service import AnalysisService, AnalysisOptions, analyze_request_binary, bind_server, request_analysis
+from elf import is_elf_x86_64
+
+# A binary needing SSE and AVX2
+objdump_text = (
+    "\n"
+    "kernel:     file format elf64-x86-64\n"
+    "\n"
+    "\n"
+    "Disassembly of section .text:\n"
+    "\n"
+    "0000000000001000 <kernel>:\n"
+    "    1000:\t0f 58 c1             \taddps  xmm0,xmm1\n"
+    "    1003:\tc5 f5 76 c1          \tvpcmpeqd ymm0,ymm1,ymm1\n"
+    "    1007:\tc3                   \tret\n"
+)
+
+@pytest.fixture
+def settings(tmp_path):
+    return {'matcher': 'trie', 'memo_size': 1024, 'objdump_location': write_fake_objdump(tmp_path/'objdump', objdump_text)}
+
+# Requests only take ELF files, which the stand-in objdump never reads
+@pytest.fixture
+def kernel(tmp_path):
+    if not is_elf_x86_64('/bin/true'):
+        pytest.skip("/bin/true isn't a 64 bit x86 ELF file")
+    kernel = str(tmp_path/'kernel')
+    shutil.copyfile('/bin/true', kernel)
+    return kernel
+
+def test_workers_share_analyzers_between_options(definitions_raw, settings, kernel, monkeypatch):
+    monkeypatch.setattr(analysis_service, '_worker_definitions', definitions_raw)
+    monkeypatch.setattr(analysis_service, '_worker_settings', settings)
+    monkeypatch.setattr(analysis_service, '_worker_analyzers', {})
+
+    (_, result, _, error) = analyze_request_binary(kernel, AnalysisOptions(allowed=frozenset(['SSE'])))
+    assert error is None
+    assert result.violation is not None
+    (_, result, _, error) = analyze_request_binary(kernel, AnalysisOptions(full_stats=True, instruction_hits=True))
+    assert error is None
+    assert result.violation is None
+    assert result.extension_requirements == [['SSE'], ['AVX2']]
+    assert len(result.instruction_hits) == 2
+    assert len(dict(result.instruction_count)) == 2
+    assert list(analysis_service._worker_analyzers) == [False]
+
+    (_, result, _, error) = analyze_request_binary(kernel, AnalysisOptions(careful=True))
+    assert error is None
+    assert result.instruction_hits == []
+    assert sorted(analysis_service._worker_analyzers) == [False, True]
+
+# Wait for a condition the serving thread brings about
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic()+timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_requests_and_reload(settings, kernel, tmp_path):
+    daemon_definitions = tmp_path/'instructions.csv'
+    shutil.copyfile(definitions_file, daemon_definitions)
+    service = AnalysisService(str(daemon_definitions), str(tmp_path/'instructions.bin'), 1, settings)
+    socket_path = str(tmp_path/'daemon.sock')
+    server = bind_server(socket_path, service)
+    serving = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    serving.start()
+    try:
+        records = list(request_analysis(socket_path, [kernel], {}, 'ndjson'))
+        assert records[-1] == {'type': 'status', 'status': 0}
+        assert [record['extension_requirements'] for record in records if record['type'] == 'binary'] == [[['SSE'], ['AVX2']]]
+
+        records = list(request_analysis(socket_path, [kernel], {'allow': ['FOOEXT']}))
+        assert records[0]['type'] == 'error'
+        assert records[-1] == {'type': 'status', 'status': 1}
+
+        # A definition with a new extension is picked up without restarting
+        with open(daemon_definitions, 'a') as out_file:
+            out_file.write("FOO,0F 0B,FOO,V,V,FOOEXT\n")
+        wait_for(lambda: 'FOOEXT' in service.known_extensions)
+
+        records = list(request_analysis(socket_path, [kernel], {'allow': ['FOOEXT']}))
+        assert records[-1] == {'type': 'status', 'status': 2}
+        records = list(request_analysis(socket_path, [kernel], {'allow': ['x86-64-v3']}, 'text'))
+        assert records[-1] == {'type': 'status', 'status': 0}
+        assert "['AVX2']" in ''.join(record['text'] for record in records if record['type'] == 'text')
+    finally:
+        server.shutdown()
+        serving.join()
+        server.server_close()
+        service.close()
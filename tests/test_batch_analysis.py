@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import pytest
+from conftest import write_fake_objdump
+from batch_analysis import analyze_binaries, analyze_binaries_async
+from extension_analysis import ExtensionAnalyzer
+
+instructions = [(0x1000, 'vpcmpeqd', bytes.fromhex('C5 F5 76 C1'), 'vpcmpeqd ymm0,ymm1,ymm1'),
+                (0x1004, 'addps', bytes.fromhex('0F 58 C1'), 'addps xmm0,xmm1'),
+                (0x1007, 'ret', bytes.fromhex('C3'), 'ret')]
+
+objdump_text = (
+    "\n"
+    "kernel:     file format elf64-x86-64\n"
+    "\n"
+    "\n"
+    "Disassembly of section .text:\n"
+    "\n"
+    "0000000000001000 <kernel>:\n"
+    "    1000:\tc5 f5 76 c1          \tvpcmpeqd ymm0,ymm1,ymm1\n"
+    "    1004:\t0f 58 c1             \taddps  xmm0,xmm1\n"
+    "    1007:\tc3                   \tret\n"
+)
+
+def disassemble(input_file):
+    return ('64', instructions)
+
+# An objdump stand-in printing the disassembly above for any file
+@pytest.fixture
+def fake_objdump(tmp_path):
+    return write_fake_objdump(tmp_path/'objdump', objdump_text)
+
+# Without a memo every binary resolves its instructions through the matcher
+def adaptive_analyzer(definitions_raw):
+    return ExtensionAnalyzer(definitions_raw, matcher='adaptive', memo_size=0)
+
+def counted_wins(analyzer):
+    return dict((def_hash, wins) for (def_hash, wins) in analyzer.matcher._wins.items() if sum(wins) != 0)
+
+# The wins of analyzing the binaries one after another in this process
+def expected_wins(definitions_raw, binaries):
+    analyzer = adaptive_analyzer(definitions_raw)
+    for input_file in binaries:
+        analyzer.analyze_file(input_file, disassemble)
+    wins = counted_wins(analyzer)
+    assert wins != {}
+    return wins
+
+def test_pool_workers_hand_back_strategy_wins(definitions_raw):
+    binaries = ['a', 'b', 'c']
+    analyzer = adaptive_analyzer(definitions_raw)
+    for (input_file, result, output, error) in analyze_binaries(binaries, analyzer, disassemble, 2):
+        assert error is None
+        assert result.strategy_wins is None
+    assert counted_wins(analyzer) == expected_wins(definitions_raw, binaries)
+
+def test_stream_workers_hand_back_strategy_wins(definitions_raw, fake_objdump):
+    binaries = ['a', 'b', 'c']
+    analyzer = adaptive_analyzer(definitions_raw)
+    for (input_file, result, output, error) in analyze_binaries_async(binaries, analyzer, fake_objdump, 2, 2):
+        assert error is None
+        assert result.extension_requirements == [['AVX2'], ['SSE']]
+    assert counted_wins(analyzer) == expected_wins(definitions_raw, binaries)
+
+def test_saved_wins_include_workers(definitions_raw, tmp_path):
+    stats_file = str(tmp_path/'strategy_stats.json')
+    analyzer = adaptive_analyzer(definitions_raw)
+    list(analyze_binaries(['a', 'b'], analyzer, disassemble, 2))
+    analyzer.matcher.save(stats_file)
+    loaded = adaptive_analyzer(definitions_raw)
+    loaded.matcher.load(stats_file)
+    assert counted_wins(loaded) == counted_wins(analyzer)
+    # What was loaded isn't taken again as new
+    assert loaded.matcher.take_new_wins() == {}
+
+# Analyzers to hold up or kill the worker processes they're forked into
+class SlowAnalyzer(ExtensionAnalyzer):
+    delay = 1.
+
+    def analyze_file(self, input_file, disassemble, progress=False):
+        if input_file.startswith('slow'):
+            time.sleep(self.delay)
+        return ExtensionAnalyzer.analyze_file(self, input_file, disassemble, progress)
+
+# The batch finds out about a dead worker sending it output or waiting for its result
+def worker_died(error):
+    return error.split(':')[0] in ['BrokenPipeError', 'ConnectionResetError', 'EOFError']
+
+class CrashingAnalyzer(ExtensionAnalyzer):
+    def analyze_file(self, input_file, disassemble, progress=False):
+        if input_file.startswith('crash'):
+            os._exit(1)
+        return ExtensionAnalyzer.analyze_file(self, input_file, disassemble, progress)
+
+# A binary waiting for the only worker while its objdump still runs gets the whole
+# timeout once it has the worker
+def test_timeout_starts_with_the_worker(definitions_raw, tmp_path):
+    objdump = tmp_path/'objdump'
+    objdump.write_text(f"#!{sys.executable}\n"
+                       f"import sys, time\n"
+                       f"sys.stdout.write({objdump_text[:objdump_text.index('    1004')]!r})\n"
+                       f"sys.stdout.flush()\n"
+                       f"if sys.argv[-1].startswith('stalling'):\n"
+                       f"    time.sleep(2.5)\n"
+                       f"sys.stdout.write({objdump_text[objdump_text.index('    1004'):]!r})\n")
+    objdump.chmod(0o755)
+    binaries = ['slow', 'stalling']
+    results = list(analyze_binaries_async(binaries, SlowAnalyzer(definitions_raw), str(objdump), 1, len(binaries), timeout=2.))
+    assert sorted((input_file, error) for (input_file, _, _, error) in results) == [(input_file, None) for input_file in binaries]
+
+def test_hanging_objdump_times_out(definitions_raw, tmp_path):
+    objdump = write_fake_objdump(tmp_path/'objdump', objdump_text[:objdump_text.index('    1004')], hang=True)
+    start = time.monotonic()
+    results = list(analyze_binaries_async(['a', 'b'], ExtensionAnalyzer(definitions_raw), objdump, 1, 2, timeout=0.5))
+    assert time.monotonic()-start < 10
+    # The worker is reused after the binary it gave up on
+    assert sorted((input_file, result, error) for (input_file, result, _, error) in results) == \
+           [('a', None, "TimeoutError: Timed out after 0.5 seconds"), ('b', None, "TimeoutError: Timed out after 0.5 seconds")]
+
+def test_slow_analysis_times_out(definitions_raw, fake_objdump):
+    analyzer = SlowAnalyzer(definitions_raw)
+    analyzer.delay = 5
+    start = time.monotonic()
+    results = list(analyze_binaries_async(['slow'], analyzer, fake_objdump, 1, 1, timeout=0.5))
+    assert time.monotonic()-start < 5
+    assert [(input_file, result, error) for (input_file, result, _, error) in results] == \
+           [('slow', None, "TimeoutError: Timed out after 0.5 seconds")]
+
+def test_dead_worker_fails_its_binary(definitions_raw, fake_objdump):
+    analyzer = CrashingAnalyzer(definitions_raw)
+    results = dict((input_file, (result, error)) for (input_file, result, _, error)
+                   in analyze_binaries_async(['crash', 'a', 'b'], analyzer, fake_objdump, 2, 3))
+    assert results['crash'][0] is None
+    assert worker_died(results['crash'][1])
+    for input_file in ['a', 'b']:
+        (result, error) = results[input_file]
+        assert error is None
+        assert result.extension_requirements == [['AVX2'], ['SSE']]
+
+def test_binaries_fail_once_every_worker_died(definitions_raw, fake_objdump):
+    analyzer = CrashingAnalyzer(definitions_raw)
+    results = dict((input_file, (result, error)) for (input_file, result, _, error)
+                   in analyze_binaries_async(['crash', 'a'], analyzer, fake_objdump, 1, 2))
+    assert worker_died(results['crash'][1])
+    assert results['a'] == (None, "No analysis workers are left")
@@ -0,0 +1,32 @@
+import pytest
+from extension_analysis import ExtensionAnalyzer
+
+# objdump prints the EVEX vpcmp forms with predicate 0 as their eq pseudo-op, which is
+# also the mnemonic of the VEX and EVEX vpcmpeq forms
+colliding_encodings = [
+    ('vpcmpeqb', '62 F3 7D 48 3F C2 00', 'VPCMPB', ['AVX512BW']),
+    ('vpcmpeqb', 'C5 F9 74 C1', 'VPCMPEQB', ['AVX']),
+    ('vpcmpeqb', '62 F1 7D 48 74 C1', 'VPCMPEQB', ['AVX512BW']),
+    ('vpcmpeqq', '62 F3 FD 48 1F C2 00', 'VPCMPQ', ['AVX512F']),
+    ('vpcmpeqd', 'C5 F5 76 C1', 'VPCMPEQD', ['AVX2']),
+]
+
+@pytest.mark.parametrize('careful', [False, True])
+@pytest.mark.parametrize(('inst_name', 'encoding', 'name', 'cpuid'), colliding_encodings)
+def test_colliding_pseudo_op_resolves(definitions_raw, inst_name, encoding, name, cpuid, careful):
+    analyzer = ExtensionAnalyzer(definitions_raw, careful=careful, memo_size=0, full_stats=True)
+    (_, def_hash, _) = analyzer.resolve_instruction(1, inst_name, bytes.fromhex(encoding), inst_name)
+    assert definitions_raw[def_hash].name == name
+    assert definitions_raw[def_hash].cpuid == cpuid
+
+def test_colliding_pseudo_op_plan_covers_both(definitions_raw):
+    analyzer = ExtensionAnalyzer(definitions_raw, memo_size=0)
+    names = set(definitions_raw[def_hash].name for def_hash in analyzer.plans['vpcmpeqb'].cand_hashes)
+    assert names == {'VPCMPEQB', 'VPCMPB'}
+    assert analyzer.plans['vpcmpltb'] is analyzer.plans['vpcmpb']
+
+def test_colliding_pseudo_op_requirements(definitions_raw):
+    analyzer = ExtensionAnalyzer(definitions_raw)
+    instructions = [(0x1000, 'vpcmpeqb', bytes.fromhex('62 F3 7D 48 3F C2 00'), 'vpcmpeqb k0,zmm0,zmm2')]
+    result = analyzer.analyze('libc.so.6', instructions)
+    assert result.extension_requirements == [['AVX512BW']]
@@ -0,0 +1,41 @@
+import shutil
+from conftest import definitions_file
+from instruction_definitions import compile_definitions, load_compiled_definitions
+from extension_analysis import ExtensionAnalyzer
+from synthetic_corpus import synthesize_corpus
+
+def test_compiled_definitions_round_trip(definitions_raw, tmp_path):
+    compiled_file = str(tmp_path/'instructions_fixed.bin')
+    compile_definitions(definitions_raw, definitions_file, compiled_file)
+    compiled_raw = load_compiled_definitions(compiled_file, definitions_file)
+    assert list(compiled_raw) == list(definitions_raw)
+    for (def_hash, definition) in definitions_raw.items():
+        compiled = compiled_raw[def_hash]
+        assert (compiled.name, compiled.opcode, compiled.instruction, compiled.val64, compiled.val32, compiled.cpuid) == \
+               (definition.name, definition.opcode, definition.instruction, definition.val64, definition.val32, definition.cpuid)
+        assert compiled.valmasks == definition.valmasks
+
+def test_stale_compiled_definitions(definitions_raw, tmp_path):
+    compiled_file = str(tmp_path/'instructions_fixed.bin')
+    compile_definitions(definitions_raw, definitions_file, compiled_file)
+    edited_file = tmp_path/'instructions_fixed.csv'
+    shutil.copyfile(definitions_file, edited_file)
+    with open(edited_file, 'a') as out_file:
+        out_file.write("FOO,0F 0B,FOO,V,V,\n")
+    assert load_compiled_definitions(compiled_file, str(edited_file)) is None
+
+# Plans and tries are built without touching valmasks the analysis doesn't need
+def test_compiled_definitions_resolve_lazily(definitions_raw, tmp_path):
+    compiled_file = str(tmp_path/'instructions_fixed.bin')
+    compile_definitions(definitions_raw, definitions_file, compiled_file)
+    compiled_raw = load_compiled_definitions(compiled_file, definitions_file)
+    analyzer = ExtensionAnalyzer(compiled_raw, careful=True, memo_size=0)
+    assert all(definition._valmasks is None for definition in compiled_raw.values())
+
+    csv_analyzer = ExtensionAnalyzer(definitions_raw, careful=True, memo_size=0)
+    encodings = [encoding for encoding in synthesize_corpus(definitions_raw) if encoding.inst_name in ('vpcmpeqb', 'addps', 'mov')]
+    for (inst_num, encoding) in enumerate(encodings):
+        assert analyzer.resolve_instruction(inst_num+1, encoding.inst_name, encoding.inst_bytes, encoding.inst_decode) == \
+               csv_analyzer.resolve_instruction(inst_num+1, encoding.inst_name, encoding.inst_bytes, encoding.inst_decode)
+    decoded = set(def_hash for (def_hash, definition) in compiled_raw.items() if definition._valmasks is not None)
+    assert 0 < len(decoded) < len(compiled_raw)/10
@@ -0,0 +1,51 @@
+from disassembly import parse_objdump_records, parse_objdump_output
+
+# objdump --disassemble -M intel output of coreutils ls. The cs nop and the fs mov
+# don't fit their bytes on one line and continue on lines without a decode.
+objdump_text = (
+    "\n"
+    "ls:     file format elf64-x86-64\n"
+    "\n"
+    "\n"
+    "Disassembly of section .text:\n"
+    "\n"
+    "0000000000004717 <.text>:\n"
+    "    4721:\te8 6a f9 ff ff       \tcall   4090 <abort@plt>\n"
+    "    4726:\t66 2e 0f 1f 84 00 00 \tcs nop WORD PTR [rax+rax*1+0x0]\n"
+    "    472d:\t00 00 00 \n"
+    "    4730:\t41 57                \tpush   r15\n"
+    "    4758:\t48 8b 3e             \tmov    rdi,QWORD PTR [rsi]\n"
+    "    475b:\t64 48 8b 04 25 28 00 \tmov    rax,QWORD PTR fs:0x28\n"
+    "    4762:\t00 00 \n"
+)
+
+def test_continuation_lines_are_merged():
+    (file_mode, instructions) = parse_objdump_output(objdump_text.splitlines(keepends=True))
+    assert file_mode == '64'
+    assert list(instructions) == [
+        (0x4721, 'call', bytes.fromhex('e8 6a f9 ff ff'), 'call   4090 <abort@plt>'),
+        (0x4726, 'cs', bytes.fromhex('66 2e 0f 1f 84 00 00 00 00 00'), 'cs nop WORD PTR [rax+rax*1+0x0]'),
+        (0x4730, 'push', bytes.fromhex('41 57'), 'push   r15'),
+        (0x4758, 'mov', bytes.fromhex('48 8b 3e'), 'mov    rdi,QWORD PTR [rsi]'),
+        (0x475b, 'mov', bytes.fromhex('64 48 8b 04 25 28 00 00 00'), 'mov    rax,QWORD PTR fs:0x28'),
+    ]
+
+def test_continuation_without_instruction_is_dropped():
+    lines = ["    472d:\t00 00 00 \n",
+             "    4730:\t41 57                \tpush   r15\n"]
+    assert list(parse_objdump_records(lines)) == [(0x4730, 'push', bytes.fromhex('41 57'), 'push   r15')]
+
+def test_headings_and_labels_are_skipped():
+    lines = ["Disassembly of section .plt:\n",
+             "0000000000004020 <.plt>:\n",
+             "    4020:\tff 35 7a ec 01 00    \tpush   QWORD PTR [rip+0x1ec7a]\n",
+             "\t...\n"]
+    assert [address for (address, _, _, _) in parse_objdump_records(lines)] == [0x4020]
+
+def test_unsupported_file_format(capsys):
+    assert parse_objdump_output(["\n", "ls32:     file format elf32-i386\n"]) is None
+    assert "Unsupported file type elf32-i386!" in capsys.readouterr().out
+
+def test_missing_file_format(capsys):
+    assert parse_objdump_output(["\n", "Disassembly of section .text:\n"]) is None
+    assert "Wrongly formatted output!" in capsys.readouterr().out
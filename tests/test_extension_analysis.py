@@ -0,0 +1,62 @@
+import random
+import pytest
+from instruction_definitions import load_definitions
+from extension_analysis import ExtensionAnalyzer
+from synthetic_corpus import synthesize_corpus
+
+# Two forms of one encoding with differing requirements which neither the bytes nor
+# the operand type tell apart
+ambiguous_definitions = (
+    "Instruction Name,Opcode,Instruction,64-bit validity,32-bit validity,CpuId Flags\n"
+    "FOO,0F 0B,FOO xmm1,V,V,SSE2\n"
+    "FOO,0F 0B,FOO ymm1,V,V,AVX2\n"
+    "BAR,0F 0D,BAR,V,V,\n"
+)
+
+@pytest.fixture
+def ambiguous_raw(tmp_path):
+    definitions_file = tmp_path/'ambiguous.csv'
+    definitions_file.write_text(ambiguous_definitions)
+    return load_definitions(str(definitions_file))
+
+@pytest.mark.parametrize('careful', [False, True])
+def test_ambiguous_encoding_keeps_requirements(ambiguous_raw, careful):
+    analyzer = ExtensionAnalyzer(ambiguous_raw, careful=careful)
+    instructions = [(0x1000, 'bar', bytes.fromhex('0F 0D'), 'bar'),
+                    (0x1002, 'foo', bytes.fromhex('0F 0B'), 'foo'),
+                    (0x1004, 'foo', bytes.fromhex('0F 0B'), 'foo')]
+    result = analyzer.analyze('ambiguous', instructions)
+    assert result.extension_requirements == [['SSE2', 'AVX2']]
+    assert result.requirement_counts == {('SSE2', 'AVX2'): 2}
+    assert result.unsupported_inst_encounters == {'ambiguous encoding foo': 2}
+    assert result.uncertain
+
+def test_ambiguous_encoding_violates_policy(ambiguous_raw):
+    analyzer = ExtensionAnalyzer(ambiguous_raw, allowed={'SSE2'})
+    result = analyzer.analyze('ambiguous', [(0x1000, 'foo', bytes.fromhex('0F 0B'), 'foo')])
+    assert result.violation is not None
+    assert result.violation.address == 0x1000
+    assert result.violation.cpuid_reqs == ['SSE2', 'AVX2']
+
+def test_resolved_result_is_certain(definitions_raw):
+    analyzer = ExtensionAnalyzer(definitions_raw)
+    result = analyzer.analyze('avx2', [(0x1000, 'vpcmpeqd', bytes.fromhex('C5 F5 76 C1'), 'vpcmpeqd ymm0,ymm1,ymm1')])
+    assert result.extension_requirements == [['AVX2']]
+    assert not result.uncertain
+
+# Resolving each unique encoding once gives the result of resolving every instruction
+@pytest.mark.parametrize('careful', [False, True])
+def test_dedup_matches_streaming(definitions_raw, careful):
+    encodings = synthesize_corpus(definitions_raw, prefixes=False)
+    encodings = encodings+random.Random(0).sample(encodings, len(encodings))
+    instructions = [(0x1000+i*16, encoding.inst_name, encoding.inst_bytes, encoding.inst_decode) for (i, encoding) in enumerate(encodings)]
+    results = [ExtensionAnalyzer(definitions_raw, careful=careful, full_stats=True, dedup=dedup).analyze('corpus', iter(instructions))
+               for dedup in (True, False)]
+    (deduped, streamed) = results
+    assert deduped.num_instructions == streamed.num_instructions == len(instructions)
+    assert len(deduped.extension_requirements) != 0
+    assert deduped.extension_requirements == streamed.extension_requirements
+    assert deduped.requirement_counts == streamed.requirement_counts
+    assert deduped.unsupported_inst_encounters == streamed.unsupported_inst_encounters
+    assert len(dict(deduped.instruction_count)) != 0
+    assert dict(deduped.instruction_count) == dict(streamed.instruction_count)
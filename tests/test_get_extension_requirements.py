@@ -0,0 +1,73 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from conftest import repo_dir, definitions_file, write_fake_objdump
+from elf import is_elf_x86_64
+
+script = os.path.join(repo_dir, 'scripts', 'get_extension_requirements.py')
+
+# A binary needing SSE and AVX2
+objdump_text = (
+    "\n"
+    "kernel:     file format elf64-x86-64\n"
+    "\n"
+    "\n"
+    "Disassembly of section .text:\n"
+    "\n"
+    "0000000000001000 <kernel>:\n"
+    "    1000:\t0f 58 c1             \taddps  xmm0,xmm1\n"
+    "    1003:\tc5 f5 76 c1          \tvpcmpeqd ymm0,ymm1,ymm1\n"
+    "    1007:\tc3                   \tret\n"
+)
+
+@pytest.fixture
+def run(tmp_path):
+    objdump = write_fake_objdump(tmp_path/'objdump', objdump_text)
+    def run(*args):
+        command = [sys.executable, script, '-d', definitions_file, '--objdump-location', objdump, '--processes', '1',
+                   '--strategy-stats', str(tmp_path/'strategy_stats.json')]+list(args)
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return run
+
+# Single binaries are disassembled without looking at them first
+@pytest.fixture
+def kernel(tmp_path):
+    kernel = tmp_path/'kernel'
+    kernel.write_bytes(b'')
+    return str(kernel)
+
+# Batch mode only picks up ELF files, which the stand-in objdump never reads
+@pytest.fixture
+def binaries(tmp_path):
+    if not is_elf_x86_64('/bin/true'):
+        pytest.skip("/bin/true isn't a 64 bit x86 ELF file")
+    binaries_dir = tmp_path/'binaries'
+    binaries_dir.mkdir()
+    for name in ('a', 'b'):
+        shutil.copyfile('/bin/true', binaries_dir/name)
+    return str(binaries_dir)
+
+@pytest.mark.parametrize('allow', [[], ['--allow', 'x86-64-v3'], ['--allow', 'SSE,AVX2']])
+def test_allowed_requirements_exit_0(run, kernel, allow):
+    completed = run('-i', kernel, *allow)
+    assert completed.returncode == 0, completed.stdout
+    assert "['AVX2']" in completed.stdout
+
+@pytest.mark.parametrize('output_format', ['text', 'ndjson', 'json'])
+def test_violation_exits_2(run, kernel, output_format):
+    completed = run('-i', kernel, '--allow', 'x86-64', '--output-format', output_format)
+    assert completed.returncode == 2, completed.stdout
+    assert 'vpcmpeqd' in completed.stdout
+
+def test_batch_violation_exits_2(run, binaries):
+    completed = run('-i', binaries, '--allow', 'x86-64')
+    assert completed.returncode == 2, completed.stdout
+    assert "WARNING: 2 binaries require extensions which aren't allowed" in completed.stdout
+    assert run('-i', binaries, '--allow', 'x86-64-v3').returncode == 0
+
+def test_unknown_allowed_extension_exits_1(run, kernel):
+    completed = run('-i', kernel, '--allow', 'NOT_AN_EXTENSION')
+    assert completed.returncode == 1
+    assert completed.stdout.startswith('ERROR:')
@@ -0,0 +1,86 @@
+import pytest
+from extension_analysis import ExtensionAnalyzer
+from instruction_matching import matchers
+from synthetic_corpus import synthesize_corpus
+from x86_decoder import decode_fields
+
+# Keep the records with the fewest prefixes like resolve_instruction does. The
+# adaptive engine stops looking for prefixed matches once one needs none.
+def fewest_prefix_records(cand_records):
+    if len(cand_records) == 0:
+        return []
+    fewest_prefixes = min(num_prefixes for (_, num_prefixes) in cand_records)
+    return [cand_record for cand_record in cand_records if cand_record[1] == fewest_prefixes]
+
+# The synthesized encodings with their candidates and the records check_for_match gives
+@pytest.fixture(scope='module')
+def corpus_records(definitions_raw):
+    analyzer = ExtensionAnalyzer(definitions_raw, careful=True, memo_size=0)
+    corpus_records = []
+    for encoding in synthesize_corpus(definitions_raw, seed=0):
+        (_, cand_hashes) = analyzer.get_candidates(encoding.inst_name, encoding.inst_decode)
+        cand_records = []
+        for def_hash in cand_hashes:
+            def_match = definitions_raw[def_hash].check_for_match(encoding.inst_bytes)
+            if def_match[0]:
+                cand_records.append((def_hash, def_match[1]))
+        corpus_records.append((encoding, cand_hashes, fewest_prefix_records(cand_records)))
+    return corpus_records
+
+def mismatch_report(definitions_raw, mismatches):
+    return '\n'.join(f"{encoding.inst_name} {encoding.inst_bytes.hex(' ').upper()}: "
+                     f"{[definitions_raw[def_hash].instruction for (def_hash, _) in cand_records]} "
+                     f"instead of {[definitions_raw[def_hash].instruction for (def_hash, _) in expected]}"
+                     for (encoding, cand_records, expected) in mismatches[:10])
+
+@pytest.mark.parametrize('matcher_name', sorted(matchers))
+def test_match_agrees_with_check_for_match(definitions_raw, corpus_records, matcher_name):
+    matcher = matchers[matcher_name](definitions_raw)
+    mismatches = []
+    for (encoding, cand_hashes, expected) in corpus_records:
+        cand_records = fewest_prefix_records(matcher.match(encoding.inst_bytes, cand_hashes))
+        if cand_records != expected:
+            mismatches.append((encoding, cand_records, expected))
+    assert mismatches == [], mismatch_report(definitions_raw, mismatches)
+
+@pytest.mark.parametrize('matcher_name', sorted(name for name in matchers if hasattr(matchers[name], 'match_fields')))
+def test_match_fields_agrees_with_check_for_match(definitions_raw, corpus_records, matcher_name):
+    matcher = matchers[matcher_name](definitions_raw)
+    mismatches = []
+    for (encoding, cand_hashes, expected) in corpus_records:
+        cand_records = fewest_prefix_records(matcher.match_fields(decode_fields(encoding.inst_bytes), cand_hashes))
+        if cand_records != expected:
+            mismatches.append((encoding, cand_records, expected))
+    assert mismatches == [], mismatch_report(definitions_raw, mismatches)
+
+@pytest.mark.parametrize('matcher_name', sorted(name for name in matchers if hasattr(matchers[name], 'match_batch')))
+def test_match_batch_agrees_with_check_for_match(definitions_raw, corpus_records, matcher_name):
+    matcher = matchers[matcher_name](definitions_raw)
+    groups = {}
+    for (encoding, cand_hashes, expected) in corpus_records:
+        groups.setdefault(tuple(cand_hashes), []).append((encoding, expected))
+    mismatches = []
+    for (cand_key, group) in groups.items():
+        batch_records = matcher.match_batch([encoding.inst_bytes for (encoding, _) in group], list(cand_key))
+        for ((encoding, expected), cand_records) in zip(group, batch_records):
+            cand_records = fewest_prefix_records(list(cand_records))
+            if cand_records != expected:
+                mismatches.append((encoding, cand_records, expected))
+    assert mismatches == [], mismatch_report(definitions_raw, mismatches)
+
+# Instructions too short for the prefix strategies, which check_for_match only reaches
+# after the plain strategy failed
+def test_adaptive_matcher_on_short_instructions(definitions_raw):
+    matcher = matchers['adaptive'](definitions_raw)
+    for (def_hash, definition) in definitions_raw.items():
+        if definition.val64 != 'V':
+            continue
+        for inst_bytes in (b'', bytes([definition.valmasks[0][0][0] | 0x40]), bytes([0x66])):
+            try:
+                def_match = definition.check_for_match(inst_bytes)
+            except IndexError:
+                def_match = (False, 0)
+            result = matcher.match_definition(def_hash, inst_bytes)
+            assert (result is not None) == def_match[0]
+            if result is not None:
+                assert result[1] == def_match[1]
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import pytest
+from conftest import definitions_file
+from elf import ElfFile, is_elf_x86_64
+from disassembly import elf_disassemble
+from extension_analysis import ExtensionAnalyzer
+from result_cache import ResultCache, analysis_fingerprint, binary_key, cache_schema_version
+
+# Function map of code with a stretch no symbol covers
+class PartialFunctionMap(object):
+    def lookup(self, address):
+        return 'avx2_kernel' if address < 0x2000 else None
+
+instructions = [(0x1000, 'vpcmpeqd', bytes.fromhex('C5 F5 76 C1'), 'vpcmpeqd ymm0,ymm1,ymm1'),
+                (0x1004, 'addps', bytes.fromhex('0F 58 C1'), 'addps xmm0,xmm1'),
+                (0x1007, 'ret', bytes.fromhex('C3'), 'ret'),
+                (0x2000, 'vpcmpeqd', bytes.fromhex('C5 F5 76 C2'), 'vpcmpeqd ymm0,ymm1,ymm2'),
+                (0x2004, 'movbe', bytes.fromhex('0F 38 F0 07'), 'movbe eax,DWORD PTR [rdi]')]
+
+def assert_same_result(cached, result, full_stats):
+    assert cached.cached
+    assert cached.num_instructions == result.num_instructions
+    assert cached.extension_requirements == result.extension_requirements
+    assert cached.requirement_counts == result.requirement_counts
+    assert cached.function_requirements == result.function_requirements
+    assert cached.unsupported_inst_encounters == result.unsupported_inst_encounters
+    if full_stats:
+        assert dict(cached.instruction_count) == dict(result.instruction_count)
+
+@pytest.mark.parametrize('full_stats', [False, True])
+def test_round_trip(definitions_raw, tmp_path, full_stats):
+    analyzer = ExtensionAnalyzer(definitions_raw, full_stats=full_stats)
+    result = analyzer.analyze('kernel', instructions, function_map=PartialFunctionMap())
+    assert None in result.function_requirements[('AVX2',)]
+
+    fingerprint = analysis_fingerprint(definitions_file, 'objdump', False)
+    cache = ResultCache(str(tmp_path/'cache.sqlite'))
+    cache.store('sha256:kernel', fingerprint, result, definitions_raw, full_stats=full_stats)
+    cached = cache.lookup('sha256:kernel', fingerprint, 'kernel', definitions_raw, full_stats=full_stats, functions=True)
+    assert_same_result(cached, result, full_stats)
+    assert cache.lookup('sha256:kernel', 'other', 'kernel', definitions_raw) is None
+    if not full_stats:
+        assert cache.lookup('sha256:kernel', fingerprint, 'kernel', definitions_raw, full_stats=True) is None
+
+    assert [path for (path, _, _) in cache.query_requires(['AVX2'])] == [os.path.realpath('kernel')]
+    assert list(cache.query_requires(['AVX512F'])) == []
+    assert [(function, count) for (_, function, _, count, _) in cache.query_functions(['AVX2'])] == [('avx2_kernel', 1), (None, 1)]
+    cache.close()
+
+# Stripped binaries are attributed to the regions of their sections
+def test_stripped_binary_round_trip(definitions_raw, tmp_path):
+    binary = '/bin/true'
+    if not is_elf_x86_64(binary):
+        pytest.skip(f"{binary} isn't a 64 bit x86 ELF file")
+    elf_file = ElfFile(binary)
+    try:
+        if elf_file.section('.symtab') is not None:
+            pytest.skip(f"{binary} isn't stripped")
+    finally:
+        elf_file.close()
+
+    analyzer = ExtensionAnalyzer(definitions_raw, attribute_functions=True)
+    result = analyzer.analyze_file(binary, elf_disassemble)
+    fingerprint = analysis_fingerprint(definitions_file, 'builtin', False)
+    key = binary_key(binary)
+    cache = ResultCache(str(tmp_path/'cache.sqlite'))
+    cache.store(key, fingerprint, result, definitions_raw)
+    assert_same_result(cache.lookup(key, fingerprint, binary, definitions_raw, functions=True), result, False)
+    cache.close()
+
+def test_read_only_cache_of_other_version(tmp_path):
+    cache_file = str(tmp_path/'cache.sqlite')
+    db = sqlite3.connect(cache_file)
+    db.execute("CREATE TABLE results (id INTEGER PRIMARY KEY)")
+    db.execute(f"PRAGMA user_version = {cache_schema_version-1}")
+    db.commit()
+    db.close()
+
+    with pytest.raises(RuntimeError, match='schema version'):
+        ResultCache(cache_file, read_only=True)
+    db = sqlite3.connect(cache_file)
+    assert db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() == [('results',)]
+    db.close()
+
+    # Opening it for writing empties it for this version
+    ResultCache(cache_file).close()
+    ResultCache(cache_file, read_only=True).close()